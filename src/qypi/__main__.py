@@ -1,17 +1,54 @@
+from contextlib import nullcontext
+from itertools import chain
+import json
+import os
+from pathlib import Path
 import click
 from packaging.version import parse
 from . import __version__
-from .api import QyPI, first_upload
+from .api import (
+    CONNECT_TIMEOUT,
+    ENDPOINT,
+    INDEX_POLICIES,
+    READ_TIMEOUT,
+    QyPI,
+    QyPIError,
+    file_record,
+    first_upload,
+    release_record,
+    select_latest,
+    select_versions,
+)
+from .cache import DEFAULT_MAX_SIZE, ResponseCache, default_cache_dir
+from .crawl import Crawler
+from .download import Downloader
+from .hedge import Hedger
+from .index import OfflineIndex, read_documents
+from .latest import LatestIndex
+from .limiter import AdaptiveLimiter
+from .metadata import METADATA_INFO_FIELDS
+from .metrics import Metrics, MetricsExporter
+from .profiling import PROFILERS, Profiler
 from .util import (
+    ByteSize,
     JSONLister,
     JSONMapper,
+    all_opt,
     clean_pypi_dict,
     dumps,
+    fields_opt,
     package_args,
+    parse_ttls,
+    pre_opt,
+    project,
+    sort_opt,
     squish_versions,
+    unordered_opt,
+    where_opt,
 )
+from .watch import Watcher
+from .wheels import best_wheel, has_sdist, supported_tags
 
-ENDPOINT = "https://pypi.org/pypi"
 TRUST_DOWNLOADS = False
 
 SEARCH_SYNONYMS = {
@@ -22,26 +59,340 @@ SEARCH_SYNONYMS = {
     "keyword": "keywords",
 }
 
+#: Filename of the default offline search index within the cache directory
+OFFLINE_INDEX = "offline-index.db"
+
+#: Filename of the latest-version index within the cache directory
+LATEST_INDEX = "latest-index.db"
+
+#: Filename of the default `watch` state file within the cache directory
+WATCH_STATE = "watch-serial"
+
+#: The fields of ``info`` output that are derived from fields of the index's
+#: ``info`` mapping with different names
+INFO_FIELD_SOURCES = {
+    "url": ["home_page"],
+    "people": ["author", "author_email", "maintainer", "maintainer_email"],
+    "project_url": ["project_url", "package_url"],
+    "release_date": [],
+}
+
 
 @click.group(context_settings={"help_option_names": ["-h", "--help"]})
 @click.option(
     "-i",
     "--index-url",
-    default=ENDPOINT,
+    multiple=True,
+    default=[ENDPOINT],
+    metavar="URL",
+    help="Use a different URL for PyPI.  Can be given multiple times.",
+    show_default=True,
+)
+@click.option(
+    "--index-policy",
+    type=click.Choice(INDEX_POLICIES),
+    default="first",
+    help="How to combine results from multiple indexes",
+    show_default=True,
+)
+@click.option(
+    "--cache/--no-cache",
+    default=False,
+    envvar="QYPI_CACHE",
+    help="Cache index responses on disk",
+    show_default=True,
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=default_cache_dir,
+    envvar="QYPI_CACHE_DIR",
+    help="Directory in which to store cached responses",
+    show_default="$XDG_CACHE_HOME/qypi",
+)
+@click.option(
+    "--cache-size",
+    type=ByteSize(),
+    default=DEFAULT_MAX_SIZE,
+    envvar="QYPI_CACHE_SIZE",
+    help="Maximum size of the cache, e.g. 500M",
+    show_default=True,
+)
+@click.option(
+    "--cache-ttl",
+    multiple=True,
+    metavar="KIND=SECONDS",
+    callback=parse_ttls,
+    help="How long cached responses of the given kind stay fresh",
+)
+@click.option(
+    "--stale-while-revalidate",
+    type=click.FloatRange(min=0),
+    default=0,
+    metavar="SECONDS",
+    envvar="QYPI_STALE_WHILE_REVALIDATE",
+    help="Serve cached responses up to SECONDS past their TTL while refreshing"
+    " them in the background",
+    show_default=True,
+)
+@click.option(
+    "--latest-index/--no-latest-index",
+    default=False,
+    envvar="QYPI_LATEST_INDEX",
+    help="Look up latest versions in a local index kept current from the"
+    " index's changelog",
+    show_default=True,
+)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    envvar="QYPI_JOBS",
+    help="Number of packages to look up concurrently",
+    show_default=True,
+)
+@click.option(
+    "--adaptive-jobs/--no-adaptive-jobs",
+    default=False,
+    envvar="QYPI_ADAPTIVE_JOBS",
+    help="Adjust the number of concurrent requests between --min-jobs and"
+    " --jobs according to the index's latency and errors",
+    show_default=True,
+)
+@click.option(
+    "--min-jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="Lowest number of concurrent requests for --adaptive-jobs",
+    show_default=True,
+)
+@click.option(
+    "--pool-size",
+    type=click.IntRange(min=1),
+    help="Maximum number of connections to keep open  [default: max(10, JOBS)]",
+)
+@click.option(
+    "--keep-alive/--no-keep-alive",
+    default=True,
+    help="Reuse connections between requests",
+    show_default=True,
+)
+@click.option(
+    "--connect-timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=CONNECT_TIMEOUT,
+    metavar="SECONDS",
+    help="Timeout for connecting to the index",
+    show_default=True,
+)
+@click.option(
+    "--timeout",
+    type=click.FloatRange(min=0, min_open=True),
+    default=READ_TIMEOUT,
+    metavar="SECONDS",
+    help="Timeout for receiving data from the index",
+    show_default=True,
+)
+@click.option(
+    "--deadline",
+    type=click.FloatRange(min=0, min_open=True),
+    metavar="SECONDS",
+    help="Give up on any requests not finished within this long of startup",
+)
+@click.option(
+    "--hedge/--no-hedge",
+    default=False,
+    help="Send a duplicate of any request that is slower than usual",
+    show_default=True,
+)
+@click.option(
+    "--hedge-url",
     metavar="URL",
-    help="Use a different URL for PyPI",
+    help="Send duplicate requests to this index instead",
+)
+@click.option(
+    "--hedge-percentile",
+    type=click.FloatRange(min=0, max=100, min_open=True),
+    default=95,
+    help="Hedge requests slower than this percentile of recent requests",
+    show_default=True,
+)
+@click.option(
+    "--hedge-max-rate",
+    type=click.FloatRange(min=0, max=1),
+    default=0.1,
+    help="Maximum fraction of requests to hedge",
+    show_default=True,
+)
+@click.option(
+    "--hedge-delay",
+    type=click.FloatRange(min=0),
+    default=1.0,
+    metavar="SECONDS",
+    help="Hedging delay to use until enough requests have been observed",
+    show_default=True,
+)
+@click.option(
+    "--offline-index",
+    type=click.Path(dir_okay=False, path_type=Path),
+    envvar="QYPI_OFFLINE_INDEX",
+    help="Path to the offline search index  [default: offline-index.db in the"
+    " cache directory]",
+)
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Write Prometheus metrics to this file at exit",
+)
+@click.option(
+    "--metrics-interval",
+    type=click.FloatRange(min=0, min_open=True),
+    metavar="SECONDS",
+    help="Also write the metrics file every SECONDS seconds",
+)
+@click.option(
+    "--metrics-port",
+    type=click.IntRange(0, 65535),
+    metavar="PORT",
+    help="Serve Prometheus metrics on localhost:PORT while running",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(list(PROFILERS)),
+    help="Profile the command's CPU or memory usage",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False, writable=True, path_type=Path),
+    help="Where to write the profiling results  [default: qypi.prof or"
+    " qypi.tracemalloc]",
+)
+@click.option(
+    "--profile-top",
+    type=click.IntRange(min=1),
+    default=20,
+    metavar="N",
+    help="Show the top N hot spots on stderr",
+    show_default=True,
+)
+@click.option(
+    "--timings/--no-timings",
+    default=False,
+    help="Report request timings on stderr",
     show_default=True,
 )
 @click.version_option(__version__, "-V", "--version", message="%(prog)s %(version)s")
 @click.pass_context
-def qypi(ctx, index_url):
+def qypi(
+    ctx,
+    index_url,
+    index_policy,
+    cache,
+    cache_dir,
+    cache_size,
+    cache_ttl,
+    stale_while_revalidate,
+    latest_index,
+    jobs,
+    adaptive_jobs,
+    min_jobs,
+    pool_size,
+    keep_alive,
+    connect_timeout,
+    timeout,
+    deadline,
+    hedge,
+    hedge_url,
+    hedge_percentile,
+    hedge_max_rate,
+    hedge_delay,
+    offline_index,
+    metrics_file,
+    metrics_interval,
+    metrics_port,
+    profile,
+    profile_output,
+    profile_top,
+    timings,
+):
     """Query PyPI from the command line"""
-    ctx.obj = QyPI(index_url)
+    if profile is not None:
+        profiler = Profiler(profile, path=profile_output, top=profile_top)
+        profiler.start()
+        # This runs once the command (including any lazily-evaluated lookups)
+        # and `cleanup()` have finished.
+        ctx.call_on_close(profiler.stop)
+    if metrics_interval is not None and metrics_file is None:
+        raise click.UsageError("--metrics-interval requires --metrics-file")
+    if adaptive_jobs and min_jobs > jobs:
+        raise click.UsageError("--min-jobs cannot be greater than --jobs")
+    store = ResponseCache(
+        cache_dir,
+        max_size=cache_size,
+        ttls=cache_ttl,
+        max_stale=stale_while_revalidate,
+    )
+    ctx.meta["qypi.cache"] = store
+    ctx.meta["qypi.offline_index"] = OfflineIndex(
+        offline_index if offline_index is not None else store.path / OFFLINE_INDEX
+    )
+    ctx.obj = QyPI(
+        index_url,
+        cache=store if cache else None,
+        jobs=jobs,
+        pool_size=pool_size,
+        keep_alive=keep_alive,
+        timeout=(connect_timeout, timeout),
+        deadline=deadline,
+        hedger=(
+            Hedger(
+                percentile=hedge_percentile,
+                max_rate=hedge_max_rate,
+                initial_delay=hedge_delay,
+                # Each request to each index may be running in the pool along
+                # with its duplicate; any fewer workers, and time spent
+                # queueing would count towards the hedge delay.
+                max_workers=2 * jobs * len(index_url),
+            )
+            if hedge
+            else None
+        ),
+        hedge_url=hedge_url,
+        timings=timings,
+        index_policy=index_policy,
+        metrics=(
+            Metrics() if metrics_file is not None or metrics_port is not None else None
+        ),
+        latest_index=LatestIndex(store.path / LATEST_INDEX) if latest_index else None,
+        limiter=(
+            AdaptiveLimiter(min_limit=min_jobs, max_limit=jobs)
+            if adaptive_jobs
+            else None
+        ),
+    )
+    if ctx.obj.metrics is not None:
+        exporter = MetricsExporter(
+            ctx.obj.render_metrics,
+            path=metrics_file,
+            interval=metrics_interval,
+            port=metrics_port,
+        )
+        exporter.start()
+        ctx.meta["qypi.metrics"] = exporter
+        # In case the command fails before `cleanup()` runs
+        ctx.call_on_close(exporter.close)
 
 
 @qypi.result_callback()
 @click.pass_context
 def cleanup(ctx, *_args, **_kwargs):
+    # Revalidations' requests should be included in the exported metrics.
+    ctx.obj.finish_revalidating()
+    exporter = ctx.meta.get("qypi.metrics")
+    if exporter is not None:
+        # Export before the cache is closed, which resets its counts
+        exporter.close()
     ctx.obj.cleanup(ctx)
 
 
@@ -58,38 +409,75 @@ def cleanup(ctx, *_args, **_kwargs):
     help="Show download stats",
     show_default=True,
 )
+@click.option(
+    "--simple-metadata/--no-simple-metadata",
+    default=False,
+    help="Look up specific versions' core metadata files via the Simple API",
+    show_default=True,
+)
+@fields_opt
+@where_opt("release")
+@unordered_opt
 @package_args()
-def info(packages, trust_downloads, description):
+@click.pass_obj
+def info(obj, packages, trust_downloads, description, simple_metadata, fields, where):
     """
     Show package details.
 
     Packages can be specified as either ``packagename`` to show the latest
     version or as ``packagename==version`` to show the details for ``version``.
     """
+
+    def wants(field):
+        return fields is None or field in fields
+
+    if fields is not None:
+        # The fields of the index's data needed to produce the output fields
+        sources = [src for f in fields for src in INFO_FIELD_SOURCES.get(f, [f])]
+        if (
+            where is None
+            and "release_date" not in fields
+            and all(src in METADATA_INFO_FIELDS for src in sources)
+        ):
+            # Everything needed is in the releases' core metadata, which is
+            # much smaller than their JSON documents.
+            obj.metadata_only = True
+            obj.simple_metadata = simple_metadata
     with JSONLister() as jlist:
-        for pkg in packages:
-            info = clean_pypi_dict(pkg["info"])
-            if not description:
-                info.pop("description", None)
-            if not trust_downloads:
-                info.pop("downloads", None)
-            info["url"] = info.pop("home_page", None)
-            info["release_date"] = first_upload(pkg["urls"])
-            info["people"] = []
-            for role in ("author", "maintainer"):
-                name = info.pop(role, None)
-                email = info.pop(role + "_email", None)
-                if name or email:
-                    info["people"].append(
-                        {
-                            "name": name,
-                            "email": email,
-                            "role": role,
-                        }
-                    )
+        for spec, pkg in packages:
+            if where is not None and not where(release_record(pkg)):
+                continue
+            if fields is None:
+                info = clean_pypi_dict(pkg["info"])
+                if not description:
+                    info.pop("description", None)
+                if not trust_downloads:
+                    info.pop("downloads", None)
+            else:
+                info = clean_pypi_dict(project(pkg["info"], sources))
+            if wants("url"):
+                info["url"] = info.pop("home_page", None)
+            if wants("release_date"):
+                info["release_date"] = first_upload(pkg["urls"])
+            if wants("people"):
+                info["people"] = []
+                for role in ("author", "maintainer"):
+                    name = info.pop(role, None)
+                    email = info.pop(role + "_email", None)
+                    if name or email:
+                        info["people"].append(
+                            {
+                                "name": name,
+                                "email": email,
+                                "role": role,
+                            }
+                        )
             if "package_url" in info and "project_url" not in info:
                 # Field was renamed between PyPI Legacy and Warehouse
                 info["project_url"] = info.pop("package_url")
+            info = project(info, fields)
+            if obj.unordered:
+                info = dict(info, spec=spec)
             jlist.append(info)
 
 
@@ -106,34 +494,48 @@ def readme(packages):
     version or as ``packagename==version`` to show the long description for
     ``version``.
     """
-    for pkg in packages:
+    for _, pkg in packages:
         click.echo_via_pager(pkg["info"]["description"])
 
 
 @qypi.command()
+@fields_opt
+@where_opt("release")
+@unordered_opt
 @package_args(versioned=False)
-def releases(packages):
+@click.pass_obj
+def releases(obj, packages, fields, where):
     """List released package versions"""
+
+    def wants(field):
+        return (
+            fields is None
+            or field in fields
+            or (where is not None and field in where.fields)
+        )
+
     with JSONMapper() as jmap:
-        for pkg in packages:
+        for spec, pkg in packages:
             try:
                 project_url = pkg["info"]["project_url"]
             except KeyError:
                 project_url = pkg["info"]["package_url"]
             if not project_url.endswith("/"):
                 project_url += "/"
-            jmap.append(
-                pkg["info"]["name"],
-                [
-                    {
-                        "version": version,
-                        "is_prerelease": parse(version).is_prerelease,
-                        "release_date": first_upload(pkg["releases"][version]),
-                        "release_url": project_url + version,
-                    }
-                    for version in sorted(pkg["releases"], key=parse)
-                ],
-            )
+            rels = []
+            for version in sorted(pkg["releases"], key=parse):
+                rel = {}
+                if wants("version"):
+                    rel["version"] = version
+                if wants("is_prerelease"):
+                    rel["is_prerelease"] = parse(version).is_prerelease
+                if wants("release_date"):
+                    rel["release_date"] = first_upload(pkg["releases"][version])
+                if wants("release_url"):
+                    rel["release_url"] = project_url + version
+                if where is None or where(rel):
+                    rels.append(project(rel, fields))
+            jmap.append(spec if obj.unordered else pkg["info"]["name"], rels)
 
 
 @qypi.command()
@@ -143,8 +545,12 @@ def releases(packages):
     help="Show download stats",
     show_default=True,
 )
+@fields_opt
+@where_opt("file")
+@unordered_opt
 @package_args()
-def files(packages, trust_downloads):
+@click.pass_obj
+def files(obj, packages, trust_downloads, fields, where):
     """
     List files available for download.
 
@@ -153,27 +559,181 @@ def files(packages, trust_downloads):
     ``version``.
     """
     with JSONLister() as jlist:
-        for pkg in packages:
+        for spec, pkg in packages:
+            name = pkg["info"]["name"]
+            version = pkg["info"]["version"]
             pkgfiles = pkg["urls"]
-            for pf in pkgfiles:
-                if not trust_downloads:
-                    pf.pop("downloads", None)
-                pf.pop("path", None)
+            if where is not None:
+                pkgfiles = [
+                    pf for pf in pkgfiles if where(file_record(name, version, pf))
+                ]
+                if not pkgfiles:
+                    continue
+            if fields is None:
+                # The documents are shared with other lookups, so copy the
+                # files rather than modifying them.
+                dropped = {"path"} if trust_downloads else {"path", "downloads"}
+                pkgfiles = [
+                    {k: v for k, v in pf.items() if k not in dropped} for pf in pkgfiles
+                ]
                 ### TODO: Change empty comment_text fields to None?
-            jlist.append(
-                {
-                    "name": pkg["info"]["name"],
-                    "version": pkg["info"]["version"],
-                    "files": pkgfiles,
+            else:
+                pkgfiles = [project(pf, fields) for pf in pkgfiles]
+            record = {"name": name, "version": version, "files": pkgfiles}
+            if obj.unordered:
+                record["spec"] = spec
+            jlist.append(record)
+
+
+@qypi.command()
+@click.option(
+    "-d",
+    "--dest",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=".",
+    help="Directory in which to save the files",
+    show_default=True,
+)
+@where_opt("file")
+@package_args()
+@click.pass_obj
+def download(obj, packages, dest, where):
+    """
+    Download release files.
+
+    Downloads all of the files (or, with ``--where``, the matching files) for
+    the given package releases, which are specified the same way as for
+    ``files``.  Up to ``--jobs`` files are downloaded at once.  Each file's
+    SHA256 digest is verified, interrupted downloads are resumed, and files
+    that are already present with the right digest are skipped.
+    """
+    todo = {}
+    for _, pkg in packages:
+        name = pkg["info"]["name"]
+        version = pkg["info"]["version"]
+        for pf in pkg["urls"]:
+            if where is None or where(file_record(name, version, pf)):
+                todo.setdefault(pf["filename"], pf)
+    downloader = Downloader(obj, dest)
+
+    def fetch(pf):
+        try:
+            return downloader.download(pf), None
+        except QyPIError as e:
+            return None, e
+
+    with JSONLister() as jlist:
+        for result, e in obj.map(fetch, todo.values()):
+            if e is None:
+                jlist.append(result)
+            else:
+                obj.errmsgs.append(str(e))
+
+
+def parse_targets(_ctx, param, value):
+    targets = []
+    for t in value:
+        try:
+            supported_tags(t)
+        except ValueError as e:
+            raise click.BadParameter(str(e), param=param) from None
+        if t not in targets:
+            targets.append(t)
+    return targets
+
+
+@qypi.command()
+@click.option(
+    "-t",
+    "--target",
+    "targets",
+    multiple=True,
+    required=True,
+    metavar="cpXY-PLATFORM",
+    callback=parse_targets,
+    help="Check for wheels installable on the given Python version & platform."
+    "  Can be given multiple times.",
+)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["json", "table"]),
+    default="json",
+    help="Output format",
+    show_default=True,
+)
+@all_opt
+@sort_opt
+@pre_opt
+@package_args(versioned=False)
+@click.pass_obj
+def wheels(obj, packages, targets, fmt):
+    """
+    Show which releases have wheels for which platforms.
+
+    For each package's latest version (or every version, with
+    ``--all-versions``), shows the wheel that an installer would pick for
+    each target, or null if there is none, along with whether the release
+    has an sdist.  Targets are given as a CPython version and the newest
+    platform tag the target supports, e.g., ``cp312-manylinux_2_28_aarch64``,
+    ``cp311-win_amd64``, or ``cp313-macosx_14_0_arm64``.
+    """
+    rows = []
+    with JSONLister() if fmt == "json" else nullcontext() as jlist:
+        for _, pkg in packages:
+            name = pkg["info"]["name"]
+            if obj.all_versions:
+                versions = select_versions(pkg, pre=obj.pre)
+            else:
+                latest = select_latest(pkg, pre=obj.pre, newest=obj.newest)
+                if latest is None:
+                    obj.errmsgs.append(name + ": no suitable versions available")
+                    continue
+                versions = [latest]
+            for v in versions:
+                files = pkg["releases"][v]
+                row = {
+                    "name": name,
+                    "version": v,
+                    "sdist": has_sdist(files),
+                    "wheels": {t: best_wheel(files, t) for t in targets},
                 }
-            )
+                if jlist is not None:
+                    jlist.append(row)
+                else:
+                    rows.append(row)
+    if fmt == "table":
+        click.echo(wheel_table(rows, targets), nl=False)
+
+
+def wheel_table(rows, targets):
+    """
+    Format the rows of ``wheels`` output as a table with a column per target
+    showing whether each release has a wheel or just an sdist for it
+    """
+    table = [["NAME", "VERSION", *targets]]
+    for r in rows:
+        cells = [r["name"], r["version"]]
+        for t in targets:
+            if r["wheels"][t] is not None:
+                cells.append("wheel")
+            elif r["sdist"]:
+                cells.append("sdist")
+            else:
+                cells.append("-")
+        table.append(cells)
+    widths = [max(map(len, col)) for col in zip(*table)]
+    return "".join(
+        "  ".join(c.ljust(w) for c, w in zip(cells, widths)).rstrip() + "\n"
+        for cells in table
+    )
 
 
 @qypi.command("list")
 @click.pass_obj
 def listcmd(obj):
     """List all packages on PyPI"""
-    for pkg in obj.xmlrpc("list_packages"):
+    for pkg in obj.list_packages():
         click.echo(pkg)
 
 
@@ -192,9 +752,16 @@ def listcmd(obj):
     default=False,
     help="Show one result per package/per release" " [default: per release]",
 )
+@click.option(
+    "--offline/--online",
+    default=False,
+    help="Search the offline index instead of querying the package index"
+    "  [default: online]",
+)
+@fields_opt
 @click.argument("terms", nargs=-1, required=True)
-@click.pass_obj
-def search(obj, terms, oper, packages):
+@click.pass_context
+def search(ctx, terms, oper, packages, offline, fields):
     """
     Search PyPI for packages or releases thereof.
 
@@ -210,10 +777,19 @@ def search(obj, terms, oper, packages):
             key = SEARCH_SYNONYMS.get(key, key)
         # ServerProxy can't handle defaultdicts, so we can't use those instead.
         spec.setdefault(key, []).append(value)
-    results = map(clean_pypi_dict, obj.xmlrpc("search", spec, oper))
+    if offline:
+        index = ctx.meta["qypi.offline_index"]
+        try:
+            results = index.search(spec, oper)
+        except QyPIError as e:
+            raise click.UsageError(str(e))
+        finally:
+            index.close()
+    else:
+        results = ctx.obj.xmlrpc("search", spec, oper)
     if packages:
         results = squish_versions(results)
-    click.echo(dumps(results))
+    click.echo(dumps(clean_pypi_dict(project(r, fields)) for r in results))
 
 
 @qypi.command()
@@ -224,9 +800,16 @@ def search(obj, terms, oper, packages):
     default=False,
     help="Show one result per package/per release" " [default: per release]",
 )
+@click.option(
+    "--offline/--online",
+    default=False,
+    help="Use the offline index instead of querying the package index"
+    "  [default: online]",
+)
+@fields_opt
 @click.argument("classifiers", nargs=-1)
-@click.pass_obj
-def browse(obj, classifiers, file, packages):
+@click.pass_context
+def browse(ctx, classifiers, file, packages, offline, fields):
     """
     List packages with given trove classifiers.
 
@@ -236,45 +819,329 @@ def browse(obj, classifiers, file, packages):
     """
     if file is not None:
         classifiers += tuple(map(str.strip, file))
-    results = [
-        {"name": name, "version": version or None}
-        for name, version in obj.xmlrpc("browse", classifiers)
-    ]
-    if packages:
-        results = squish_versions(results)
-    click.echo(dumps(results))
+    if offline:
+        # The offline index has one entry per project, so there's nothing to
+        # squish.
+        index = ctx.meta["qypi.offline_index"]
+        try:
+            results = index.browse(classifiers)
+        except QyPIError as e:
+            raise click.UsageError(str(e))
+        finally:
+            index.close()
+    else:
+        results = [
+            {"name": name, "version": version or None}
+            for name, version in ctx.obj.xmlrpc("browse", classifiers)
+        ]
+        if packages:
+            results = squish_versions(results)
+    click.echo(dumps(project(r, fields) for r in results))
 
 
 @qypi.command()
+@unordered_opt
 @click.argument("packages", nargs=-1)
 @click.pass_obj
 def owner(obj, packages):
     """List package owners & maintainers"""
     with JSONMapper() as jmap:
-        for pkg in packages:
-            jmap.append(
-                pkg,
-                [
-                    {"role": role, "user": user}
-                    for role, user in obj.xmlrpc("package_roles", pkg)
-                ],
-            )
+        for pkg, roles in obj.map(
+            lambda p: (p, obj.xmlrpc("package_roles", p)), packages
+        ):
+            jmap.append(pkg, [{"role": role, "user": user} for role, user in roles])
 
 
 @qypi.command()
+@unordered_opt
 @click.argument("users", nargs=-1)
 @click.pass_obj
 def owned(obj, users):
     """List packages owned/maintained by a user"""
     with JSONMapper() as jmap:
-        for u in users:
-            jmap.append(
-                u,
-                [
-                    {"role": role, "package": pkg}
-                    for role, pkg in obj.xmlrpc("user_packages", u)
-                ],
-            )
+        for u, pkgs in obj.map(lambda u: (u, obj.xmlrpc("user_packages", u)), users):
+            jmap.append(u, [{"role": role, "package": pkg} for role, pkg in pkgs])
+
+
+@qypi.command()
+@click.option(
+    "-f",
+    "--file",
+    type=click.File("r"),
+    help="Read further packages from the given file ('-' for stdin)",
+)
+@all_opt
+@sort_opt
+@pre_opt
+@click.argument("specs", nargs=-1)
+@click.pass_obj
+def prefetch(obj, specs, file):
+    """
+    Populate the response cache ahead of time.
+
+    Fetches every document that ``info``, ``files``, ``readme``, or
+    ``releases`` would need for the given packages, which can be specified
+    the same way as for those commands, one per line in a file, or both.
+    Progress is reported on stderr.
+    """
+    if obj.cache is None:
+        raise click.UsageError("prefetch requires caching to be enabled with --cache")
+    if file is not None:
+        specs += tuple(
+            line.strip() for line in file if line.strip() and not line.startswith("#")
+        )
+    bytes_before = obj.bytes_received
+    documents = 0
+    for i, (spec, (n, e)) in enumerate(
+        zip(specs, obj.map(obj.prefetch, specs)), start=1
+    ):
+        documents += n
+        status = "ok" if e is None else "error"
+        click.echo(f"[{i}/{len(specs)}] {spec}: {status}", err=True)
+        if e is not None:
+            obj.errmsgs.append(str(e))
+    click.echo(
+        dumps(
+            {
+                "packages": len(specs),
+                "documents": documents,
+                "bytes_received": obj.bytes_received - bytes_before,
+            }
+        )
+    )
+
+
+@qypi.command()
+@click.option(
+    "-f",
+    "--file",
+    type=click.File("r"),
+    help="Read further packages to watch from the given file ('-' for stdin)",
+)
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False, path_type=Path),
+    help="File in which to store the last serial seen  [default: watch-serial in"
+    " the cache directory]",
+)
+@click.option(
+    "--since",
+    type=click.IntRange(min=0),
+    metavar="SERIAL",
+    help="Report changes after SERIAL instead of after the stored serial",
+)
+@click.option(
+    "--invalidate/--no-invalidate",
+    default=False,
+    help="Delete changed packages' documents from the response cache",
+    show_default=True,
+)
+@click.option(
+    "--all-events",
+    is_flag=True,
+    help="Also report changes other than releases, files, and removals",
+)
+@click.option(
+    "--follow",
+    is_flag=True,
+    help="Keep polling for changes until interrupted",
+)
+@click.option(
+    "--interval",
+    type=click.FloatRange(min=0, min_open=True),
+    default=60,
+    metavar="SECONDS",
+    help="Time between polls when following",
+    show_default=True,
+)
+@click.argument("packages", nargs=-1)
+@click.pass_context
+def watch(
+    ctx, packages, file, state_file, since, invalidate, all_events, follow, interval
+):
+    """
+    Report changes to the index as they happen.
+
+    Each new release, file upload, or removal since the last run (as recorded
+    in the state file) is output as a line of JSON.  If any packages are
+    given, on the command line or in a file, only changes to those packages
+    are reported.  On the first run, nothing is reported; the index's current
+    serial is just recorded for next time.
+    """
+    if file is not None:
+        packages += tuple(
+            line.strip() for line in file if line.strip() and not line.startswith("#")
+        )
+    store = ctx.meta["qypi.cache"]
+    watcher = Watcher(
+        ctx.obj,
+        state_file if state_file is not None else store.path / WATCH_STATE,
+        watchlist=packages or None,
+        cache=store if invalidate else None,
+        all_events=all_events,
+    )
+    watcher.run(
+        lambda ev: click.echo(json.dumps(ev, sort_keys=True)),
+        since=since,
+        follow=follow,
+        interval=interval,
+    )
+
+
+def parse_shard(_ctx, param, value):
+    k, slash, n = value.partition("/")
+    try:
+        if not slash:
+            raise ValueError(value)
+        k, n = int(k), int(n)
+    except ValueError:
+        raise click.BadParameter(f"{value!r}: expected K/N", param=param) from None
+    if not 1 <= k <= n:
+        raise click.BadParameter(f"{value!r}: K must be between 1 and N", param=param)
+    return (k, n)
+
+
+@qypi.command()
+@click.option(
+    "-f",
+    "--names-file",
+    type=click.File("r"),
+    help="Read project names from the given file instead of listing the index",
+)
+@click.option(
+    "-o",
+    "--output-dir",
+    type=click.Path(file_okay=False, path_type=Path),
+    default=".",
+    help="Directory in which to write output & checkpoints",
+    show_default=True,
+)
+@click.option(
+    "--shard",
+    default="1/1",
+    metavar="K/N",
+    callback=parse_shard,
+    help="Only crawl the K-th of N deterministic partitions of the projects",
+    show_default=True,
+)
+@click.option(
+    "-P",
+    "--processes",
+    type=click.IntRange(min=1),
+    default=os.cpu_count,
+    help="Number of worker processes  [default: number of CPUs]",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    help="Number of projects per output file",
+    show_default=True,
+)
+@click.pass_obj
+def crawl(obj, names_file, output_dir, shard, processes, batch_size):
+    """
+    Dump metadata for every project on the index.
+
+    The project JSON documents for all projects listed by ``qypi list`` (or
+    in the file given with ``--names-file``) in the selected shard are written
+    as gzipped JSON Lines files to the output directory.  Progress is
+    checkpointed, so an interrupted crawl can be resumed by running the same
+    command again.
+    """
+    if names_file is not None:
+        names = [line.strip() for line in names_file if line.strip()]
+    else:
+        names = obj.list_packages()
+    k, n = shard
+    crawler = Crawler(
+        obj,
+        output_dir,
+        shard=k,
+        shards=n,
+        processes=processes,
+        batch_size=batch_size,
+    )
+    stats = crawler.run(
+        names,
+        progress=lambda done, total: click.echo(
+            f"[crawl {k}/{n}] {done}/{total} projects", err=True
+        ),
+    )
+    click.echo(dumps(stats))
+
+
+@qypi.group("cache")
+@click.pass_context
+def cachecmd(ctx):
+    """
+    Manage the local response cache.
+
+    These commands operate on the cache directory even if ``--cache`` is not
+    given.
+    """
+    ctx.obj = ctx.meta["qypi.cache"]
+
+
+@cachecmd.command("stats")
+@click.pass_obj
+def cache_stats(cache):
+    """Show cache size, entry counts, and hit rates"""
+    click.echo(dumps(cache.stats()))
+
+
+@cachecmd.command("prune")
+@click.pass_obj
+def cache_prune(cache):
+    """Delete expired entries and shrink the cache to its maximum size"""
+    removed, freed = cache.prune()
+    click.echo(dumps({"removed": removed, "freed": freed}))
+
+
+@cachecmd.command("clear")
+@click.pass_obj
+def cache_clear(cache):
+    """Delete all cached responses and statistics"""
+    removed, freed = cache.clear()
+    click.echo(dumps({"removed": removed, "freed": freed}))
+
+
+@qypi.group("index")
+def indexcmd():
+    """Manage the offline search index"""
+    pass
+
+
+@indexcmd.command("build")
+@click.option(
+    "--from-cache",
+    is_flag=True,
+    help="Include the project documents in the response cache",
+)
+@click.argument("sources", nargs=-1, type=click.Path(exists=True, path_type=Path))
+@click.pass_context
+def index_build(ctx, sources, from_cache):
+    """
+    Build the offline search index.
+
+    The index is built from JSON Lines files of project documents (such as
+    those written by ``qypi crawl``), directories containing such files,
+    and/or (with ``--from-cache``) the project documents in the response
+    cache.  Any existing index is replaced.
+    """
+    if not sources and not from_cache:
+        raise click.UsageError("No sources given")
+    documents = read_documents(sources)
+    if from_cache:
+        cached = (
+            json.loads(entry.body)
+            for entry in ctx.meta["qypi.cache"].entries("project")
+            if entry.status == 200
+        )
+        documents = chain(documents, cached)
+    click.echo(
+        dumps(OfflineIndex.build(ctx.meta["qypi.offline_index"].path, documents))
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,225 @@
+import asyncio
+from collections import OrderedDict
+from functools import partial
+from packaging.utils import canonicalize_name
+from .api import (
+    CONNECT_TIMEOUT,
+    ENDPOINT,
+    MEMO_SIZE,
+    READ_TIMEOUT,
+    USER_AGENT,
+    QyPIError,
+    select_latest,
+    select_versions,
+)
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover
+    httpx = None
+
+
+class AsyncQyPI:
+    """
+    An asyncio counterpart to `QyPI`'s JSON API lookups, with the same
+    version-selection semantics.  Requires ``httpx``, which can be installed
+    via the ``async`` extra.  All requests go through a single
+    `httpx.AsyncClient` with a pool of up to ``max_connections`` connections,
+    so any number of lookups can run concurrently on one event loop.
+
+    As with `QyPI`, concurrent requests for the same document are coalesced
+    into a single request, and the ``memo_size`` most recently used documents
+    are kept for reuse; failed requests are retried the next time the
+    document is needed.  An instance must only be used from
+    one event loop, and it should be used as an async context manager (or
+    closed with `aclose()`) in order to release its connections.
+    """
+
+    def __init__(
+        self,
+        index_url=ENDPOINT,
+        max_connections=100,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        pre=False,
+        newest=False,
+        all_versions=False,
+        transport=None,
+        memo_size=MEMO_SIZE,
+    ):
+        if httpx is None:
+            raise ImportError(
+                "AsyncQyPI requires httpx; install it with `pip install qypi[async]`"
+            )
+        self.index_url = index_url
+        self.max_connections = max_connections
+        #: A ``(connect, read)`` pair of timeouts in seconds
+        self.timeout = timeout
+        self.pre = pre
+        self.newest = newest
+        self.all_versions = all_versions
+        #: An `httpx.AsyncBaseTransport` to use instead of the network
+        self.transport = transport
+        self.memo_size = memo_size
+        self.client = None
+        self.errmsgs = []
+        #: Tasks for the documents currently being fetched, by canonicalized
+        #: path
+        self.fetching = {}
+        #: The most recently used documents, by canonicalized path
+        self.documents = OrderedDict()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, _exc_type, _exc_value, _traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def make_client(self):
+        connect, read = self.timeout
+        return httpx.AsyncClient(
+            headers={"User-Agent": USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+            ),
+            timeout=httpx.Timeout(read, connect=connect),
+            transport=self.transport,
+        )
+
+    async def get_json(self, *path):
+        """
+        Fetch & decode the JSON document at ``path`` (a project name followed
+        by zero or more further path components) on the index.  Returns `None`
+        if the document does not exist.
+        """
+        project, *rest = path
+        key = "/".join([canonicalize_name(project), *rest])
+        if key in self.documents:
+            self.documents.move_to_end(key)
+            return self.documents[key]
+        task = self.fetching.get(key)
+        if task is None:
+            task = self.fetching[key] = asyncio.ensure_future(self._get_json(path))
+            task.add_done_callback(partial(self._finish, key))
+        # Don't let one caller's cancellation cancel the request for everyone
+        # else.
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        if self.fetching.get(key) is not task:
+            # The document was forgotten while it was being fetched.
+            return
+        del self.fetching[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        if self.memo_size > 0:
+            self.documents[key] = task.result()
+            if len(self.documents) > self.memo_size:
+                self.documents.popitem(last=False)
+
+    async def _get_json(self, path):
+        if self.client is None:
+            self.client = self.make_client()
+        url = self.index_url.rstrip("/") + "/" + "/".join(path)
+        try:
+            r = await self.client.get(url)
+        except httpx.TimeoutException as e:
+            raise QyPIError(f"{url}: request timed out") from e
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r.json()
+
+    def forget(self, package, version=None):
+        """
+        Discard the stored documents for ``package`` (or just for the given
+        version of it) so that they can be garbage-collected
+        """
+        path = [canonicalize_name(package)]
+        if version is not None:
+            path.append(version)
+        key = "/".join([*path, "json"])
+        self.fetching.pop(key, None)
+        self.documents.pop(key, None)
+
+    async def get_package(self, package):
+        pkg = await self.get_json(package, "json")
+        if pkg is None:
+            raise QyPIError(package + ": package not found")
+        return pkg
+
+    async def get_version(self, package, version):
+        pkg = await self.get_json(package, version, "json")
+        if pkg is None:
+            raise QyPIError(f"{package}: version {version} not found")
+        return pkg
+
+    async def get_latest_version(self, package):
+        pkg = await self.get_package(package)
+        latest = select_latest(pkg, pre=self.pre, newest=self.newest)
+        if latest is None:
+            raise QyPIError(package + ": no suitable versions available")
+        if pkg["info"]["version"] == latest:
+            return pkg
+        else:
+            return await self.get_version(package, latest)
+
+    async def resolve_spec(self, spec):
+        """
+        Return a list of the version documents for a ``name`` or
+        ``name==version`` spec in accordance with the ``pre``, ``newest``, and
+        ``all_versions`` settings
+        """
+        name, eq, version = spec.partition("=")
+        if eq != "":
+            return [await self.get_version(name, version.lstrip("="))]
+        elif self.all_versions:
+            p = await self.get_package(name)
+            versions = select_versions(p, pre=self.pre)
+            fetched = iter(
+                await asyncio.gather(
+                    *(
+                        self.get_version(name, v)
+                        for v in versions
+                        if v != p["info"]["version"]
+                    )
+                )
+            )
+            return [p if v == p["info"]["version"] else next(fetched) for v in versions]
+        else:
+            return [await self.get_latest_version(name)]
+
+    async def lookup_package(self, args):
+        """
+        Look up the project documents for the package names in ``args``
+        concurrently, yielding them in order.  Errors are appended to
+        `errmsgs`.
+        """
+        async for doc in self._lookup(self.get_package, args):
+            yield doc
+
+    async def lookup_package_version(self, args):
+        """
+        Look up the version documents for the specs in ``args`` concurrently,
+        yielding them in order.  Errors are appended to `errmsgs`.
+        """
+        async for docs in self._lookup(self.resolve_spec, args):
+            for doc in docs:
+                yield doc
+
+    async def _lookup(self, func, args):
+        tasks = [asyncio.ensure_future(func(a)) for a in args]
+        try:
+            for t in tasks:
+                try:
+                    yield await t
+                except QyPIError as e:
+                    self.errmsgs.append(str(e))
+        finally:
+            for t in tasks:
+                t.cancel()
@@ -1,9 +1,29 @@
+from collections import ChainMap, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import partial
+import hashlib
+import json
 import platform
-from xmlrpc.client import ServerProxy
+import threading
+import time
+from time import monotonic
+from urllib.parse import urljoin
+from xmlrpc.client import Error as XMLRPCError
+from xmlrpc.client import Fault as XMLRPCFault
+from xmlrpc.client import ProtocolError, SafeTransport, ServerProxy, Transport
 import click
+from packaging.utils import canonicalize_name
 from packaging.version import parse
 import requests
+from requests.adapters import HTTPAdapter
 from . import __url__, __version__
+from .metadata import (
+    SIMPLE_JSON,
+    metadata_digest,
+    metadata_files,
+    parse_core_metadata,
+    simple_url,
+)
 
 USER_AGENT = "qypi/{} ({}) requests/{} {}/{}".format(
     __version__,
@@ -13,101 +33,863 @@ USER_AGENT = "qypi/{} ({}) requests/{} {}/{}".format(
     platform.python_version(),
 )
 
+#: The default package index
+ENDPOINT = "https://pypi.org/pypi"
+
+#: Default number of seconds to wait for a connection to the index
+CONNECT_TIMEOUT = 10
+
+#: Default number of seconds to wait for the index to send data
+READ_TIMEOUT = 60
+
+
+#: Number of decoded documents and other lookup results to keep in memory for
+#: reuse within a session
+MEMO_SIZE = 256
+
+#: The XML-RPC methods whose results are cached, mapped to the kinds of cache
+#: entries (and thus the TTLs) used for them.  The changelog methods are
+#: deliberately absent, as their callers need the index's current state.
+XMLRPC_CACHE_KINDS = {
+    "list_packages": "list",
+    "package_roles": "roles",
+    "user_packages": "roles",
+    "browse": "browse",
+    "search": "search",
+}
+
+#: How to combine the responses from multiple indexes: use the first index in
+#: priority order that has the document, use whichever index with the document
+#: responds first, or combine the ``releases`` of all indexes with the
+#: document
+INDEX_POLICIES = ("first", "fastest", "merge")
+
 
 class QyPI:
-    def __init__(self, index_url):
-        self.index_url = index_url
+    def __init__(
+        self,
+        index_urls,
+        cache=None,
+        jobs=1,
+        pool_size=None,
+        keep_alive=True,
+        timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+        deadline=None,
+        hedger=None,
+        hedge_url=None,
+        timings=False,
+        index_policy="first",
+        metrics=None,
+        latest_index=None,
+        limiter=None,
+    ):
+        if isinstance(index_urls, str):
+            index_urls = [index_urls]
+        #: The indexes to query, in priority order
+        self.index_urls = list(index_urls)
+        self.index_policy = index_policy
+        self.cache = cache
+        self.jobs = jobs
+        #: Maximum number of connections to keep open to the index; defaults
+        #: to enough for ``jobs`` concurrent requests
+        self.pool_size = pool_size if pool_size is not None else max(jobs, 10)
+        self.keep_alive = keep_alive
+        #: A ``(connect, read)`` pair of timeouts in seconds
+        self.timeout = timeout
+        #: The `monotonic()` time by which the session must be finished, or
+        #: `None` for no limit
+        self.deadline = monotonic() + deadline if deadline is not None else None
+        #: A `Hedger` to send requests through, or `None` to not hedge requests
+        self.hedger = hedger
+        #: An alternative index URL to send hedged requests to
+        self.hedge_url = hedge_url
+        #: Whether to report request timings on stderr
+        self.timings = timings
+        #: A `Metrics` instance to record requests in, or `None`
+        self.metrics = metrics
+        #: A `LatestIndex` for looking up projects' latest versions without
+        #: fetching their project documents, or `None`
+        self.latest_index = latest_index
+        #: An `AdaptiveLimiter` for the number of requests in flight, or
+        #: `None` to only be limited by ``jobs``
+        self.limiter = limiter
         self.s = None
-        self.xsp = None
+        # XML-RPC proxies can't be shared between threads, so each thread
+        # gets its own.
+        self._local = threading.local()
         self.pre = False
         self.newest = False
         self.all_versions = False
+        #: Whether version documents may be built from just the releases'
+        #: core metadata files (see `get_core_metadata()`)
+        self.metadata_only = False
+        #: Whether `get_core_metadata()` may fetch projects' Simple API pages
+        #: that aren't already in the response cache
+        self.simple_metadata = False
+        #: Whether `map()` should return results in order of completion
+        #: rather than in order of arguments
+        self.unordered = False
+        #: A `Where` filter for the results of the current command, or `None`
+        self.where = None
+        #: Whether `where` applies to releases (``"release"``) or to their
+        #: files (``"file"``)
+        self.where_level = "release"
         self.errmsgs = []
+        #: Cache keys of documents that the index has reported as not existing
+        #: during this session
+        self.missing = set()
+        self.flights = SingleFlight()
+        self.executor = None
+        self.fanout = None
+        #: Thread pool for revalidating stale cache entries in the background
+        self.refresher = None
+        #: Cache keys currently being revalidated
+        self.revalidating = set()
+        #: Number of stale cache entries served
+        self.stale_hits = 0
+        #: Total size of the response bodies received from the index
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Sessions, connections, thread pools, and locks can't be sent to
+        # other processes, so they are recreated on demand afterwards.
+        state = self.__dict__.copy()
+        for attr in ("s", "executor", "fanout", "refresher"):
+            state[attr] = None
+        state["revalidating"] = set()
+        del state["flights"]
+        del state["_lock"]
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.flights = SingleFlight()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def index_url(self):
+        """The primary index, used for XML-RPC requests"""
+        return self.index_urls[0]
+
+    def session(self):
+        """Return the HTTP session, creating it if necessary"""
+        with self._lock:
+            if self.s is None:
+                self.s = self.make_session()
+        return self.s
+
+    def get(self, *path, base=None):
+        if base is None:
+            base = self.index_url
+        url = base.rstrip("/") + "/" + "/".join(path)
+        alt = None
+        # The hedge URL mirrors the primary index; requests to any other index
+        # are duplicated to that index itself.
+        if self.hedge_url is not None and base == self.index_url:
+            alt = self.hedge_url.rstrip("/") + "/" + "/".join(path)
+        return self.get_url(url, alt=alt)
+
+    def get_url(self, url, alt=None, headers=None):
+        """
+        Perform a GET request for ``url``.  If requests are being hedged, the
+        duplicate request is sent to ``alt`` (default: ``url``).  Only a
+        successful (2xx) response to the duplicate is used; anything else
+        (such as a 404 from a mirror that lags behind the index) defers to the
+        response to ``url``, so that "not found" results are only ever
+        recorded on the index's own word.
+        """
+        self.session()
+        start = monotonic()
+        try:
+            if self.hedger is None:
+                r, how = self.request(url, headers), "direct"
+            else:
+                r, how = self.hedger.call(
+                    partial(self.request, url, headers),
+                    partial(self.request, alt if alt is not None else url, headers),
+                    accept=lambda r: 200 <= r.status_code < 300,
+                )
+        except (QyPIError, requests.RequestException) as e:
+            if self.metrics is not None:
+                self.metrics.observe(
+                    "json",
+                    "timeout" if isinstance(e, QyPIError) else "error",
+                    monotonic() - start,
+                )
+            raise
+        with self._lock:
+            self.bytes_received += len(r.content)
+        if self.metrics is not None:
+            self.metrics.observe(
+                "json",
+                r.status_code,
+                monotonic() - start,
+                bytes_in=len(r.content),
+                bytes_out=request_size(r.request),
+            )
+        self.log_timing(
+            f"GET {r.url} {r.status_code} {monotonic() - start:.3f}s"
+            + (f" {how}" if how != "direct" else "")
+        )
+        return r
+
+    def request(self, url, headers=None):
+        # Computed up front so that running past the deadline doesn't count
+        # against the concurrency limit
+        timeout = self.request_timeout()
+        try:
+            if self.limiter is None:
+                return self.s.get(url, headers=headers, timeout=timeout)
+            return self.limiter.call(
+                partial(self.s.get, url, headers=headers, timeout=timeout),
+                lambda r: is_overloaded(r.status_code),
+            )
+        except requests.Timeout as e:
+            raise QyPIError(f"{url}: request timed out") from e
+
+    def log_timing(self, msg):
+        if self.timings:
+            click.echo("[timings] " + msg, err=True)
+
+    def make_session(self):
+        s = requests.Session()
+        s.headers["User-Agent"] = USER_AGENT
+        if not self.keep_alive:
+            s.headers["Connection"] = "close"
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size
+        )
+        s.mount("https://", adapter)
+        s.mount("http://", adapter)
+        return s
+
+    def request_timeout(self):
+        """
+        Return the ``(connect, read)`` timeouts to use for the next request,
+        shortened as needed to not run past the deadline.  Raises a
+        `QyPIError` if the deadline has already passed.
+        """
+        if self.deadline is None:
+            return self.timeout
+        remaining = self.deadline - monotonic()
+        if remaining <= 0:
+            raise QyPIError("deadline exceeded")
+        return tuple(min(t, remaining) for t in self.timeout)
+
+    def get_json(self, kind, *path):
+        """
+        Fetch & decode the JSON document at ``path`` (a project name followed
+        by zero or more further path components) on the index, going through
+        the response cache if there is one.  Returns `None` if the document
+        does not exist.
+
+        "Not found" results are cached as well, both for the rest of the
+        session and (with a short TTL) in the response cache.
+
+        Concurrent and repeated requests for the same document (after
+        canonicalizing the project name) are coalesced into a single request,
+        and the decoded result is shared between all callers.  The most
+        recently used `MEMO_SIZE` results are kept for reuse later in the
+        session; callers must not modify them.
+        """
+        key = self.cache_key(*path)
+        return self.flights.do(key, self._get_json, kind, key, path)
+
+    def _get_json(self, kind, key, path):
+        if key in self.missing or (
+            # If a project doesn't exist, neither do any of its versions.
+            len(path) > 2
+            and self.cache_key(path[0], "json") in self.missing
+        ):
+            return None
+        if self.cache is None:
+            status, body = self.fetch_document(path)
+            fetched = time.time()
+        else:
+            entry = self.cached(key, lambda: self.fetch_entry(kind, path))
+            status, body, fetched = entry.status, entry.body, entry.stored
+        if status == 404:
+            self.missing.add(key)
+            return None
+        doc = json.loads(body)
+        if kind == "project" and self.uses_latest_index():
+            self.latest_index.record(self.index_url, path[0], doc, fetched)
+        return doc
+
+    def fetch_document(self, path):
+        """
+        Fetch the document at ``path`` from the index or indexes, returning
+        a ``(status, body)`` pair.  ``status`` is 404 if the document does not
+        exist and 200 otherwise.
+        """
+        if len(self.index_urls) == 1:
+            r = self.get_document(self.index_url, path)
+            if r is None:
+                return (404, b"")
+            return (200, r.content)
+        doc = self.get_federated(path)
+        if doc is None:
+            return (404, b"")
+        return (200, json.dumps(doc).encode("utf-8"))
+
+    def cached(self, key, fetch):
+        """
+        Return the cache entry for ``key``, calling ``fetch()`` to create it
+        if needed (see `ResponseCache.get_or_fetch()`).  If the entry is stale
+        (which only happens if the cache has a nonzero ``max_stale``), it is
+        returned anyway, and a fresh copy is fetched in the background for
+        future runs.
+        """
+        entry = self.cache.get_or_fetch(key, fetch)
+        if entry.hit:
+            age = self.cache.clock() - entry.stored
+            if self.cache.expired(entry.kind, entry.stored):
+                with self._lock:
+                    self.stale_hits += 1
+                self.log_timing(f"CACHE {key} stale {age:.1f}s old, revalidating")
+                self.revalidate(key, fetch)
+            else:
+                self.log_timing(f"CACHE {key} fresh {age:.1f}s old")
+        return entry
+
+    def revalidate(self, key, fetch):
+        """Refresh the cache entry for ``key`` in a background thread"""
+        with self._lock:
+            if key in self.revalidating:
+                return
+            self.revalidating.add(key)
+            if self.refresher is None:
+                self.refresher = ThreadPoolExecutor(max_workers=self.jobs)
+        self.refresher.submit(self._revalidate, key, fetch)
+
+    def _revalidate(self, key, fetch):
+        try:
+            self.cache.refresh(key, fetch)
+        except (QyPIError, requests.RequestException) as e:
+            # The stale entry will just be served again next time.
+            self.log_timing(f"CACHE {key} revalidation failed: {e}")
+        finally:
+            with self._lock:
+                self.revalidating.discard(key)
+
+    def fetch_entry(self, kind, path):
+        status, body = self.fetch_document(path)
+        return ("missing" if status == 404 else kind, status, body)
 
-    def get(self, *path):
-        if self.s is None:
-            self.s = requests.Session()
-            self.s.headers["User-Agent"] = USER_AGENT
-        return self.s.get(self.index_url.rstrip("/") + "/" + "/".join(path))
+    def get_document(self, base, path):
+        """
+        Request the document at ``path`` on the index at ``base``, returning
+        the response or `None` if the document does not exist
+        """
+        r = self.get(*path, base=base)
+        if r.status_code == 404:
+            return None
+        r.raise_for_status()
+        return r
+
+    def get_federated(self, path):
+        """
+        Request the document at ``path`` from all indexes concurrently and
+        combine the results according to ``index_policy``.  Returns the decoded
+        document, or `None` if no index has it.  If no index has the document
+        but at least one request failed, the first failure is raised.
+        """
+        with self._lock:
+            if self.fanout is None:
+                self.fanout = ThreadPoolExecutor(
+                    max_workers=len(self.index_urls) * self.jobs
+                )
+        futures = [
+            self.fanout.submit(self.get_document, base, path)
+            for base in self.index_urls
+        ]
+        if self.index_policy == "fastest":
+            ordered = as_completed(futures)
+        else:
+            ordered = futures
+        docs = []
+        error = None
+        for fut in ordered:
+            try:
+                r = fut.result()
+            except (QyPIError, requests.RequestException) as e:
+                if error is None:
+                    error = e
+                continue
+            if r is not None:
+                docs.append(r.json())
+                if self.index_policy != "merge":
+                    break
+        if not docs:
+            if error is not None:
+                raise error
+            return None
+        doc = docs[0]
+        for other in docs[1:]:
+            releases = doc.setdefault("releases", {})
+            for version, files in other.get("releases", {}).items():
+                releases.setdefault(version, files)
+        return doc
+
+    def forget(self, package, version=None):
+        """
+        Discard the in-memory copy of the given project or version document
+        so that the next lookup fetches it anew (or reads it from the cache)
+        """
+        if version is None:
+            key = self.cache_key(package, "json")
+        else:
+            key = self.cache_key(package, version, "json")
+        self.flights.forget(key)
+        self.missing.discard(key)
+
+    def cache_key(self, *path):
+        # Canonicalize the project name so that all spellings of a name share
+        # one cache entry
+        project, *rest = path
+        if len(self.index_urls) == 1:
+            base = self.index_url.rstrip("/")
+        else:
+            base = "|".join(
+                [self.index_policy, *(url.rstrip("/") for url in self.index_urls)]
+            )
+        return "/".join([base, canonicalize_name(project), *rest])
 
     def get_package(self, package):
-        r = self.get(package, "json")
+        pkg = self.get_json("project", package, "json")
         # Unlike the XML-RPC API, the JSON API accepts package names regardless
         # of normalization
-        if r.status_code == 404:
+        if pkg is None:
             raise QyPIError(package + ": package not found")
-        r.raise_for_status()
-        return r.json()
+        return pkg
 
     def get_latest_version(self, package):
+        version = self.lookup_latest(package)
+        if version is not None:
+            try:
+                return self.get_version(package, version)
+            except QyPIError:
+                # The index is out of date; fall back to the project document.
+                self.latest_index.discard(self.index_url, package)
         pkg = self.get_package(package)
-        releases = {
-            (parse(rel), rel): first_upload(files)
-            # The unparsed version string needs to be kept around because the
-            # alternative approach (stringifying the Version object once
-            # comparisons are done) can result in a different string (e.g.,
-            # "2001.01.01" becomes "2001.1.1"), leading to a 404.
-            for rel, files in pkg["releases"].items()
-        }
-        candidates = releases.keys()
-        if not self.pre and any(not v[0].is_prerelease for v in candidates):
-            candidates = filter(lambda v: not v[0].is_prerelease, candidates)
-        if self.newest:
-            latest = max(
-                filter(releases.__getitem__, candidates),
-                key=releases.__getitem__,
-                default=None,
-            )
-        else:
-            latest = max(candidates, default=None)
+        latest = select_latest(pkg, pre=self.pre, newest=self.newest)
         if latest is None:
             raise QyPIError(package + ": no suitable versions available")
-        latest = latest[1]
         if pkg["info"]["version"] == latest:
             return pkg
         else:
-            return self.get_version(package, latest)
+            return self.get_version(package, latest, pkg)
 
-    def get_version(self, package, version):
-        r = self.get(package, version, "json")
-        if r.status_code == 404:
+    def uses_latest_index(self):
+        # Changelogs are per-index, so the latest-version index can't be used
+        # when combining multiple indexes.
+        return self.latest_index is not None and len(self.index_urls) == 1
+
+    def lookup_latest(self, package):
+        """
+        Return the version of ``package`` that `get_latest_version()` should
+        return according to the latest-version index, or `None` if it isn't
+        known.  The index is synced with the package index's changelog first
+        (at most once per session).
+        """
+        if not self.uses_latest_index():
+            return None
+        if not self.flights.do("#sync-latest", self.sync_latest):
+            return None
+        version = self.latest_index.lookup(
+            self.index_url, package, pre=self.pre, newest=self.newest
+        )
+        if version is not None:
+            self.log_timing(f"LATEST {package} {version}")
+        return version
+
+    def sync_latest(self):
+        """
+        Bring the latest-version index up to date if it hasn't been synced
+        recently.  Returns `False` if this failed, in which case the index is
+        not used for the rest of the session.
+        """
+        if not self.latest_index.needs_sync(self.index_url):
+            return True
+        start = monotonic()
+        try:
+            n = self.latest_index.sync(self.index_url, self.xmlrpc)
+        except (OSError, XMLRPCError, QyPIError) as e:
+            self.log_timing(f"latest-version index sync failed: {e}")
+            return False
+        self.log_timing(
+            f"latest-version index synced ({n} changes) {monotonic() - start:.3f}s"
+        )
+        return True
+
+    def get_version(self, package, version, pkg=None):
+        # `pkg` is the project document for `package`, if it's already been
+        # fetched.
+        if self.metadata_only:
+            info = self.get_core_metadata(package, version, pkg)
+            if info is not None:
+                return {"info": info, "urls": []}
+        pkg = self.get_json("version", package, version, "json")
+        if pkg is None:
             raise QyPIError(f"{package}: version {version} not found")
-        r.raise_for_status()
-        return r.json()
+        return pkg
+
+    def get_resource(self, kind, url, accept=None):
+        """
+        Fetch the resource at ``url`` (which may be anywhere, not just on the
+        JSON API), going through the response cache if there is one.  Returns
+        the response body, or `None` if the resource does not exist or (if
+        ``accept`` is given) isn't served in that format.  Concurrent and
+        repeated requests are coalesced as for `get_json()`.
+        """
+        return self.flights.do(url, self._get_resource, kind, url, accept)
+
+    def _get_resource(self, kind, url, accept):
+        def fetch():
+            r = self.get_url(url, headers={"Accept": accept} if accept else None)
+            if r.status_code == 404:
+                return ("missing", 404, b"")
+            r.raise_for_status()
+            ctype = r.headers.get("Content-Type", "").partition(";")[0].strip()
+            if accept is not None and ctype.lower() != accept:
+                # The server ignored the Accept header (e.g., an index that
+                # only serves HTML Simple API pages).
+                return ("missing", 404, b"")
+            return (kind, 200, r.content)
+
+        if self.cache is None:
+            _, status, body = fetch()
+        else:
+            entry = self.cached(url, fetch)
+            status, body = entry.status, entry.body
+        return body if status != 404 else None
+
+    def get_core_metadata(self, package, version, pkg=None):
+        """
+        Return an ``info`` mapping for the given release built from the core
+        metadata file that the index serves for one of its distributions (PEP
+        658), or `None` if no such file can be found or fetched.
+
+        If the project document ``pkg`` is given, the metadata file for the
+        release's first file (preferring wheels) is fetched directly.
+        Otherwise, the list of files and whether they have metadata files is
+        taken from the project's Simple API page (PEP 691); as this lists
+        every file of every release and can be much larger than a version
+        document, it is only fetched if `simple_metadata` is true or it's
+        already in the response cache.
+        """
+        if len(self.index_urls) > 1:
+            return None
+        if pkg is not None:
+            files = [f for f in pkg["releases"].get(version, []) if not f.get("yanked")]
+            files.sort(key=lambda f: not f["filename"].endswith(".whl"))
+            if not files:
+                return None
+            # Unlike the Simple API, the JSON API doesn't say which files have
+            # metadata files, so only one is tried.
+            return self.fetch_core_metadata(files[0]["url"] + ".metadata")
+        base = simple_url(self.index_url)
+        if base is None:
+            return None
+        page_url = f"{base}/{canonicalize_name(package)}/"
+        if not self.simple_metadata and (
+            self.cache is None or not self.cache.has(page_url)
+        ):
+            return None
+        # This is only an optimization, so if anything goes wrong, the version
+        # document is fetched instead.
+        try:
+            page = self.get_resource("simple", page_url, accept=SIMPLE_JSON)
+            if page is None:
+                return None
+            files = metadata_files(json.loads(page), version)
+        except (QyPIError, requests.RequestException, ValueError) as e:
+            self.log_timing(f"{page_url}: Simple API unusable: {e}")
+            return None
+        for f in files:
+            info = self.fetch_core_metadata(
+                urljoin(page_url, f["url"]) + ".metadata", metadata_digest(f)
+            )
+            if info is not None:
+                return info
+        return None
+
+    def fetch_core_metadata(self, meta_url, digest=None):
+        """
+        Fetch & parse the core metadata file at ``meta_url``, checking it
+        against the SHA256 digest ``digest`` if given.  Returns `None` if the
+        file does not exist or can't be fetched.
+        """
+        try:
+            body = self.get_resource("metadata", meta_url)
+        except (QyPIError, requests.RequestException) as e:
+            self.log_timing(f"{meta_url}: fetch failed: {e}")
+            return None
+        if body is None:
+            return None
+        if digest is not None and hashlib.sha256(body).hexdigest() != digest:
+            raise QyPIError(f"{meta_url}: SHA256 mismatch")
+        return parse_core_metadata(body)
+
+    def xmlrpc(self, method, *args):
+        """
+        Call the XML-RPC method ``method`` on the primary index.  The results
+        of the methods in `XMLRPC_CACHE_KINDS` are read from & stored in the
+        response cache, if there is one, under a key built from the method
+        name and its canonicalized arguments, and repeated calls within a
+        session are coalesced as for `get_json()`.
+        """
+        kind = XMLRPC_CACHE_KINDS.get(method)
+        if self.cache is None or kind is None:
+            return self.call_xmlrpc(method, *args)
+        key = xmlrpc_cache_key(self.index_url, method, args)
+        return self.flights.do(key, self._cached_xmlrpc, kind, key, method, args)
 
-    def xmlrpc(self, method, *args, **kwargs):
-        if self.xsp is None:
-            self.xsp = ServerProxy(self.index_url)
-        return getattr(self.xsp, method)(*args, **kwargs)
+    def _cached_xmlrpc(self, kind, key, method, args):
+        def fetch():
+            result = self.call_xmlrpc(method, *args)
+            return (kind, 200, json.dumps(result, separators=(",", ":")).encode())
+
+        return json.loads(self.cached(key, fetch).body)
+
+    def call_xmlrpc(self, method, *args, **kwargs):
+        """Call the XML-RPC method ``method`` on the primary index uncached"""
+        # XML-RPC connections only support a single timeout, which is applied
+        # to connecting and to each read alike.
+        timeout = max(self.request_timeout())
+        xsp = getattr(self._local, "xsp", None)
+        if xsp is None:
+            if self.index_url.startswith("https:"):
+                transport = TimeoutSafeTransport(timeout, self.keep_alive)
+            else:
+                transport = TimeoutTransport(timeout, self.keep_alive)
+            xsp = self._local.xsp = ServerProxy(self.index_url, transport=transport)
+        else:
+            xsp("transport").timeout = timeout
+        call = partial(getattr(xsp, method), *args, **kwargs)
+        if self.limiter is not None:
+            call = partial(self.limiter.call, call, failed=xmlrpc_overloaded)
+        if self.metrics is None:
+            return call()
+        start = monotonic()
+        status = "error"
+        try:
+            result = call()
+            status = "ok"
+            return result
+        except TimeoutError:
+            status = "timeout"
+            raise
+        finally:
+            self.metrics.observe("xmlrpc", status, monotonic() - start)
+
+    def list_packages(self):
+        return self.xmlrpc("list_packages")
+
+    def map(self, func, iterable):
+        """
+        Like `map()`, but calls ``func`` on up to ``jobs`` items concurrently.
+        Results are returned in order unless `unordered` is true, in which
+        case each one is returned as soon as it is ready.
+        """
+        if self.jobs <= 1:
+            return map(func, iterable)
+        with self._lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.jobs)
+        if self.unordered:
+            futures = [self.executor.submit(func, x) for x in iterable]
+            return (f.result() for f in as_completed(futures))
+        return self.executor.map(func, iterable)
 
     def lookup_package(self, args):
-        for name in args:
-            try:
-                yield self.get_package(name)
-            except QyPIError as e:
-                self.errmsgs.append(str(e))
+        return self._lookup(lambda name: [self.get_package(name)], args)
 
     def lookup_package_version(self, args):
-        for spec in args:
-            name, eq, version = spec.partition("=")
-            try:
-                if eq != "":
-                    yield self.get_version(name, version.lstrip("="))
-                elif self.all_versions:
-                    p = self.get_package(name)
-                    for v in sorted(p["releases"], key=parse):
-                        if self.pre or not parse(v).is_prerelease:
-                            if v == p["info"]["version"]:
-                                yield p
-                            else:
-                                ### TODO: Can this call ever fail?
-                                yield self.get_version(name, v)
+        return self._lookup(self.resolve_spec, args)
+
+    def resolve_spec(self, spec):
+        """
+        Yield the version documents for a ``name`` or ``name==version`` spec
+        in accordance with the ``pre``, ``newest``, and ``all_versions``
+        settings
+        """
+        name, eq, version = spec.partition("=")
+        if eq != "":
+            yield self.get_version(name, version.lstrip("="))
+        elif self.all_versions:
+            p = self.get_package(name)
+            for v in select_versions(p, pre=self.pre):
+                if self.where is not None and not self.may_match(p, v):
+                    # Don't fetch documents for releases that will just be
+                    # filtered out.
+                    continue
+                if v == p["info"]["version"]:
+                    yield p
                 else:
-                    yield self.get_latest_version(name)
-            except QyPIError as e:
-                self.errmsgs.append(str(e))
+                    ### TODO: Can this call ever fail?
+                    yield self.get_version(name, v, p)
+        else:
+            yield self.get_latest_version(name)
+
+    def may_match(self, pkg, version):
+        """
+        Return `False` if `where` is sure to reject ``version`` (or all of its
+        files) based on the project document ``pkg`` alone
+        """
+        if self.where_level == "file":
+            name = pkg["info"]["name"]
+            return any(
+                self.where.evaluate(file_record(name, version, f)) is not False
+                for f in pkg["releases"][version]
+            )
+        else:
+            return self.where.evaluate(release_stub(pkg, version)) is not False
+
+    def prefetch(self, spec):
+        """
+        Fetch (and thus cache) every document needed to show information about
+        ``spec`` with any command.  Returns the number of distinct documents
+        involved and the `QyPIError` that occurred, if any.
+        """
+        docs, e = gather(self.resolve_spec(spec))
+        name, eq, _ = spec.partition("=")
+        if e is None and eq != "":
+            # `releases` needs the project document.
+            try:
+                docs.append(self.get_package(name))
+            except QyPIError as exc:
+                e = exc
+        return len({id(d) for d in docs}), e
+
+    def _lookup(self, func, args):
+        # Yields ``(arg, document)`` pairs
+        if self.jobs <= 1:
+            for a in args:
+                try:
+                    for doc in func(a):
+                        yield (a, doc)
+                except QyPIError as e:
+                    self.errmsgs.append(str(e))
+        else:
+            for a, (docs, e) in self.map(lambda a: (a, gather(func(a))), args):
+                for doc in docs:
+                    yield (a, doc)
+                if e is not None:
+                    self.errmsgs.append(str(e))
+
+    def render_metrics(self):
+        """Return the current metrics in the Prometheus text format"""
+        extra = []
+        if self.cache is not None:
+            extra.extend(
+                [
+                    (
+                        "qypi_cache_hits_total",
+                        "counter",
+                        "Documents served from the response cache",
+                        self.cache.hits,
+                    ),
+                    (
+                        "qypi_cache_misses_total",
+                        "counter",
+                        "Documents not found in the response cache",
+                        self.cache.misses,
+                    ),
+                    (
+                        "qypi_cache_stale_hits_total",
+                        "counter",
+                        "Stale documents served from the cache while revalidating",
+                        self.stale_hits,
+                    ),
+                    (
+                        "qypi_cache_saved_bytes_total",
+                        "counter",
+                        "Size of the response bodies served from the cache",
+                        self.cache.bytes_saved,
+                    ),
+                ]
+            )
+        if self.hedger is not None:
+            extra.append(
+                (
+                    "qypi_hedged_requests_total",
+                    "counter",
+                    "Duplicate requests sent for slow requests",
+                    self.hedger.hedged,
+                )
+            )
+        if self.limiter is not None:
+            extra.extend(
+                [
+                    (
+                        "qypi_concurrency_limit",
+                        "gauge",
+                        "Current limit on concurrent requests to the index",
+                        self.limiter.current,
+                    ),
+                    (
+                        "qypi_concurrency_cutbacks_total",
+                        "counter",
+                        "Times the concurrency limit was cut back",
+                        self.limiter.cutbacks,
+                    ),
+                    (
+                        "qypi_throttled_seconds_total",
+                        "counter",
+                        "Time requests spent waiting for the concurrency limit",
+                        self.limiter.wait_time,
+                    ),
+                ]
+            )
+        extra.append(
+            ("qypi_errors_total", "counter", "Errors reported", len(self.errmsgs))
+        )
+        return self.metrics.render(extra)
+
+    def finish_revalidating(self):
+        """
+        Wait for any background revalidations of stale cache entries to
+        finish, so that the next run benefits from them.  As they make
+        requests of their own, this must be done before shutting down the
+        request machinery or reporting metrics.
+        """
+        if self.refresher is not None:
+            self.refresher.shutdown()
+            self.refresher = None
 
     def cleanup(self, ctx):
+        self.finish_revalidating()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+        if self.fanout is not None:
+            self.fanout.shutdown(wait=False, cancel_futures=True)
+            self.fanout = None
+        if self.hedger is not None:
+            self.hedger.shutdown()
+            self.log_timing(
+                f"requests: {self.hedger.requests}, hedged: {self.hedger.hedged}"
+                f" ({self.hedger.hedge_rate:.1%}), hedges won:"
+                f" {self.hedger.hedge_wins}, hedge delay: {self.hedger.delay():.3f}s"
+            )
+        if self.limiter is not None:
+            self.log_timing(
+                f"concurrency limit: {self.limiter.current} (ranged"
+                f" {self.limiter.low}-{self.limiter.high}), cutbacks:"
+                f" {self.limiter.cutbacks}, throttled: {self.limiter.wait_time:.3f}s"
+            )
+        if self.latest_index is not None:
+            self.latest_index.close()
+        if self.cache is not None:
+            self.log_timing(
+                f"cache hits: {self.cache.hits} ({self.stale_hits} stale),"
+                f" misses: {self.cache.misses}"
+            )
+            self.cache.close()
         if self.errmsgs:
             for msg in self.errmsgs:
                 click.echo(ctx.command_path + ": " + msg, err=True)
@@ -118,5 +900,242 @@ class QyPIError(Exception):
     pass
 
 
+def xmlrpc_cache_key(base, method, args):
+    """
+    Return the response cache key for calling the XML-RPC method ``method``
+    with the arguments ``args`` on the index at ``base``.  Arguments are
+    canonicalized so that equivalent calls share an entry: project names are
+    normalized, the order of ``browse`` classifiers and of the values for
+    each ``search`` field is ignored, and ``search`` operators are lowercased.
+    """
+    args = list(args)
+    if method == "package_roles" and args:
+        args[0] = canonicalize_name(args[0])
+    elif method == "browse" and args:
+        args[0] = sorted(set(args[0]))
+    elif method == "search" and args:
+        args[0] = {
+            field: sorted(v) if isinstance(v, (list, tuple)) else v
+            for field, v in args[0].items()
+        }
+        if len(args) > 1 and isinstance(args[1], str):
+            args[1] = args[1].lower()
+    key = f"{base.rstrip('/')}#{method}"
+    if args:
+        key += json.dumps(args, sort_keys=True, separators=(",", ":"))
+    return key
+
+
+def is_overloaded(status):
+    """
+    Return whether the HTTP status ``status`` indicates that the index is
+    overloaded (and so the concurrency limit should be cut back)
+    """
+    return status == 429 or status >= 500
+
+
+def xmlrpc_overloaded(e):
+    """
+    Return whether the exception ``e`` raised by an XML-RPC call indicates
+    that the index is overloaded.  Faults are errors reported by the
+    application, not the server, and so do not.
+    """
+    if isinstance(e, ProtocolError):
+        return is_overloaded(e.errcode)
+    return not isinstance(e, XMLRPCFault)
+
+
+class TimeoutTransport(Transport):
+    """
+    An XML-RPC transport with a socket timeout and optional closing of the
+    connection after each request
+    """
+
+    def __init__(self, timeout, keep_alive=True, **kwargs):
+        super().__init__(**kwargs)
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.user_agent = USER_AGENT
+
+    def make_connection(self, host):
+        conn = super().make_connection(host)
+        conn.timeout = self.timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(self.timeout)
+        return conn
+
+    def single_request(self, *args, **kwargs):
+        try:
+            return super().single_request(*args, **kwargs)
+        finally:
+            if not self.keep_alive:
+                self.close()
+
+
+class TimeoutSafeTransport(TimeoutTransport, SafeTransport):
+    pass
+
+
+class SingleFlight:
+    """
+    Coalesces calls by key: the first call for a given key runs its function,
+    and every other call for that key made while it is running waits for and
+    shares its outcome (return value or exception).  The return values for the
+    ``maxsize`` most recently used keys are also kept for later calls;
+    exceptions are not, so a failed call is retried the next time.
+    """
+
+    def __init__(self, maxsize=MEMO_SIZE):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        #: Futures for the calls currently running
+        self._calls = {}
+        self._results = OrderedDict()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+            fut = self._calls.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._calls[key] = Future()
+        if not owner:
+            return fut.result()
+        try:
+            value = func(*args)
+        except BaseException as e:
+            self._finish(key, fut)
+            fut.set_exception(e)
+            raise
+        if self._finish(key, fut) and self.maxsize > 0:
+            with self._lock:
+                self._results[key] = value
+                if len(self._results) > self.maxsize:
+                    self._results.popitem(last=False)
+        fut.set_result(value)
+        return value
+
+    def _finish(self, key, fut):
+        # Returns false if the key was forgotten while the call was running,
+        # in which case the result shouldn't be kept.
+        with self._lock:
+            if self._calls.get(key) is fut:
+                del self._calls[key]
+                return True
+            return False
+
+    def forget(self, key):
+        with self._lock:
+            self._calls.pop(key, None)
+            self._results.pop(key, None)
+
+
+def gather(iterable):
+    """
+    Consume ``iterable``, returning a list of the values it yielded and the
+    `QyPIError` that ended it (or `None`)
+    """
+    values = []
+    try:
+        for v in iterable:
+            values.append(v)
+    except QyPIError as e:
+        return values, e
+    return values, None
+
+
+def request_size(req):
+    """
+    Return the approximate number of bytes sent over the wire for the
+    `requests.PreparedRequest` ``req``
+    """
+    size = len(f"{req.method} {req.path_url} HTTP/1.1\r\n\r\n")
+    size += sum(len(k) + len(v) + 4 for k, v in req.headers.items())
+    if req.body is not None:
+        size += len(req.body)
+    return size
+
+
 def first_upload(files):
     return min((f["upload_time_iso_8601"] for f in files), default=None)
+
+
+def select_latest(pkg, pre=False, newest=False):
+    """
+    Return the version string of the latest release in the project document
+    ``pkg``, or `None` if there are no suitable releases.  "Latest" means
+    highest-numbered or, if ``newest`` is true, most recently uploaded.
+    Prereleases are only considered if ``pre`` is true or if there are no
+    other releases.
+    """
+    releases = {
+        (parse(rel), rel): first_upload(files)
+        # The unparsed version string needs to be kept around because the
+        # alternative approach (stringifying the Version object once
+        # comparisons are done) can result in a different string (e.g.,
+        # "2001.01.01" becomes "2001.1.1"), leading to a 404.
+        for rel, files in pkg["releases"].items()
+    }
+    candidates = releases.keys()
+    if not pre and any(not v[0].is_prerelease for v in candidates):
+        candidates = filter(lambda v: not v[0].is_prerelease, candidates)
+    if newest:
+        latest = max(
+            filter(releases.__getitem__, candidates),
+            key=releases.__getitem__,
+            default=None,
+        )
+    else:
+        latest = max(candidates, default=None)
+    return latest[1] if latest is not None else None
+
+
+def select_versions(pkg, pre=False):
+    """
+    Return the version strings of the releases in the project document
+    ``pkg`` in PEP 440 order, excluding prereleases unless ``pre`` is true
+    """
+    return [
+        v
+        for v in sorted(pkg["releases"], key=parse)
+        if pre or not parse(v).is_prerelease
+    ]
+
+
+def release_record(pkg):
+    """
+    Return the record that ``info --where`` expressions are evaluated against
+    for the version document ``pkg``
+    """
+    info = pkg["info"]
+    return ChainMap(
+        {
+            "is_prerelease": parse(info["version"]).is_prerelease,
+            "release_date": first_upload(pkg["urls"]),
+            "url": info.get("home_page"),
+        },
+        info,
+    )
+
+
+def release_stub(pkg, version):
+    """
+    Return the fields of `release_record()` for ``version`` that can be
+    determined from the project document ``pkg``
+    """
+    return {
+        "name": pkg["info"]["name"],
+        "version": version,
+        "is_prerelease": parse(version).is_prerelease,
+        "release_date": first_upload(pkg["releases"][version]),
+    }
+
+
+def file_record(name, version, f):
+    """
+    Return the record that ``files --where`` expressions are evaluated
+    against for the file ``f`` of the given release
+    """
+    return ChainMap(f, {"name": name, "version": version})
@@ -0,0 +1,498 @@
+from contextlib import contextmanager
+import errno
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    # Windows; entries are still written atomically, but concurrent processes
+    # may fetch the same resource at the same time.
+    fcntl = None
+
+#: Default upper bound on the total on-disk size of the cache, in bytes
+DEFAULT_MAX_SIZE = 256 << 20
+
+#: Number of lock files that cache keys are spread across
+LOCK_STRIPES = 1024
+
+#: Default number of seconds for which each kind of entry is considered fresh
+DEFAULT_TTLS = {
+    # Project documents change whenever anything is uploaded to the project.
+    "project": 600,
+    # Version documents only change when files are added to or yanked from an
+    # existing release, which is rare.
+    "version": 30 * 86400,
+    # The XML-RPC ``list_packages`` result
+    "list": 3600,
+    # The XML-RPC ``package_roles`` and ``user_packages`` results
+    "roles": 3600,
+    # The XML-RPC ``browse`` results
+    "browse": 3600,
+    # The XML-RPC ``search`` results, which change as often as project
+    # documents
+    "search": 600,
+    # Simple API project pages, which change as often as project documents
+    "simple": 600,
+    # Core metadata files of distributions, which never change
+    "metadata": 30 * 86400,
+    # "Not found" responses, kept only briefly so that new uploads show up
+    # quickly
+    "missing": 300,
+}
+
+
+def default_cache_dir():
+    base = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(base, "qypi")
+
+
+class CacheEntry:
+    def __init__(self, key, kind, stored, status, body, hit=True):
+        self.key = key
+        self.kind = kind
+        self.stored = stored
+        self.status = status
+        self.body = body
+        #: Whether the entry was read from the cache rather than just fetched
+        self.hit = hit
+
+
+class ResponseCache:
+    """
+    A size-bounded on-disk cache of index responses.
+
+    Each entry is stored in its own file, consisting of a one-line JSON header
+    followed by the zlib-compressed response body.  Entries are evicted in
+    least-recently-used order (tracked via file modification times) whenever
+    the total size of the cache exceeds ``max_size``.  Whether an entry is
+    still fresh is decided at lookup time based on its kind, so changing the
+    TTLs applies to entries that are already stored.  If ``max_stale`` is
+    nonzero, expired entries continue to be returned for up to that many
+    seconds past their TTL (so that they can be revalidated in the
+    background) and are not pruned until then.
+
+    The cache can be shared by any number of threads and processes, including
+    processes on different hosts sharing the directory over NFS.  Entries are
+    written to temporary files that are then renamed into place, so readers
+    never see partial entries, and `get_or_fetch()` uses POSIX record locks to
+    ensure that only one fetch per key is in progress at a time.
+    """
+
+    def __init__(
+        self,
+        path,
+        max_size=DEFAULT_MAX_SIZE,
+        ttls=None,
+        max_stale=0,
+        clock=time.time,
+    ):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.max_stale = max_stale
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.dirty = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["hits"] = state["misses"] = state["bytes_saved"] = 0
+        state["dirty"] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def entries_dir(self):
+        return self.path / "entries"
+
+    @property
+    def stats_file(self):
+        return self.path / "stats.json"
+
+    def entry_path(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return self.entries_dir / digest[:2] / digest
+
+    def get(self, key):
+        """
+        Return the fresh (or not too stale) `CacheEntry` stored for ``key``, or
+        `None` if there is no such entry
+        """
+        entry = self._lookup(key)
+        self._count(entry)
+        return entry
+
+    def has(self, key):
+        """
+        Return whether a fresh (or not too stale) entry is stored for ``key``,
+        without counting it as a hit or miss
+        """
+        return self._lookup(key) is not None
+
+    def get_or_fetch(self, key, fetch):
+        """
+        Return the fresh (or not too stale) `CacheEntry` stored for ``key``;
+        if there is none, call ``fetch()`` to obtain a ``(kind, status, body)``
+        triple, store it, and return it as a `CacheEntry`.
+
+        If another thread or process is already fetching ``key``, this waits
+        for it to finish and then returns the entry it stored.
+        """
+        entry = self._lookup(key)
+        if entry is None:
+            with self.lock(key):
+                # Another process may have stored the entry while we were
+                # waiting for the lock.
+                entry = self._lookup(key)
+                if entry is None:
+                    kind, status, body = fetch()
+                    self.put(kind, key, body, status=status)
+                    self._count(None)
+                    return CacheEntry(key, kind, self.clock(), status, body, hit=False)
+        self._count(entry)
+        return entry
+
+    def refresh(self, key, fetch):
+        """
+        Replace the stale entry for ``key`` with the result of ``fetch()``
+        (which is called as for `get_or_fetch()`), unless another thread or
+        process has refreshed it in the meantime
+        """
+        with self.lock(key):
+            entry = self._lookup(key, stale=False)
+            if entry is None:
+                kind, status, body = fetch()
+                self.put(kind, key, body, status=status)
+
+    @property
+    def locks_dir(self):
+        return self.path / "locks"
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Hold an exclusive lock on ``key`` across all threads & processes using
+        the cache directory.
+
+        Keys are hashed onto a fixed set of `LOCK_STRIPES` lock files, so the
+        number of lock files (and of in-process locks) stays bounded no matter
+        how many keys are used, at the cost of occasionally making fetches of
+        unrelated keys wait for each other.
+        """
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        stripe = int(digest[:8], 16) % LOCK_STRIPES
+        with _FileLock(self.locks_dir / f"{stripe:03x}.lock"):
+            yield
+
+    def _lookup(self, key, stale=True):
+        path = self.entry_path(key)
+        entry = self._read(path)
+        if (
+            entry is None
+            or entry.key != key
+            or self.expired(
+                entry.kind, entry.stored, grace=self.max_stale if stale else 0
+            )
+        ):
+            return None
+        try:
+            # Mark the entry as recently used
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _count(self, entry):
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.bytes_saved += len(entry.body)
+
+    def expired(self, kind, stored, grace=0):
+        return self.clock() - stored > self.ttls.get(kind, 0) + grace
+
+    def put(self, kind, key, body, status=200):
+        header = {
+            "key": key,
+            "kind": kind,
+            "stored": self.clock(),
+            "status": status,
+            "size": len(body),
+        }
+        path = self.entry_path(key)
+        self._write(
+            path, json.dumps(header).encode("utf-8") + b"\n" + zlib.compress(body)
+        )
+        self.dirty = True
+
+    def entries(self, kind=None):
+        """
+        Yield every `CacheEntry` in the cache (or every one of the given kind),
+        including expired entries
+        """
+        for path, _, header in self._scan():
+            if header is not None and kind in (None, header["kind"]):
+                entry = self._read(path)
+                if entry is not None:
+                    yield entry
+
+    def delete(self, key):
+        try:
+            self.entry_path(key).unlink()
+        except FileNotFoundError:
+            return False
+        else:
+            return True
+
+    def prune(self):
+        """
+        Delete all entries that are expired (by more than ``max_stale``
+        seconds), and then delete the least recently used entries until the
+        cache is no larger than ``max_size``.  Returns the number of entries
+        deleted and the number of bytes freed.
+        """
+        removed = freed = 0
+        live = []
+        for path, st, header in self._scan():
+            if header is None or self.expired(
+                header["kind"], header["stored"], grace=self.max_stale
+            ):
+                if self._unlink(path):
+                    removed += 1
+                    freed += st.st_size
+            else:
+                live.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in live)
+        live.sort()
+        for _, size, path in live:
+            if total <= self.max_size:
+                break
+            if self._unlink(path):
+                removed += 1
+                freed += size
+            total -= size
+        return removed, freed
+
+    def clear(self):
+        """
+        Delete all entries and statistics.  Returns the number of entries
+        deleted and the number of bytes freed.
+        """
+        removed = freed = 0
+        for path, st, _ in self._scan(headers=False):
+            if self._unlink(path):
+                removed += 1
+                freed += st.st_size
+        self._unlink(self.stats_file)
+        with self._lock:
+            self.hits = self.misses = self.bytes_saved = 0
+        return removed, freed
+
+    def stats(self):
+        totals = self._load_stats()
+        with self._lock:
+            hits = totals["hits"] + self.hits
+            misses = totals["misses"] + self.misses
+            bytes_saved = totals["bytes_saved"] + self.bytes_saved
+        kinds = {}
+        entries = size = 0
+        for _, st, header in self._scan():
+            kind = header["kind"] if header is not None else "unknown"
+            k = kinds.setdefault(kind, {"entries": 0, "size": 0})
+            k["entries"] += 1
+            k["size"] += st.st_size
+            entries += 1
+            size += st.st_size
+        return {
+            "path": str(self.path),
+            "entries": entries,
+            "size": size,
+            "max_size": self.max_size,
+            "kinds": kinds,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else None,
+            "bytes_saved": bytes_saved,
+        }
+
+    def take_counts(self):
+        """
+        Return this session's hit & miss counts as a `dict` (for passing to
+        `add_counts()`, e.g., from a worker process to its parent) and reset
+        them
+        """
+        with self._lock:
+            counts = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+            }
+            self.hits = self.misses = self.bytes_saved = 0
+        return counts
+
+    def add_counts(self, counts):
+        """Add hit & miss counts returned by `take_counts()`"""
+        with self._lock:
+            self.hits += counts["hits"]
+            self.misses += counts["misses"]
+            self.bytes_saved += counts["bytes_saved"]
+
+    def close(self):
+        """
+        Record this session's hit & miss counts and, if anything was added to
+        the cache, evict entries as needed to stay under ``max_size``
+        """
+        counts = self.take_counts()
+        if any(counts.values()):
+            with _FileLock(self.path / "stats.lock"):
+                totals = self._load_stats()
+                for k, v in counts.items():
+                    totals[k] += v
+                self._write(self.stats_file, json.dumps(totals).encode("utf-8"))
+        if self.dirty:
+            # If another process is already pruning, leave it to them.
+            with _FileLock(self.path / "prune.lock", blocking=False) as locked:
+                if locked:
+                    self.prune()
+            self.dirty = False
+
+    def _read(self, path, header_only=False):
+        try:
+            with open(path, "rb") as fp:
+                header = json.loads(fp.readline())
+                if header_only:
+                    return header
+                body = zlib.decompress(fp.read())
+        except FileNotFoundError:
+            return None
+        except (ValueError, zlib.error):
+            # Corrupt or foreign file; treat it as absent.
+            return None
+        return CacheEntry(
+            key=header["key"],
+            kind=header["kind"],
+            stored=header["stored"],
+            status=header["status"],
+            body=body,
+        )
+
+    def _scan(self, headers=True):
+        if not self.entries_dir.is_dir():
+            return
+        for subdir in self.entries_dir.iterdir():
+            if not subdir.is_dir():
+                continue
+            for path in subdir.iterdir():
+                if path.name.startswith("."):
+                    continue
+                try:
+                    st = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield (
+                    path,
+                    st,
+                    self._read(path, header_only=True) if headers else None,
+                )
+
+    def _load_stats(self):
+        totals = {"hits": 0, "misses": 0, "bytes_saved": 0}
+        try:
+            with open(self.stats_file) as fp:
+                totals.update(json.load(fp))
+        except (FileNotFoundError, ValueError):
+            pass
+        return totals
+
+    @staticmethod
+    def _write(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            return False
+        else:
+            return True
+
+
+class _FileLock:
+    """
+    Context manager that holds an exclusive lock on a lock file (creating it
+    if necessary) and returns whether the lock was acquired, which is always
+    true when ``blocking`` is true
+    """
+
+    # POSIX record locks are held per-process, so threads within a process are
+    # additionally serialized with an in-process lock per lock file.
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
+
+    def __init__(self, path, blocking=True):
+        self.path = path
+        self.blocking = blocking
+        with self._thread_locks_lock:
+            self.tlock = self._thread_locks.setdefault(str(path), threading.Lock())
+        self.fd = None
+        self.acquired = False
+
+    def __enter__(self):
+        if not self.tlock.acquire(blocking=self.blocking):
+            return False
+        try:
+            if fcntl is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+                flags = fcntl.LOCK_EX
+                if not self.blocking:
+                    flags |= fcntl.LOCK_NB
+                # `lockf()` rather than `flock()`, as the former works over NFS
+                fcntl.lockf(self.fd, flags)
+        except OSError as e:
+            if self.fd is not None:
+                os.close(self.fd)
+                self.fd = None
+            self.tlock.release()
+            if not self.blocking and e.errno in (errno.EACCES, errno.EAGAIN):
+                return False
+            raise
+        self.acquired = True
+        return True
+
+    def __exit__(self, _exc_type, _exc_value, _traceback):
+        if self.acquired:
+            if self.fd is not None:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+                os.close(self.fd)
+                self.fd = None
+            self.acquired = False
+            self.tlock.release()
+        return False
@@ -0,0 +1,244 @@
+import gzip
+import hashlib
+import json
+import multiprocessing
+import os
+from pathlib import Path
+import re
+import tempfile
+from packaging.utils import canonicalize_name
+import requests
+from .api import QyPIError
+
+#: The `QyPI` instance used by the current crawl worker process
+_worker = None
+
+#: Whether the current crawl worker runs in a separate process and so must
+#: send its metrics & cache counts back to the parent
+_remote = False
+
+
+def in_shard(name, shard, shards):
+    """
+    Return whether the project ``name`` belongs to shard number ``shard``
+    (counting from 1) out of ``shards``.  Assignment depends only on the
+    canonicalized name, so every host splitting up a crawl agrees on it.
+    """
+    digest = hashlib.sha256(canonicalize_name(name).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % shards == shard - 1
+
+
+class Crawler:
+    """
+    Fetches the project documents for a shard of a list of projects and writes
+    them as gzipped JSON Lines files in ``outdir``.
+
+    Output is written in parts of up to ``batch_size`` projects.  Each part is
+    written to a temporary file and renamed into place, after which the part
+    and the projects it covers are appended to a checkpoint file.  When a
+    crawl is restarted, projects listed in the checkpoint are skipped, and any
+    part files not listed in it (left over from an interruption) are deleted.
+    """
+
+    def __init__(self, qypi, outdir, shard=1, shards=1, processes=1, batch_size=1000):
+        self.qypi = qypi
+        self.outdir = Path(outdir)
+        self.shard = shard
+        self.shards = shards
+        self.processes = processes
+        self.batch_size = batch_size
+
+    @property
+    def stem(self):
+        return f"shard-{self.shard}-of-{self.shards}"
+
+    @property
+    def checkpoint_file(self):
+        return self.outdir / f"{self.stem}.checkpoint"
+
+    def part_file(self, n):
+        return self.outdir / f"{self.stem}-part-{n:05d}.jsonl.gz"
+
+    def load_checkpoint(self):
+        """
+        Return the set of projects that have already been crawled and the
+        names of the completed part files
+        """
+        done = set()
+        parts = set()
+        try:
+            with open(self.checkpoint_file) as fp:
+                for line in fp:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A partially-written final line
+                        continue
+                    if record["part"] is not None:
+                        parts.add(record["part"])
+                    done.update(record["names"])
+        except FileNotFoundError:
+            pass
+        return done, parts
+
+    def run(self, names, progress=None):
+        """
+        Crawl the projects in ``names`` that belong to this shard and have not
+        already been crawled.  ``progress``, if given, is called with the
+        number of projects handled so far and the total for this run after
+        each part is written.  Returns a `dict` of statistics.
+        """
+        self.outdir.mkdir(parents=True, exist_ok=True)
+        done, parts = self.load_checkpoint()
+        pattern = re.compile(re.escape(self.stem) + r"-part-(\d+)\.jsonl\.gz")
+        next_part = 0
+        for p in self.outdir.iterdir():
+            m = pattern.fullmatch(p.name)
+            if m:
+                if p.name in parts:
+                    next_part = max(next_part, int(m[1]) + 1)
+                else:
+                    p.unlink()
+        todo = []
+        seen = set()
+        skipped = 0
+        for name in names:
+            if not in_shard(name, self.shard, self.shards):
+                continue
+            key = canonicalize_name(name)
+            if key in seen:
+                continue
+            seen.add(key)
+            if name in done:
+                skipped += 1
+            else:
+                todo.append(name)
+        stats = {
+            "shard": f"{self.shard}/{self.shards}",
+            "projects": len(todo) + skipped,
+            "skipped": skipped,
+            "crawled": 0,
+            "not_found": 0,
+            "errors": 0,
+            "parts": 0,
+        }
+        batch = []
+        batch_names = []
+        handled = 0
+        for name, line, error, found, counters in self._results(todo):
+            handled += 1
+            if counters is not None:
+                add_counters(self.qypi, counters)
+            if line is not None:
+                batch.append(line)
+                batch_names.append(name)
+                stats["crawled"] += 1
+            elif not found:
+                # The project has been deleted since the name list was made;
+                # there's no point in retrying it on resumption.
+                batch_names.append(name)
+                stats["not_found"] += 1
+                self.qypi.errmsgs.append(error)
+            else:
+                stats["errors"] += 1
+                self.qypi.errmsgs.append(error)
+            if len(batch_names) >= self.batch_size:
+                next_part = self._flush(batch, batch_names, next_part, stats)
+                batch, batch_names = [], []
+                if progress is not None:
+                    progress(handled, len(todo))
+        if batch_names:
+            self._flush(batch, batch_names, next_part, stats)
+            if progress is not None:
+                progress(handled, len(todo))
+        return stats
+
+    def _results(self, names):
+        if self.processes <= 1:
+            init_worker(self.qypi)
+            yield from map(crawl_project, names)
+        else:
+            # Use "spawn" so that nothing depends on the state of the parent's
+            # threads (e.g., the locks of its connection pools) at fork time.
+            with multiprocessing.get_context("spawn").Pool(
+                self.processes, initializer=init_worker, initargs=(self.qypi, True)
+            ) as pool:
+                yield from pool.imap_unordered(crawl_project, names, chunksize=16)
+            if self.qypi.cache is not None:
+                # The workers added entries to the cache but never got the
+                # chance to prune it.
+                self.qypi.cache.dirty = True
+
+    def _flush(self, lines, names, n, stats):
+        part = None
+        if lines:
+            path = self.part_file(n)
+            fd, tmp = tempfile.mkstemp(dir=self.outdir, prefix=".tmp-")
+            try:
+                with (
+                    os.fdopen(fd, "wb") as raw,
+                    gzip.GzipFile(fileobj=raw, mode="wb") as fp,
+                ):
+                    for line in lines:
+                        fp.write(line.encode("utf-8") + b"\n")
+                os.replace(tmp, path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+            part = path.name
+            stats["parts"] += 1
+            n += 1
+        with open(self.checkpoint_file, "a") as fp:
+            print(json.dumps({"part": part, "names": names}), file=fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        return n
+
+
+def init_worker(qypi, remote=False):
+    global _worker, _remote
+    _worker = qypi
+    _remote = remote
+
+
+def crawl_project(name):
+    """
+    Fetch the project document for ``name`` in a crawl worker.  Returns a
+    tuple of the name, the document as a line of JSON (or `None` on error),
+    an error message (or `None`), whether the project exists (or may exist),
+    and, in a worker process, the counters to pass to `add_counters()` (or
+    `None`)
+    """
+    try:
+        doc = _worker.get_json("project", name, "json")
+    except (QyPIError, requests.RequestException) as e:
+        return (name, None, f"{name}: {e}", True, take_counters())
+    finally:
+        # Don't keep every project document in memory for the whole crawl
+        _worker.forget(name)
+    if doc is None:
+        return (name, None, f"{name}: package not found", False, take_counters())
+    return (name, json.dumps(doc, sort_keys=True), None, True, take_counters())
+
+
+def take_counters():
+    """
+    In a worker process, return the metrics and cache counts recorded since
+    the last call, resetting them; otherwise (where they are already being
+    recorded in the parent's `QyPI`), return `None`
+    """
+    if not _remote:
+        return None
+    return (
+        _worker.metrics.drain() if _worker.metrics is not None else None,
+        _worker.cache.take_counts() if _worker.cache is not None else None,
+    )
+
+
+def add_counters(qypi, counters):
+    """Add counters from `take_counters()` in a worker to the parent's `QyPI`"""
+    metrics, cache_counts = counters
+    if metrics is not None and qypi.metrics is not None:
+        qypi.metrics.merge(metrics)
+    if cache_counts is not None and qypi.cache is not None:
+        qypi.cache.add_counts(cache_counts)
@@ -0,0 +1,133 @@
+import hashlib
+import os
+from pathlib import Path
+from time import monotonic
+import requests
+from .api import QyPIError
+
+#: Size of the pieces in which files are read & written
+CHUNK_SIZE = 1 << 16
+
+
+class Downloader:
+    """
+    Downloads distribution files into the directory ``dest``, verifying their
+    SHA256 digests as they are written.
+
+    Each file is first written to a ``.part`` file, which is renamed into
+    place once the download is complete and verified.  If a ``.part`` file is
+    already present (e.g., from an interrupted run), the download resumes
+    where it left off by means of a range request.  Files that already exist
+    with the correct digest are not downloaded again.
+    """
+
+    def __init__(self, qypi, dest):
+        self.qypi = qypi
+        self.dest = Path(dest)
+
+    def download(self, f):
+        """
+        Download the file described by the file `dict` ``f`` (from the
+        ``urls`` or ``releases`` of a JSON API document).  Returns a `dict` of
+        the file's ``filename``, ``path``, ``size``, and ``status``
+        (``"downloaded"``, ``"resumed"``, or ``"skipped"``).  Raises a
+        `QyPIError` if the download fails or the file's digest is wrong.
+        """
+        filename = f["filename"]
+        if Path(filename).name != filename or filename.startswith("."):
+            raise QyPIError(f"{filename}: refusing to write outside of {self.dest}")
+        expected = f.get("digests", {}).get("sha256")
+        path = self.dest / filename
+        part = path.with_name(filename + ".part")
+        if path.exists() and (
+            hash_file(path).hexdigest() == expected
+            if expected is not None
+            else path.stat().st_size == f.get("size")
+        ):
+            status = "skipped"
+        else:
+            self.dest.mkdir(parents=True, exist_ok=True)
+            try:
+                status, digest = self.fetch(f["url"], part)
+            except (QyPIError, requests.RequestException) as e:
+                raise QyPIError(f"{filename}: download failed: {e}") from e
+            if expected is not None and digest != expected:
+                part.unlink()
+                raise QyPIError(
+                    f"{filename}: SHA256 mismatch: expected {expected}, got {digest}"
+                )
+            os.replace(part, path)
+        return {
+            "filename": filename,
+            "path": str(path),
+            "size": path.stat().st_size,
+            "status": status,
+        }
+
+    def fetch(self, url, part):
+        """
+        Download ``url`` to ``part``, resuming from the end of ``part`` if it
+        exists.  Returns the status (``"downloaded"`` or ``"resumed"``) and the
+        hexdigest of the complete file.
+        """
+        hasher = hashlib.sha256()
+        try:
+            offset = part.stat().st_size
+        except FileNotFoundError:
+            offset = 0
+        # Byte ranges are only meaningful for the file as stored.
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            hash_file(part, hasher)
+            headers["Range"] = f"bytes={offset}-"
+        start = monotonic()
+        s = self.qypi.session()
+        with s.get(
+            url, headers=headers, stream=True, timeout=self.qypi.request_timeout()
+        ) as r:
+            if r.status_code == 416 and offset:
+                # The partial file is the complete file (or is corrupt); its
+                # digest will tell.
+                return ("resumed", hasher.hexdigest())
+            r.raise_for_status()
+            if r.status_code == 206 and content_range_start(r) == offset:
+                status, mode = "resumed", "ab"
+            else:
+                # The server ignored the range; start over.
+                hasher = hashlib.sha256()
+                status, mode = "downloaded", "wb"
+            received = 0
+            with open(part, mode) as fp:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    hasher.update(chunk)
+                    fp.write(chunk)
+                    received += len(chunk)
+        self.qypi.log_timing(
+            f"GET {url} {r.status_code} {received} bytes {monotonic() - start:.3f}s"
+        )
+        return (status, hasher.hexdigest())
+
+
+def content_range_start(r):
+    """
+    Return the first byte position in the ``Content-Range`` header of the
+    response ``r``, or `None` if it is missing or malformed
+    """
+    unit, _, spec = r.headers.get("Content-Range", "").partition(" ")
+    first, dash, _ = spec.partition("-")
+    if unit != "bytes" or not dash or not first.isdigit():
+        return None
+    return int(first)
+
+
+def hash_file(path, hasher=None):
+    """
+    Feed the contents of the file at ``path`` to ``hasher`` (a new SHA256
+    hasher by default) in chunks and return it
+    """
+    if hasher is None:
+        hasher = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
@@ -0,0 +1,115 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import math
+import threading
+from time import monotonic
+
+
+class Hedger:
+    """
+    Runs requests with hedging: if a request has not completed within a delay
+    based on the latencies of previous requests, a duplicate request is sent,
+    and the result of whichever finishes first is used.
+
+    At most ``max_rate`` of all requests are hedged.  Until ``min_samples``
+    latencies have been observed, ``initial_delay`` is used as the delay.
+    """
+
+    def __init__(
+        self,
+        percentile=95,
+        max_rate=0.1,
+        initial_delay=1.0,
+        min_samples=20,
+        window=200,
+        max_workers=2,
+    ):
+        self.percentile = percentile
+        self.max_rate = max_rate
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.max_workers = max_workers
+        self.latencies = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.executor = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["executor"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def hedge_rate(self):
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def delay(self):
+        with self._lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            latencies = sorted(self.latencies)
+        i = math.ceil(len(latencies) * self.percentile / 100) - 1
+        return latencies[max(i, 0)]
+
+    def call(self, primary, secondary, accept=None):
+        """
+        Call ``primary()`` and, if it takes too long, ``secondary()`` as well.
+        Returns a pair of the first successful result and a string describing
+        how it was obtained: ``"direct"`` (not hedged), ``"hedged"`` (hedged,
+        but the primary request won), or ``"hedge-won"``.  A result from
+        ``secondary()`` is only used if ``accept(result)`` is true (or
+        ``accept`` is `None`); otherwise, the outcome of ``primary()`` is
+        awaited.  If ``primary()`` fails and ``secondary()`` doesn't produce
+        an acceptable result, the exception from ``primary()`` is raised.
+        """
+        with self._lock:
+            self.requests += 1
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        start = monotonic()
+        first = self.executor.submit(primary)
+        done, _ = wait([first], timeout=self.delay())
+        if done or not self._take_hedge():
+            r = first.result()
+            self._record(monotonic() - start)
+            return r, "direct"
+        second = self.executor.submit(secondary)
+        pending = {first, second}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            if first in done and first.exception() is None:
+                self._record(monotonic() - start)
+                return first.result(), "hedged"
+            if (
+                second in done
+                and second.exception() is None
+                and (accept is None or accept(second.result()))
+            ):
+                self._record(monotonic() - start)
+                with self._lock:
+                    self.hedge_wins += 1
+                return second.result(), "hedge-won"
+        return first.result(), "hedged"
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+    def _take_hedge(self):
+        with self._lock:
+            if self.hedged + 1 > self.max_rate * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def _record(self, elapsed):
+        with self._lock:
+            self.latencies.append(elapsed)
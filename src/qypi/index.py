@@ -0,0 +1,327 @@
+from collections import Counter, defaultdict
+import gzip
+import json
+import math
+import os
+from pathlib import Path
+import re
+import sqlite3
+import tempfile
+import zlib
+from packaging.utils import canonicalize_name
+from .api import QyPIError
+
+#: The fields covered by the full-text index and their weights when ranking
+#: search results
+FIELD_WEIGHTS = {
+    "name": 5.0,
+    "keywords": 3.0,
+    "summary": 2.0,
+    "classifiers": 1.0,
+    "description": 0.5,
+}
+
+SCHEMA = """
+CREATE TABLE projects (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    version TEXT,
+    summary TEXT
+);
+CREATE TABLE postings (
+    field TEXT NOT NULL,
+    term TEXT NOT NULL,
+    project INTEGER NOT NULL,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (field, term, project)
+) WITHOUT ROWID;
+CREATE TABLE classifiers (
+    classifier TEXT PRIMARY KEY,
+    projects BLOB NOT NULL
+);
+"""
+
+#: Maximum number of parameters to use in a single SQLite query
+MAX_PARAMS = 500
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+def field_terms(field, info):
+    """
+    Return a `Counter` of the index terms for ``field`` of the project
+    ``info`` mapping
+    """
+    value = info.get(field)
+    if not value:
+        return Counter()
+    if isinstance(value, list):
+        value = " ".join(map(str, value))
+    terms = Counter(tokenize(value))
+    if field == "name" and len(terms) > 1:
+        # Let "foobar" find "foo-bar" and "Foo_Bar"
+        terms["".join(tokenize(value))] += 1
+    return terms
+
+
+class OfflineIndex:
+    """
+    A local full-text index of project metadata, stored in an SQLite
+    database, for searching without querying the package index.
+
+    The index maps each term (a lowercased run of letters and digits) in each
+    of the fields in `FIELD_WEIGHTS` to the projects containing it, along with
+    the number of times it occurs.  Searches are ranked by TF-IDF, weighted by
+    field.
+
+    The index also maps each trove classifier to the set of projects that
+    have it, stored as a compressed bitset over project IDs, so that any
+    number of classifiers can be intersected with a few bitwise operations.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            if not self.path.exists():
+                raise QyPIError(
+                    f"{self.path}: offline index not found; create it with"
+                    " `qypi index build`"
+                )
+            self.db = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        return self.db
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    @classmethod
+    def build(cls, path, documents):
+        """
+        Create an index at ``path`` (replacing any existing index there) from
+        an iterable of project JSON documents.  If a project occurs more than
+        once, only its first document is used.  Returns a `dict` of
+        statistics.
+        """
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-", suffix=".db")
+        os.close(fd)
+        stats = {"projects": 0, "duplicates": 0, "postings": 0, "classifiers": 0}
+        by_classifier = defaultdict(list)
+        try:
+            db = sqlite3.connect(tmp)
+            try:
+                # The database isn't visible to anyone until it's complete, so
+                # there's no need to make the writes durable along the way.
+                db.execute("PRAGMA journal_mode = OFF")
+                db.execute("PRAGMA synchronous = OFF")
+                db.executescript(SCHEMA)
+                with db:
+                    for doc in documents:
+                        if cls._add(db, doc, stats, by_classifier):
+                            stats["projects"] += 1
+                        else:
+                            stats["duplicates"] += 1
+                    db.executemany(
+                        "INSERT INTO classifiers VALUES (?, ?)",
+                        (
+                            (c, pack_bitset(pids))
+                            for c, pids in sorted(by_classifier.items())
+                        ),
+                    )
+                    stats["classifiers"] = len(by_classifier)
+            finally:
+                db.close()
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        stats["path"] = str(path)
+        stats["size"] = path.stat().st_size
+        return stats
+
+    @staticmethod
+    def _add(db, doc, stats, by_classifier):
+        info = doc["info"]
+        cur = db.execute(
+            "INSERT OR IGNORE INTO projects (key, name, version, summary)"
+            " VALUES (?, ?, ?, ?)",
+            (
+                canonicalize_name(info["name"]),
+                info["name"],
+                info.get("version"),
+                info.get("summary"),
+            ),
+        )
+        if not cur.rowcount:
+            return False
+        pid = cur.lastrowid
+        rows = [
+            (field, term, pid, tf)
+            for field in FIELD_WEIGHTS
+            for term, tf in field_terms(field, info).items()
+        ]
+        db.executemany("INSERT INTO postings VALUES (?, ?, ?, ?)", rows)
+        stats["postings"] += len(rows)
+        for c in set(info.get("classifiers") or []):
+            by_classifier[c].append(pid)
+        return True
+
+    def search(self, spec, operator="and"):
+        """
+        Search the index.  ``spec`` is a `dict` mapping field names to lists
+        of values, as for the XML-RPC ``search`` method: a project matches a
+        value if the field contains every term in the value, a project matches
+        a field if it matches any of the field's values, and the results for
+        the fields are combined according to ``operator`` (``"and"`` or
+        ``"or"``).  Returns a list of `dict`s with ``name``, ``version``, and
+        ``summary`` fields, best matches first.
+        """
+        for field in spec:
+            if field not in FIELD_WEIGHTS:
+                raise QyPIError(f"{field}: field is not covered by the offline index")
+        db = self.connect()
+        (total,) = db.execute("SELECT COUNT(*) FROM projects").fetchone()
+        scores = None
+        for field, values in spec.items():
+            matches = {}
+            for v in values:
+                for pid, score in self._match(field, v, total).items():
+                    matches[pid] = matches.get(pid, 0) + score
+            if scores is None:
+                scores = matches
+            elif operator == "and":
+                scores = {
+                    pid: scores[pid] + score
+                    for pid, score in matches.items()
+                    if pid in scores
+                }
+            else:
+                for pid, score in matches.items():
+                    scores[pid] = scores.get(pid, 0) + score
+        if not scores:
+            return []
+        projects = self._projects(scores.keys())
+        ranked = sorted(scores, key=lambda pid: (-scores[pid], projects[pid]["name"]))
+        return [projects[pid] for pid in ranked]
+
+    def browse(self, classifiers):
+        """
+        Return a list of `dict`s with ``name`` and ``version`` fields for the
+        projects that have all of the given classifiers, sorted by name
+        """
+        db = self.connect()
+        matches = None
+        for c in dict.fromkeys(classifiers):
+            try:
+                row = db.execute(
+                    "SELECT projects FROM classifiers WHERE classifier = ?", (c,)
+                ).fetchone()
+            except sqlite3.OperationalError:
+                raise QyPIError(
+                    f"{self.path}: offline index has no classifier data; rebuild it"
+                    " with `qypi index build`"
+                )
+            if row is None:
+                return []
+            bits = unpack_bitset(row[0])
+            matches = bits if matches is None else matches & bits
+            if not matches:
+                return []
+        if matches is None:
+            return []
+        projects = self._projects(iter_bits(matches))
+        return sorted(
+            ({"name": p["name"], "version": p["version"]} for p in projects.values()),
+            key=lambda p: canonicalize_name(p["name"]),
+        )
+
+    def _match(self, field, value, total):
+        weight = FIELD_WEIGHTS[field]
+        scores = None
+        for term in dict.fromkeys(tokenize(value)):
+            rows = self.db.execute(
+                "SELECT project, tf FROM postings WHERE field = ? AND term = ?",
+                (field, term),
+            ).fetchall()
+            idf = math.log(1 + total / len(rows)) if rows else 0
+            term_scores = {pid: weight * (1 + math.log(tf)) * idf for pid, tf in rows}
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {
+                    pid: scores[pid] + score
+                    for pid, score in term_scores.items()
+                    if pid in scores
+                }
+            if not scores:
+                break
+        return scores or {}
+
+    def _projects(self, pids):
+        pids = list(pids)
+        projects = {}
+        for i in range(0, len(pids), MAX_PARAMS):
+            chunk = pids[i : i + MAX_PARAMS]
+            placeholders = ", ".join("?" * len(chunk))
+            for pid, name, version, summary in self.db.execute(
+                "SELECT id, name, version, summary FROM projects"
+                f" WHERE id IN ({placeholders})",
+                chunk,
+            ):
+                projects[pid] = {"name": name, "version": version, "summary": summary}
+        return projects
+
+
+def pack_bitset(ids):
+    """
+    Return a compressed bitset of the nonnegative integers in ``ids``, with
+    bit ``i`` of byte ``j`` set iff ``8 * j + i`` is in ``ids``
+    """
+    bits = bytearray(max(ids, default=-1) // 8 + 1)
+    for i in ids:
+        bits[i >> 3] |= 1 << (i & 7)
+    return zlib.compress(bytes(bits))
+
+
+def unpack_bitset(blob):
+    """Return a bitset produced by `pack_bitset()` as an `int`"""
+    return int.from_bytes(zlib.decompress(blob), "little")
+
+
+def iter_bits(n):
+    """Yield the positions of the set bits in the nonnegative `int` ``n``"""
+    for j, byte in enumerate(n.to_bytes((n.bit_length() + 7) // 8, "little")):
+        while byte:
+            low = byte & -byte
+            yield 8 * j + low.bit_length() - 1
+            byte ^= low
+
+
+def read_documents(paths):
+    """
+    Yield the project documents in the given JSON Lines files (optionally
+    gzipped) and directories thereof, such as the output of ``qypi crawl``
+    """
+    for p in map(Path, paths):
+        if p.is_dir():
+            files = sorted(
+                f
+                for f in p.rglob("*")
+                if f.name.endswith((".jsonl", ".jsonl.gz")) and f.is_file()
+            )
+        else:
+            files = [p]
+        for f in files:
+            opener = gzip.open if f.suffix == ".gz" else open
+            with opener(f, "rt", encoding="utf-8") as fp:
+                for line in fp:
+                    if line.strip():
+                        yield json.loads(line)
@@ -0,0 +1,224 @@
+from pathlib import Path
+import sqlite3
+import threading
+import time
+from packaging.utils import canonicalize_name
+from packaging.version import parse
+from .api import first_upload, select_latest
+from .watch import CHANGELOG_LIMIT
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS latest (
+    key TEXT PRIMARY KEY,
+    highest TEXT,
+    highest_final TEXT,
+    newest TEXT,
+    newest_time TEXT,
+    newest_final TEXT,
+    newest_final_time TEXT
+);
+CREATE TABLE IF NOT EXISTS serials (
+    base TEXT PRIMARY KEY,
+    serial INTEGER NOT NULL,
+    synced REAL NOT NULL
+);
+"""
+
+
+class LatestIndex:
+    """
+    A local SQLite index of the latest versions of projects, so that the
+    version to show for a bare project name can be determined without
+    fetching the project's full JSON document.
+
+    For each project, the index stores the highest version, the highest
+    non-prerelease version, the most recently uploaded version, and the most
+    recently uploaded non-prerelease version (the latter two with their upload
+    times), as computed by `select_latest()` from the last project document
+    fetched.  The index is kept current by following each package index's
+    changelog: new releases are applied to the stored versions, and any other
+    change to a project discards its entry until its project document is next
+    fetched.  The changelog is checked at most every ``max_age`` seconds.
+    """
+
+    def __init__(self, path, max_age=60, clock=time.time):
+        self.path = Path(path)
+        self.max_age = max_age
+        self.clock = clock
+        self.db = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["db"] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def connect(self):
+        if self.db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            # Several threads (and processes) may be recording projects at
+            # once.
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode = WAL")
+            self.db.executescript(SCHEMA)
+        return self.db
+
+    def close(self):
+        with self._lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+    @staticmethod
+    def key(base, name):
+        return base.rstrip("/") + "/" + canonicalize_name(name)
+
+    def synced(self, base):
+        """
+        Return the last changelog serial applied for the index at ``base`` and
+        the time at which it was applied, or `None` if the index has never
+        been synced
+        """
+        with self._lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT serial, synced FROM serials WHERE base = ?",
+                    (base.rstrip("/"),),
+                )
+                .fetchone()
+            )
+        return row
+
+    def needs_sync(self, base):
+        row = self.synced(base)
+        return row is None or self.clock() - row[1] > self.max_age
+
+    def sync(self, base, xmlrpc):
+        """
+        Apply the changes in the changelog of the index at ``base`` since the
+        last sync, using ``xmlrpc(method, *args)`` to call the index's XML-RPC
+        API.  On the first sync, the index's current serial is just recorded.
+        Returns the number of changes applied.
+        """
+        row = self.synced(base)
+        now = self.clock()
+        if row is None:
+            self._set_serial(base, xmlrpc("changelog_last_serial"), now)
+            return 0
+        serial = row[0]
+        applied = 0
+        while True:
+            changes = xmlrpc("changelog_since_serial", serial)
+            with self._lock, self.connect() as db:
+                for name, version, _, action, change_serial in changes:
+                    serial = max(serial, change_serial)
+                    self._apply(db, self.key(base, name), version, action)
+            applied += len(changes)
+            if len(changes) < CHANGELOG_LIMIT:
+                break
+        self._set_serial(base, serial, now)
+        return applied
+
+    def _set_serial(self, base, serial, now):
+        with self._lock, self.connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO serials VALUES (?, ?, ?)",
+                (base.rstrip("/"), serial, now),
+            )
+
+    @staticmethod
+    def _apply(db, key, version, action):
+        row = db.execute(
+            "SELECT highest, highest_final FROM latest WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return
+        if action == "new release" and version:
+            # A new release has no files yet, so only the highest versions
+            # can change.
+            highest, highest_final = row
+            v = parse(version)
+            if v > parse(highest):
+                highest = version
+            if not v.is_prerelease and (
+                highest_final is None or v > parse(highest_final)
+            ):
+                highest_final = version
+            db.execute(
+                "UPDATE latest SET highest = ?, highest_final = ? WHERE key = ?",
+                (highest, highest_final, key),
+            )
+        else:
+            db.execute("DELETE FROM latest WHERE key = ?", (key,))
+
+    def record(self, base, name, pkg, fetched):
+        """
+        Store the latest versions in the project document ``pkg``, which was
+        fetched from the index at ``base`` at time ``fetched``.  Documents
+        fetched before the last sync are ignored, as changes between their
+        fetching and the sync would be missed.
+        """
+        row = self.synced(base)
+        if row is None or fetched < row[1] or not pkg.get("releases"):
+            return
+        newest = select_latest(pkg, pre=True, newest=True)
+        newest_final = select_latest(pkg, newest=True)
+        if newest_final is not None and parse(newest_final).is_prerelease:
+            # `select_latest()` only falls back to prereleases when there are
+            # no other releases.
+            newest_final = None
+        highest_final = select_latest(pkg)
+        if parse(highest_final).is_prerelease:
+            highest_final = None
+        with self._lock, self.connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.key(base, name),
+                    select_latest(pkg, pre=True),
+                    highest_final,
+                    newest,
+                    upload_time(pkg, newest),
+                    newest_final,
+                    upload_time(pkg, newest_final),
+                ),
+            )
+
+    def discard(self, base, name):
+        with self._lock, self.connect() as db:
+            db.execute("DELETE FROM latest WHERE key = ?", (self.key(base, name),))
+
+    def lookup(self, base, name, pre=False, newest=False):
+        """
+        Return the version that `select_latest()` would choose for the project
+        ``name`` on the index at ``base``, or `None` if it is not known
+        """
+        with self._lock:
+            row = (
+                self.connect()
+                .execute(
+                    "SELECT highest, highest_final, newest, newest_final"
+                    " FROM latest WHERE key = ?",
+                    (self.key(base, name),),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        highest, highest_final, newest_any, newest_final = row
+        if pre or highest_final is None:
+            return newest_any if newest else highest
+        else:
+            return newest_final if newest else highest_final
+
+
+def upload_time(pkg, version):
+    if version is None:
+        return None
+    return first_upload(pkg["releases"][version])
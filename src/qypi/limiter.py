@@ -0,0 +1,135 @@
+from collections import deque
+import threading
+from time import monotonic
+
+
+class AdaptiveLimiter:
+    """
+    Limits the number of requests in flight at once, adjusting the limit
+    between ``min_limit`` and ``max_limit`` according to how the index copes
+    (additive increase, multiplicative decrease).
+
+    Each request that succeeds while at least half of the limit is in use
+    raises the limit by one.  A request that fails, is answered with a 429 or
+    5xx response, or brings the smoothed latency above ``tolerance`` times the
+    lowest latency among the last ``window`` requests multiplies the limit by
+    ``backoff``.  Requests that were already in flight when the limit was cut
+    back do not cut it back again, as they were sent under the old limit.
+    Latency is only taken into account once ``min_samples`` requests have
+    completed.
+    """
+
+    def __init__(
+        self,
+        min_limit=1,
+        max_limit=10,
+        initial=None,
+        backoff=0.5,
+        tolerance=2.0,
+        smoothing=0.2,
+        min_samples=10,
+        window=100,
+        clock=monotonic,
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.min_samples = min_samples
+        self.clock = clock
+        self.limit = float(initial if initial is not None else min_limit)
+        #: The lowest & highest limits reached
+        self.low = self.high = self.current
+        self.inflight = 0
+        self.requests = 0
+        self.cutbacks = 0
+        #: Total time in seconds that requests have spent waiting for the
+        #: limit to allow them
+        self.wait_time = 0.0
+        #: Exponentially-weighted moving average of recent latencies
+        self.smoothed = None
+        self.latencies = deque(maxlen=window)
+        #: When the limit was last cut back
+        self.last_cut = None
+        self._cond = threading.Condition()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_cond"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._cond = threading.Condition()
+
+    @property
+    def current(self):
+        """The current limit as a whole number of requests"""
+        return int(self.limit)
+
+    def acquire(self):
+        """
+        Wait until fewer than the current limit of requests are in flight and
+        then start a request, returning its start time for passing to
+        `release()`
+        """
+        with self._cond:
+            if self.inflight >= self.current:
+                start = self.clock()
+                while self.inflight >= self.current:
+                    self._cond.wait()
+                self.wait_time += self.clock() - start
+            self.inflight += 1
+            return self.clock()
+
+    def release(self, started, overloaded=False):
+        """
+        Finish a request started at ``started`` and adjust the limit.
+        ``overloaded`` should be true if the request failed or the index
+        reported being overloaded.
+        """
+        elapsed = self.clock() - started
+        with self._cond:
+            self.inflight -= 1
+            self.requests += 1
+            if not overloaded:
+                self.latencies.append(elapsed)
+                if self.smoothed is None:
+                    self.smoothed = elapsed
+                else:
+                    self.smoothed += self.smoothing * (elapsed - self.smoothed)
+                if len(
+                    self.latencies
+                ) >= self.min_samples and self.smoothed > self.tolerance * min(
+                    self.latencies
+                ):
+                    overloaded = True
+            if overloaded:
+                if self.last_cut is None or started >= self.last_cut:
+                    self.limit = max(self.min_limit, self.limit * self.backoff)
+                    self.last_cut = self.clock()
+                    self.cutbacks += 1
+                    # Judge the new limit on latencies observed under it.
+                    self.smoothed = None
+            elif 2 * (self.inflight + 1) >= self.limit:
+                self.limit = min(self.max_limit, self.limit + 1)
+            self.low = min(self.low, self.current)
+            self.high = max(self.high, self.current)
+            self._cond.notify_all()
+
+    def call(self, func, overloaded=None, failed=None):
+        """
+        Call ``func()`` once the limit allows it, and return its result.  The
+        limit is cut back if ``overloaded(result)`` is true or if ``func()``
+        raises an exception ``e`` for which ``failed(e)`` is true (by default,
+        any exception).
+        """
+        started = self.acquire()
+        try:
+            result = func()
+        except Exception as e:
+            self.release(started, overloaded=failed is None or failed(e))
+            raise
+        self.release(started, overloaded=overloaded is not None and overloaded(result))
+        return result
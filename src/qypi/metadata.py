@@ -0,0 +1,127 @@
+from email.parser import BytesParser
+from email.policy import compat32
+from packaging.utils import (
+    InvalidSdistFilename,
+    InvalidWheelFilename,
+    parse_sdist_filename,
+    parse_wheel_filename,
+)
+from packaging.version import InvalidVersion, parse
+
+#: The ``Accept`` header for requesting the JSON form of Simple API pages
+#: (PEP 691)
+SIMPLE_JSON = "application/vnd.pypi.simple.v1+json"
+
+#: The fields of a JSON API ``info`` mapping that are filled in from single
+#: core metadata fields
+SINGLE_FIELDS = {
+    "name": "Name",
+    "version": "Version",
+    "summary": "Summary",
+    "home_page": "Home-page",
+    "download_url": "Download-URL",
+    "author": "Author",
+    "author_email": "Author-email",
+    "maintainer": "Maintainer",
+    "maintainer_email": "Maintainer-email",
+    "license": "License",
+    "keywords": "Keywords",
+    "platform": "Platform",
+    "requires_python": "Requires-Python",
+    "description_content_type": "Description-Content-Type",
+}
+
+#: The fields of a JSON API ``info`` mapping that are filled in from
+#: multiple-use core metadata fields
+MULTIPLE_FIELDS = {
+    "classifiers": "Classifier",
+    "requires_dist": "Requires-Dist",
+    "provides_extra": "Provides-Extra",
+}
+
+#: All of the ``info`` fields that can be determined from core metadata
+METADATA_INFO_FIELDS = frozenset(
+    [*SINGLE_FIELDS, *MULTIPLE_FIELDS, "project_urls", "description"]
+)
+
+
+def simple_url(index_url):
+    """
+    Return the base URL of the Simple API for the JSON API at ``index_url``,
+    or `None` if it can't be determined
+    """
+    base = index_url.rstrip("/")
+    if base.endswith("/pypi"):
+        return base[: -len("pypi")] + "simple"
+    return None
+
+
+def dist_version(filename):
+    """
+    Return the version of the wheel or sdist named ``filename`` as a
+    `~packaging.version.Version`, or `None` if it's neither
+    """
+    try:
+        if filename.endswith(".whl"):
+            return parse_wheel_filename(filename)[1]
+        else:
+            return parse_sdist_filename(filename)[1]
+    except (InvalidWheelFilename, InvalidSdistFilename, InvalidVersion):
+        return None
+
+
+def metadata_files(page, version):
+    """
+    Return the files on the Simple API JSON page ``page`` for the given
+    version that have core metadata files available (PEP 658/714), wheels
+    first
+    """
+    if not isinstance(page, dict):
+        return []
+    try:
+        v = parse(version)
+    except InvalidVersion:
+        return []
+    files = [
+        f
+        for f in page.get("files", [])
+        if (f.get("core-metadata") or f.get("data-dist-info-metadata"))
+        and not f.get("yanked")
+        and dist_version(f["filename"]) == v
+    ]
+    files.sort(key=lambda f: not f["filename"].endswith(".whl"))
+    return files
+
+
+def metadata_digest(f):
+    """
+    Return the SHA256 digest of the core metadata file for the Simple API file
+    entry ``f``, if given
+    """
+    meta = f.get("core-metadata") or f.get("data-dist-info-metadata")
+    if isinstance(meta, dict):
+        return meta.get("sha256")
+    return None
+
+
+def parse_core_metadata(body):
+    """
+    Parse the core metadata file ``body`` (a `bytes` object) into a `dict` of
+    the corresponding JSON API ``info`` fields
+    """
+    msg = BytesParser(policy=compat32).parsebytes(body)
+    info = {field: msg.get(header) for field, header in SINGLE_FIELDS.items()}
+    for field, header in MULTIPLE_FIELDS.items():
+        info[field] = msg.get_all(header)
+    if info["classifiers"] is None:
+        info["classifiers"] = []
+    project_urls = {}
+    for v in msg.get_all("Project-URL", []):
+        label, _, url = v.partition(",")
+        project_urls[label.strip()] = url.strip()
+    info["project_urls"] = project_urls or None
+    description = msg.get_payload()
+    if not description:
+        description = msg.get("Description")
+    info["description"] = description or None
+    return info
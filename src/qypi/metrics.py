@@ -0,0 +1,218 @@
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+from pathlib import Path
+import tempfile
+import threading
+
+#: Upper bounds (in seconds) of the buckets of the request latency histogram
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metrics:
+    """
+    Counters and histograms of the requests made during a run, rendered in
+    the Prometheus text exposition format.
+
+    Requests are labelled by API (``json`` or ``xmlrpc``) and outcome: the
+    HTTP status code for JSON API requests, ``ok`` or ``error`` for XML-RPC
+    requests, and ``timeout`` for requests that timed out.
+    """
+
+    def __init__(self):
+        self.requests = {}
+        #: Per-API bucket counts (the last being for ``+Inf``), sums, and
+        #: counts of request durations
+        self.latencies = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def observe(self, api, status, elapsed, bytes_in=0, bytes_out=0):
+        """Record a completed (or failed) request"""
+        with self._lock:
+            key = (api, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            buckets, total, count = self.latencies.get(
+                api, ([0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0)
+            )
+            buckets[bisect_left(LATENCY_BUCKETS, elapsed)] += 1
+            self.latencies[api] = (buckets, total + elapsed, count + 1)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def drain(self):
+        """
+        Return the metrics recorded so far in a picklable form for passing to
+        `merge()` (e.g., from a worker process to its parent), and reset them
+        """
+        with self._lock:
+            snapshot = (self.requests, self.latencies, self.bytes_in, self.bytes_out)
+            self.requests = {}
+            self.latencies = {}
+            self.bytes_in = self.bytes_out = 0
+        return snapshot
+
+    def merge(self, snapshot):
+        """Add the metrics from a snapshot returned by `drain()`"""
+        requests, latencies, bytes_in, bytes_out = snapshot
+        with self._lock:
+            for key, n in requests.items():
+                self.requests[key] = self.requests.get(key, 0) + n
+            for api, (buckets, total, count) in latencies.items():
+                if api in self.latencies:
+                    mybuckets, mytotal, mycount = self.latencies[api]
+                    buckets = [a + b for a, b in zip(mybuckets, buckets)]
+                    total += mytotal
+                    count += mycount
+                self.latencies[api] = (list(buckets), total, count)
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def render(self, extra=()):
+        """
+        Return the metrics in the Prometheus text format.  ``extra`` is an
+        iterable of further ``(name, type, help, value)`` metrics to include.
+        """
+        lines = []
+
+        def header(name, mtype, helptext):
+            lines.append(f"# HELP {name} {helptext}")
+            lines.append(f"# TYPE {name} {mtype}")
+
+        with self._lock:
+            header("qypi_requests_total", "counter", "Requests made to the index")
+            for (api, status), n in sorted(self.requests.items()):
+                lines.append(
+                    f'qypi_requests_total{{api="{api}",status="{status}"}} {n}'
+                )
+            header(
+                "qypi_request_duration_seconds",
+                "histogram",
+                "Time taken by requests to the index",
+            )
+            for api, (buckets, total, count) in sorted(self.latencies.items()):
+                cumulative = 0
+                for bound, n in zip((*LATENCY_BUCKETS, "+Inf"), buckets):
+                    cumulative += n
+                    lines.append(
+                        f'qypi_request_duration_seconds_bucket{{api="{api}",'
+                        f'le="{bound}"}} {cumulative}'
+                    )
+                lines.append(
+                    f'qypi_request_duration_seconds_sum{{api="{api}"}} {total}'
+                )
+                lines.append(
+                    f'qypi_request_duration_seconds_count{{api="{api}"}} {count}'
+                )
+            header(
+                "qypi_received_bytes_total",
+                "counter",
+                "Size of the response bodies received from the index",
+            )
+            lines.append(f"qypi_received_bytes_total {self.bytes_in}")
+            header(
+                "qypi_sent_bytes_total",
+                "counter",
+                "Approximate size of the requests sent to the index",
+            )
+            lines.append(f"qypi_sent_bytes_total {self.bytes_out}")
+        for name, mtype, helptext, value in extra:
+            header(name, mtype, helptext)
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def write_textfile(path, text):
+    """
+    Write ``text`` to ``path`` atomically, so that a collector reading the
+    file never sees a partial write
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            fp.write(text)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class MetricsExporter:
+    """
+    Exports the metrics returned by ``render()`` by writing them to a
+    textfile (at `close()` and, if ``interval`` is set, every ``interval``
+    seconds) and/or serving them over HTTP on ``port`` on the loopback
+    interface
+    """
+
+    def __init__(self, render, path=None, interval=None, port=None):
+        self.render = render
+        self.path = path
+        self.interval = interval
+        self.port = port
+        self.server = None
+        self.writer = None
+        self._stop = threading.Event()
+        self.closed = False
+
+    def start(self):
+        if self.port is not None:
+            render = self.render
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header(
+                        "Content-Type", "text/plain; version=0.0.4; charset=utf-8"
+                    )
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, *_args):
+                    pass
+
+            self.server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        if self.path is not None and self.interval is not None:
+            self.writer = threading.Thread(target=self._write_periodically, daemon=True)
+            self.writer.start()
+
+    def _write_periodically(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def write(self):
+        if self.path is not None:
+            write_textfile(self.path, self.render())
+
+    def close(self):
+        """Stop exporting, writing the metrics file one last time"""
+        if self.closed:
+            return
+        self.closed = True
+        self._stop.set()
+        if self.writer is not None:
+            self.writer.join()
+            self.writer = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+        self.write()
@@ -0,0 +1,86 @@
+import cProfile
+import io
+import pstats
+import sys
+import threading
+import tracemalloc
+import click
+
+#: The supported profilers and the default filenames of their output
+PROFILERS = {
+    "cprofile": "qypi.prof",
+    "tracemalloc": "qypi.tracemalloc",
+}
+
+
+class Profiler:
+    """
+    Profiles the code run between `start()` and `stop()` with either
+    `cProfile` (CPU time per function) or `tracemalloc` (memory allocated per
+    line).  When stopped, the full results are written to ``path`` (as a
+    `pstats` file or a `tracemalloc.Snapshot` dump, respectively) and the top
+    ``top`` entries are written to stderr.
+
+    `cProfile` covers every thread on Python 3.12 and up.  On earlier
+    versions, it only profiles the thread that enables it, so each thread
+    started while profiling gets a profiler of its own, and their results are
+    merged.
+    """
+
+    def __init__(self, mode, path=None, top=20):
+        if mode not in PROFILERS:
+            raise ValueError(f"Unknown profiler: {mode!r}")
+        self.mode = mode
+        self.path = path if path is not None else PROFILERS[mode]
+        self.top = top
+        self.profiler = None
+        #: Profilers for threads other than the one calling `start()`
+        self.thread_profilers = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.mode == "cprofile":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+            if sys.version_info < (3, 12):
+                threading.setprofile(self._profile_thread)
+        else:
+            # Keep enough frames to see which command code led to each
+            # allocation
+            tracemalloc.start(25)
+
+    def stop(self):
+        if self.mode == "cprofile":
+            if self.profiler is None:
+                return
+            threading.setprofile(None)
+            self.profiler.disable()
+            out = io.StringIO()
+            with self._lock:
+                stats = pstats.Stats(self.profiler, *self.thread_profilers, stream=out)
+                self.thread_profilers = []
+            stats.dump_stats(self.path)
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top)
+            self.profiler = None
+            summary = out.getvalue().strip("\n")
+        else:
+            if not tracemalloc.is_tracing():
+                return
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            snapshot.dump(self.path)
+            lines = [f"Current: {current} bytes; peak: {peak} bytes"]
+            for stat in snapshot.statistics("lineno")[: self.top]:
+                lines.append(str(stat))
+            summary = "\n".join(lines)
+        click.echo(f"[profile] {self.mode} results written to {self.path}", err=True)
+        click.echo(summary, err=True)
+
+    def _profile_thread(self, _frame, _event, _arg):
+        # Called by the first profiling event in each new thread; enabling a
+        # profiler replaces this function for the rest of the thread.
+        profiler = cProfile.Profile()
+        with self._lock:
+            self.thread_profilers.append(profiler)
+        profiler.enable()
@@ -5,6 +5,8 @@ from operator import itemgetter
 from textwrap import indent
 import click
 from packaging.version import parse
+from .cache import DEFAULT_TTLS
+from .where import Where, WhereError
 
 
 def obj_option(*args, **kwargs):
@@ -41,6 +43,70 @@ sort_opt = obj_option(
 )
 
 
+unordered_opt = obj_option(
+    "--unordered/--ordered",
+    default=False,
+    help="Output results as soon as they are ready rather than in argument"
+    " order, labelling each with the argument it is for  [default: ordered]",
+)
+
+
+def parse_fields(_ctx, _param, value):
+    if not value:
+        return None
+    fields = []
+    for v in value:
+        for f in v.split(","):
+            f = f.strip()
+            if f and f not in fields:
+                fields.append(f)
+    return fields
+
+
+fields_opt = click.option(
+    "-F",
+    "--fields",
+    multiple=True,
+    metavar="FIELD[,FIELD...]",
+    callback=parse_fields,
+    help="Only output the given fields of each result.  Can be given multiple times.",
+)
+
+
+def where_opt(level):
+    """
+    Return a ``--where`` option for filtering the command's results, which
+    are releases (``level="release"``) or files (``level="file"``)
+    """
+
+    def callback(ctx, _param, value):
+        try:
+            where = Where(*value) if value else None
+        except WhereError as e:
+            raise click.BadParameter(str(e))
+        ctx.obj.where = where
+        ctx.obj.where_level = level
+        return where
+
+    return click.option(
+        "--where",
+        multiple=True,
+        metavar="EXPR",
+        callback=callback,
+        help="Only show results matching EXPR.  Can be given multiple times.",
+    )
+
+
+def project(d, fields):
+    """
+    Return a `dict` of just the items of ``d`` whose keys are in ``fields``,
+    or ``d`` itself if ``fields`` is `None`
+    """
+    if fields is None:
+        return d
+    return {k: d[k] for k in fields if k in d}
+
+
 def package_args(versioned=True):
     if versioned:
 
@@ -63,6 +129,55 @@ def package_args(versioned=True):
         )
 
 
+class ByteSize(click.ParamType):
+    """
+    A click parameter type for byte counts, optionally suffixed with ``K``,
+    ``M``, or ``G`` (powers of 1024)
+    """
+
+    name = "size"
+
+    UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+    def convert(self, value, param, ctx):
+        if isinstance(value, int):
+            return value
+        s = value.strip().upper().removesuffix("B")
+        unit = s[-1:] if s[-1:] in self.UNITS else ""
+        try:
+            n = int(s.removesuffix(unit))
+        except ValueError:
+            self.fail(f"{value!r} is not a valid size", param, ctx)
+        if n < 0:
+            self.fail(f"{value!r} is not a valid size", param, ctx)
+        return n * self.UNITS[unit]
+
+
+def parse_ttls(_ctx, param, value):
+    """
+    Callback for options of the form ``KIND=SECONDS`` that can be given
+    multiple times, where ``KIND`` is a kind of response cache entry
+    """
+    ttls = {}
+    for v in value:
+        kind, eq, secs = v.partition("=")
+        kind = kind.strip()
+        try:
+            if not eq:
+                raise ValueError(v)
+            ttls[kind] = float(secs)
+        except ValueError:
+            raise click.BadParameter(
+                f"{v!r}: expected KIND=SECONDS", param=param
+            ) from None
+        if kind not in DEFAULT_TTLS:
+            raise click.BadParameter(
+                f"{kind!r}: unknown kind; expected one of " + ", ".join(DEFAULT_TTLS),
+                param=param,
+            )
+    return ttls
+
+
 def dumps(obj):
     if isinstance(obj, Iterator):
         obj = list(obj)
@@ -0,0 +1,143 @@
+from datetime import datetime, timezone
+import re
+import time
+from xmlrpc.client import Error as XMLRPCError
+import click
+from packaging.utils import canonicalize_name
+from .api import QyPIError
+from .metrics import write_textfile
+
+#: Patterns for the changelog actions that `Watcher` reports and the names of
+#: the corresponding event types
+EVENT_TYPES = [
+    (re.compile(r"new release"), "release"),
+    (re.compile(r"add (?P<python_version>\S+) file (?P<filename>.+)"), "file_added"),
+    (re.compile(r"remove file (?P<filename>.+)"), "file_removed"),
+    (re.compile(r"remove release"), "release_removed"),
+    (re.compile(r"remove project"), "project_removed"),
+    (re.compile(r"yank release"), "release_yanked"),
+    (re.compile(r"unyank release"), "release_unyanked"),
+]
+
+#: The maximum number of changelog entries that the index returns per call;
+#: if a call returns this many, there may be more
+CHANGELOG_LIMIT = 50000
+
+
+def parse_event(name, version, timestamp, action, serial):
+    """
+    Convert an entry returned by the XML-RPC ``changelog_since_serial`` method
+    to an event `dict`.  Actions not listed in `EVENT_TYPES` are given the
+    type ``"other"``.
+    """
+    event = {
+        "serial": serial,
+        "name": name,
+        "version": version or None,
+        "timestamp": datetime.fromtimestamp(timestamp, timezone.utc).strftime(
+            "%Y-%m-%dT%H:%M:%SZ"
+        ),
+        "action": action,
+        "event": "other",
+    }
+    for rgx, etype in EVENT_TYPES:
+        m = rgx.fullmatch(action)
+        if m is not None:
+            event["event"] = etype
+            event.update(m.groupdict())
+            break
+    return event
+
+
+class Watcher:
+    """
+    Follows an index's changelog, starting from the serial number stored in
+    ``state_file`` and updating it after each poll, so that each change is
+    reported once across runs.
+
+    If ``watchlist`` is given, only changes to the projects named in it are
+    reported.  If ``cache`` is given, the cached documents for each reported
+    project and release are deleted from it.
+    """
+
+    def __init__(self, qypi, state_file, watchlist=None, cache=None, all_events=False):
+        self.qypi = qypi
+        self.state_file = state_file
+        self.watchlist = (
+            {canonicalize_name(n) for n in watchlist} if watchlist is not None else None
+        )
+        self.cache = cache
+        self.all_events = all_events
+
+    def load_serial(self):
+        try:
+            return int(self.state_file.read_text().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def save_serial(self, serial):
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        write_textfile(self.state_file, f"{serial}\n")
+
+    def poll(self, since):
+        """
+        Fetch the changes made after serial ``since``, returning a list of the
+        events to report and the serial of the latest change
+        """
+        events = []
+        while True:
+            changes = self.qypi.xmlrpc("changelog_since_serial", since)
+            for name, version, timestamp, action, serial in changes:
+                since = max(since, serial)
+                if (
+                    self.watchlist is not None
+                    and canonicalize_name(name) not in self.watchlist
+                ):
+                    continue
+                if self.cache is not None:
+                    self.invalidate(name, version)
+                event = parse_event(name, version, timestamp, action, serial)
+                if event["event"] != "other" or self.all_events:
+                    events.append(event)
+            if len(changes) < CHANGELOG_LIMIT:
+                return events, since
+
+    def invalidate(self, name, version):
+        keys = [self.qypi.cache_key(name, "json")]
+        if version:
+            keys.append(self.qypi.cache_key(name, version, "json"))
+        for k in keys:
+            self.cache.delete(k)
+
+    def run(self, emit, since=None, follow=False, interval=60, sleep=time.sleep):
+        """
+        Poll the changelog once (or, if ``follow`` is true, every ``interval``
+        seconds forever), calling ``emit()`` on each event to report.  If
+        ``since`` is `None`, the serial in the state file is used; if there is
+        no state file either, watching starts from the index's current serial.
+        Returns the last serial seen.
+        """
+        if since is None:
+            since = self.load_serial()
+        if since is None:
+            since = self.qypi.xmlrpc("changelog_last_serial")
+            self.save_serial(since)
+            if not follow:
+                return since
+            sleep(interval)
+        while True:
+            try:
+                events, serial = self.poll(since)
+            except (OSError, XMLRPCError, QyPIError) as e:
+                if not follow:
+                    raise
+                click.echo(f"[watch] changelog poll failed: {e}", err=True)
+            else:
+                for ev in events:
+                    emit(ev)
+                if serial != since:
+                    self.save_serial(serial)
+                    since = serial
+            if not follow:
+                return since
+            sleep(interval)
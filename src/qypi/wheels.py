@@ -0,0 +1,100 @@
+from functools import lru_cache
+import re
+from packaging.tags import compatible_tags, cpython_tags, mac_platforms
+from packaging.utils import InvalidWheelFilename, parse_wheel_filename
+
+#: The old names of manylinux platforms, by glibc version
+LEGACY_MANYLINUX = {
+    (2, 17): "manylinux2014",
+    (2, 12): "manylinux2010",
+    (2, 5): "manylinux1",
+}
+
+target_rgx = re.compile(r"cp(?P<major>\d)(?P<minor>\d+)-(?P<platform>\w+)")
+glibc_rgx = re.compile(r"(?P<libc>manylinux|musllinux)_(\d+)_(\d+)_(?P<arch>\w+)")
+macos_rgx = re.compile(r"macosx_(\d+)_(\d+)_(?P<arch>\w+)")
+
+
+@lru_cache(maxsize=None)
+def supported_tags(target):
+    """
+    Return a `dict` mapping the tags of the wheels that can be installed on
+    ``target`` to their priorities (lower is better), as installers rank
+    them.  ``target`` is a string of the form ``cpXY-PLATFORM`` (e.g.,
+    ``cp312-manylinux_2_28_aarch64`` or ``cp311-win_amd64``), where
+    ``PLATFORM`` is the newest platform tag the target supports.  Raises a
+    `ValueError` if ``target`` is not of this form.
+    """
+    m = target_rgx.fullmatch(target)
+    if m is None:
+        raise ValueError(f"{target!r}: expected a target of the form cpXY-PLATFORM")
+    python_version = (int(m["major"]), int(m["minor"]))
+    interpreter = "cp{}{}".format(*python_version)
+    platforms = compatible_platforms(m["platform"])
+    tags = [
+        *cpython_tags(python_version, abis=[interpreter], platforms=platforms),
+        *compatible_tags(python_version, interpreter, platforms),
+    ]
+    return {t: i for i, t in reversed(list(enumerate(tags)))}
+
+
+def compatible_platforms(platform):
+    """
+    Return a list of the platform tags whose wheels can be installed on
+    ``platform``, most specific first
+    """
+    for (major, minor), old in LEGACY_MANYLINUX.items():
+        if platform.startswith(old + "_"):
+            platform = f"manylinux_{major}_{minor}" + platform[len(old) :]
+            break
+    m = glibc_rgx.fullmatch(platform)
+    if m is not None:
+        libc, major, minor, arch = m[1], int(m[2]), int(m[3]), m["arch"]
+        platforms = []
+        for v in range(minor, -1, -1):
+            platforms.append(f"{libc}_{major}_{v}_{arch}")
+            if libc == "manylinux" and (major, v) in LEGACY_MANYLINUX:
+                platforms.append(f"{LEGACY_MANYLINUX[major, v]}_{arch}")
+        platforms.append(f"linux_{arch}")
+        return platforms
+    m = macos_rgx.fullmatch(platform)
+    if m is not None:
+        return list(mac_platforms((int(m[1]), int(m[2])), m["arch"]))
+    return [platform]
+
+
+@lru_cache(maxsize=None)
+def wheel_tags(filename):
+    """
+    Return the `frozenset` of tags of the wheel named ``filename``, or `None`
+    if ``filename`` is not a valid wheel filename
+    """
+    if not filename.endswith(".whl"):
+        return None
+    try:
+        _, _, _, tags = parse_wheel_filename(filename)
+    except InvalidWheelFilename:
+        return None
+    return tags
+
+
+def best_wheel(files, target):
+    """
+    Return the filename of the wheel in ``files`` (a list of file `dict`s
+    from the index) that an installer would pick for ``target``, or `None`
+    if none of them are compatible
+    """
+    priorities = supported_tags(target)
+    best, best_priority = None, None
+    for f in files:
+        tags = wheel_tags(f["filename"])
+        if not tags:
+            continue
+        priority = min((priorities[t] for t in tags if t in priorities), default=None)
+        if priority is not None and (best is None or priority < best_priority):
+            best, best_priority = f["filename"], priority
+    return best
+
+
+def has_sdist(files):
+    return any(f.get("packagetype") == "sdist" for f in files)
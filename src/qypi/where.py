@@ -0,0 +1,247 @@
+from fnmatch import fnmatchcase
+import re
+from packaging.specifiers import InvalidSpecifier, SpecifierSet
+from packaging.version import InvalidVersion, Version
+
+#: Fields whose values are compared as PEP 440 versions rather than as strings
+VERSION_FIELDS = {"version"}
+
+TOKEN_RGX = re.compile(
+    r"""
+    \s*
+    (?:
+        (?P<punct>[()])
+        | (?P<op>==|!=|<=|>=|<|>|~)
+        | "(?P<dq>(?:[^"\\]|\\.)*)"
+        | '(?P<sq>(?:[^'\\]|\\.)*)'
+        | (?P<word>[^\s()<>=!~"']+)
+    )
+    """,
+    flags=re.X,
+)
+
+KEYWORDS = {"and", "or", "not", "allows", "true", "false", "null"}
+
+LITERALS = {"true": True, "false": False, "null": None}
+
+#: Sentinel for a field that a record does not have
+MISSING = object()
+
+
+class WhereError(ValueError):
+    pass
+
+
+class Where:
+    """
+    A parsed ``--where`` expression, or the conjunction of several.
+
+    Expressions consist of comparisons of the form ``FIELD OP VALUE``, where
+    ``OP`` is one of ``==``, ``!=``, ``<``, ``<=``, ``>``, ``>=``, ``~`` (glob
+    match), or ``allows`` (for testing whether a version specifier such as
+    ``requires_python`` admits a given version), and bare field names (true if
+    the field's value is truthy), combined with ``and``, ``or``, ``not``, and
+    parentheses.  A field name may contain dots in order to refer to a field
+    of a nested object.
+
+    Expressions are evaluated with three-valued logic: a comparison involving
+    a field that the record does not have is neither true nor false, and a
+    record only matches if the expression as a whole is true.  This allows an
+    expression to be evaluated against a record containing only some of a
+    result's fields (e.g., those available from the project document) and
+    reliably rule the result out before the rest of it is fetched.
+    """
+
+    def __init__(self, *exprs):
+        self.exprs = exprs
+        #: The names of the top-level fields referenced by the expression
+        self.fields = set()
+        trees = []
+        for e in exprs:
+            self.tokens = tokenize(e)
+            self.pos = 0
+            trees.append(self.parse_or())
+            if self.pos < len(self.tokens):
+                raise WhereError(f"unexpected {self.tokens[self.pos][1]!r}")
+        del self.tokens, self.pos
+        self.tree = trees[0] if len(trees) == 1 else ("and", trees)
+
+    def __repr__(self):
+        return "Where({})".format(", ".join(map(repr, self.exprs)))
+
+    def __call__(self, record):
+        """Return whether ``record`` matches the expression"""
+        return self.evaluate(record) is True
+
+    def evaluate(self, record):
+        """
+        Evaluate the expression against ``record``, returning `True`,
+        `False`, or `None` if the result depends on fields that ``record``
+        lacks
+        """
+        return evaluate(self.tree, record)
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        tok = self.peek()
+        if tok[0] is None:
+            raise WhereError("unexpected end of expression")
+        self.pos += 1
+        return tok
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek() == ("word", "or"):
+            self.pos += 1
+            terms.append(self.parse_and())
+        return terms[0] if len(terms) == 1 else ("or", terms)
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.peek() == ("word", "and"):
+            self.pos += 1
+            terms.append(self.parse_not())
+        return terms[0] if len(terms) == 1 else ("and", terms)
+
+    def parse_not(self):
+        if self.peek() == ("word", "not"):
+            self.pos += 1
+            return ("not", self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.next()
+        if (kind, value) == ("punct", "("):
+            tree = self.parse_or()
+            if self.next() != ("punct", ")"):
+                raise WhereError("expected ')'")
+            return tree
+        if kind != "word" or value in KEYWORDS:
+            raise WhereError(f"expected field name, got {value!r}")
+        field = value.split(".")
+        self.fields.add(field[0])
+        op = self.peek()
+        if op[0] == "op" or op == ("word", "allows"):
+            self.pos += 1
+            return ("cmp", field, op[1], self.parse_value(op[1]))
+        else:
+            return ("truthy", field)
+
+    def parse_value(self, op):
+        kind, value = self.next()
+        if kind == "str":
+            return value
+        if kind != "word" or value in KEYWORDS - LITERALS.keys():
+            raise WhereError(f"expected value after {op!r}, got {value!r}")
+        return LITERALS.get(value, value)
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    expr = expr.rstrip()
+    while pos < len(expr):
+        m = TOKEN_RGX.match(expr, pos)
+        if not m:
+            raise WhereError(f"invalid syntax at {expr[pos:].lstrip()!r}")
+        pos = m.end()
+        if m["punct"] is not None:
+            tokens.append(("punct", m["punct"]))
+        elif m["op"] is not None:
+            tokens.append(("op", m["op"]))
+        elif m["word"] is not None:
+            tokens.append(("word", m["word"]))
+        else:
+            s = m["dq"] if m["dq"] is not None else m["sq"]
+            tokens.append(("str", re.sub(r"\\(.)", r"\1", s)))
+    return tokens
+
+
+def evaluate(tree, record):
+    kind = tree[0]
+    if kind == "or":
+        result = False
+        for t in tree[1]:
+            r = evaluate(t, record)
+            if r is True:
+                return True
+            elif r is None:
+                result = None
+        return result
+    elif kind == "and":
+        result = True
+        for t in tree[1]:
+            r = evaluate(t, record)
+            if r is False:
+                return False
+            elif r is None:
+                result = None
+        return result
+    elif kind == "not":
+        r = evaluate(tree[1], record)
+        return None if r is None else not r
+    value = lookup(record, tree[1])
+    if value is MISSING:
+        return None
+    elif kind == "truthy":
+        return bool(value)
+    _, field, op, literal = tree
+    if isinstance(value, list):
+        return any(compare(field[-1], v, op, literal) for v in value)
+    return compare(field[-1], value, op, literal)
+
+
+def lookup(record, field):
+    value = record
+    for f in field:
+        try:
+            value = value[f]
+        except (KeyError, TypeError, IndexError):
+            return MISSING
+    return value
+
+
+def compare(field, value, op, literal):
+    if op == "allows":
+        if not value:
+            # No constraint
+            return True
+        try:
+            return SpecifierSet(value).contains(str(literal), prereleases=True)
+        except (InvalidSpecifier, InvalidVersion):
+            return False
+    elif op == "~":
+        return value is not None and fnmatchcase(str(value), str(literal))
+    a, b = str(value), literal
+    if isinstance(value, bool) or value is None or not isinstance(literal, str):
+        a = value
+    elif isinstance(value, (int, float)):
+        try:
+            a, b = value, float(literal)
+        except ValueError:
+            pass
+    elif field in VERSION_FIELDS:
+        try:
+            a, b = Version(str(value)), Version(literal)
+        except InvalidVersion:
+            return False
+    if op == "==":
+        return a == b
+    elif op == "!=":
+        return a != b
+    try:
+        if op == "<":
+            return a < b
+        elif op == "<=":
+            return a <= b
+        elif op == ">":
+            return a > b
+        else:
+            assert op == ">="
+            return a >= b
+    except TypeError:
+        return False
@@ -0,0 +1,109 @@
+import asyncio
+from types import SimpleNamespace
+from conftest import mkresponse
+import pytest
+from qypi.api import QyPIError
+
+httpx = pytest.importorskip("httpx")
+
+from qypi.aio import AsyncQyPI  # noqa: E402
+
+
+def mock_transport(calls):
+    def handler(request):
+        calls.append(str(request.url))
+        status, headers, body = mkresponse(SimpleNamespace(url=str(request.url)))
+        return httpx.Response(status, headers=headers, content=body)
+
+    return httpx.MockTransport(handler)
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_get_latest_version():
+    calls = []
+
+    async def main():
+        async with AsyncQyPI(transport=mock_transport(calls)) as obj:
+            return await asyncio.gather(
+                obj.get_latest_version("has-prerel"),
+                obj.get_latest_version("Has_Prerel"),
+            )
+
+    docs = run(main())
+    assert [d["info"]["version"] for d in docs] == ["1.0.0", "1.0.0"]
+    assert calls == [
+        "https://pypi.org/pypi/has-prerel/json",
+        "https://pypi.org/pypi/has-prerel/1.0.0/json",
+    ]
+
+
+def test_lookup_package_version():
+    async def main():
+        async with AsyncQyPI(
+            transport=mock_transport([]), all_versions=True, pre=True
+        ) as obj:
+            docs = [
+                d
+                async for d in obj.lookup_package_version(
+                    ["foobar", "nonexistent", "nullfields==1.0.0"]
+                )
+            ]
+            return docs, obj.errmsgs
+
+    docs, errmsgs = run(main())
+    assert [(d["info"]["name"], d["info"]["version"]) for d in docs] == [
+        ("foobar", "0.1.0"),
+        ("foobar", "0.2.0"),
+        ("foobar", "1.0.0"),
+        ("nullfields", "1.0.0"),
+    ]
+    assert errmsgs == ["nonexistent: package not found"]
+
+
+def test_get_version_not_found():
+    async def main():
+        async with AsyncQyPI(transport=mock_transport([])) as obj:
+            await obj.get_version("foobar", "9.9.9")
+
+    with pytest.raises(QyPIError, match=r"foobar: version 9\.9\.9 not found"):
+        run(main())
+
+
+def test_failure_not_memoized():
+    calls = []
+
+    def handler(request):
+        calls.append(str(request.url))
+        if len(calls) == 1:
+            return httpx.Response(503)
+        status, headers, body = mkresponse(SimpleNamespace(url=str(request.url)))
+        return httpx.Response(status, headers=headers, content=body)
+
+    async def main():
+        async with AsyncQyPI(transport=httpx.MockTransport(handler)) as obj:
+            with pytest.raises(httpx.HTTPStatusError):
+                await obj.get_package("foobar")
+            return await obj.get_package("foobar")
+
+    assert run(main())["info"]["name"] == "foobar"
+    assert calls == ["https://pypi.org/pypi/foobar/json"] * 2
+
+
+def test_memo_bounded():
+    calls = []
+
+    async def main():
+        async with AsyncQyPI(transport=mock_transport(calls), memo_size=1) as obj:
+            for name in ["foobar", "foobar", "has-prerel", "foobar"]:
+                await obj.get_package(name)
+            return len(obj.documents)
+
+    assert run(main()) == 1
+    assert calls == [
+        "https://pypi.org/pypi/foobar/json",
+        "https://pypi.org/pypi/has-prerel/json",
+        "https://pypi.org/pypi/foobar/json",
+    ]
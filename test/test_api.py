@@ -0,0 +1,330 @@
+from itertools import chain, repeat
+import json
+import re
+import threading
+import time
+from click.testing import CliRunner
+from conftest import mkresponse
+import pytest
+import responses
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import QyPI, SingleFlight, TimeoutSafeTransport
+
+
+def test_single_flight_concurrent():
+    flights = SingleFlight()
+    calls = []
+    barrier = threading.Barrier(8)
+
+    def fetch(key):
+        calls.append(key)
+        time.sleep(0.1)
+        return {"key": key}
+
+    results = []
+
+    def worker():
+        barrier.wait()
+        results.append(flights.do("foo", fetch, "foo"))
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls == ["foo"]
+    assert len(results) == 8
+    assert all(r is results[0] for r in results)
+
+
+def test_single_flight_exception():
+    flights = SingleFlight()
+    calls = []
+
+    def fail():
+        calls.append(None)
+        raise ValueError("nope")
+
+    for _ in range(2):
+        with pytest.raises(ValueError, match="nope"):
+            flights.do("foo", fail)
+    # Failures aren't remembered.
+    assert len(calls) == 2
+
+
+def test_single_flight_bounded():
+    flights = SingleFlight(maxsize=2)
+    calls = []
+
+    def fetch(key):
+        calls.append(key)
+        return key.upper()
+
+    for key in ["a", "b", "a", "c", "a", "b"]:
+        assert flights.do(key, fetch, key) == key.upper()
+    assert calls == ["a", "b", "c", "b"]
+    flights.forget("a")
+    flights.do("a", fetch, "a")
+    assert calls == ["a", "b", "c", "b", "a"]
+
+
+@pytest.mark.parametrize("jobs", ["1", "4"])
+def test_info_duplicate_specs(mock_pypi_json, jobs):
+    r = CliRunner().invoke(
+        qypi,
+        ["-j", jobs, "info", "foobar", "FooBar", "foobar==1.0.0", "FOOBAR"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    data = [(d["name"], d["version"]) for d in json.loads(r.output)]
+    assert data == [("foobar", "1.0.0")] * 4
+    assert sorted(c.request.url for c in mock_pypi_json.calls) == [
+        "https://pypi.org/pypi/foobar/1.0.0/json",
+        "https://pypi.org/pypi/foobar/json",
+    ]
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_parallel_output_matches_sequential():
+    args = ["files", "-A", "--pre", "has-prerel", "does-not-exist", "foobar"]
+    r1 = CliRunner().invoke(qypi, args)
+    r4 = CliRunner().invoke(qypi, ["--jobs", "4", *args])
+    assert r1.exit_code == r4.exit_code == 1
+    assert r4.stdout == r1.stdout
+    assert r4.stderr == r1.stderr == "qypi: does-not-exist: package not found\n"
+
+
+def test_timeouts(mock_pypi_json):
+    r = CliRunner().invoke(
+        qypi, ["--connect-timeout", "3", "--timeout", "7", "info", "foobar"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert mock_pypi_json.calls[0].request.req_kwargs["timeout"] == (3, 7)
+
+
+def test_deadline_exceeded(mocker):
+    monotonic = mocker.patch("qypi.api.monotonic", return_value=100.0)
+    obj = QyPI("https://pypi.org/pypi", deadline=5)
+    monotonic.return_value = 103.0
+    assert obj.request_timeout() == (2.0, 2.0)
+    mocker.patch("qypi.api.monotonic", side_effect=chain([100.0], repeat(105.5)))
+    r = CliRunner().invoke(qypi, ["--deadline", "5", "info", "foobar", "quux"])
+    assert r.exit_code == 1, show_result(r)
+    assert r.stdout == "[]\n"
+    assert r.stderr == "qypi: deadline exceeded\nqypi: deadline exceeded\n"
+
+
+def test_session_pool():
+    s = QyPI("https://pypi.org/pypi", jobs=32, keep_alive=False).make_session()
+    assert s.adapters["https://"]._pool_maxsize == 32
+    assert s.headers["Connection"] == "close"
+    s = QyPI("https://pypi.org/pypi", pool_size=4).make_session()
+    assert s.adapters["https://"]._pool_maxsize == 4
+    assert s.headers["Connection"] == "keep-alive"
+
+
+def test_xmlrpc_timeout(mocker):
+    spinstance = mocker.Mock(**{"list_packages.return_value": []})
+    spclass = mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    r = CliRunner().invoke(
+        qypi, ["--connect-timeout", "5", "--timeout", "7", "--no-keep-alive", "list"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    transport = spclass.call_args.kwargs["transport"]
+    assert isinstance(transport, TimeoutSafeTransport)
+    assert transport.timeout == 7
+    assert not transport.keep_alive
+
+
+INTERNAL = {
+    "internal-only": {
+        "name": "internal-only",
+        "version": "1.0",
+        "project_url": "https://internal.test/project/internal-only/",
+    },
+    "foobar": {
+        "name": "foobar",
+        "version": "9.9.9",
+        "project_url": "https://internal.test/project/foobar/",
+    },
+}
+
+
+def internal_response(r):
+    m = re.fullmatch(r"https://internal\.test/pypi/([^/]+)/json", r.url)
+    try:
+        info = INTERNAL[m[1]]
+    except (KeyError, TypeError):
+        return (404, {}, "Nope.")
+    return (
+        200,
+        {},
+        json.dumps(
+            {
+                "info": info,
+                "urls": [],
+                "releases": {info["version"]: []},
+            }
+        ),
+    )
+
+
+def delayed(callback, delay):
+    def wrapped(r):
+        time.sleep(delay)
+        return callback(r)
+
+    return wrapped
+
+
+@pytest.fixture
+def mock_internal(mock_pypi_json):
+    mock_pypi_json.add_callback(
+        responses.GET,
+        re.compile(r"^https://internal\.test/"),
+        callback=internal_response,
+        content_type="application/json",
+    )
+    return mock_pypi_json
+
+
+FEDERATED = ["-i", "https://internal.test/pypi", "-i", "https://pypi.org/pypi"]
+
+
+@pytest.mark.usefixtures("mock_internal")
+def test_federated_first():
+    r = CliRunner().invoke(
+        qypi, [*FEDERATED, "info", "foobar", "internal-only", "has-prerel"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert [(d["name"], d["version"]) for d in json.loads(r.output)] == [
+        ("foobar", "9.9.9"),
+        ("internal-only", "1.0"),
+        ("has_prerel", "1.0.0"),
+    ]
+
+
+@pytest.mark.usefixtures("mock_internal")
+def test_federated_merge():
+    r = CliRunner().invoke(
+        qypi, [*FEDERATED, "--index-policy", "merge", "releases", "foobar"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    versions = [rel["version"] for rel in json.loads(r.output)["foobar"]]
+    assert versions == ["0.1.0", "0.2.0", "1.0.0", "9.9.9"]
+
+
+@pytest.mark.usefixtures("mock_internal")
+def test_federated_not_found():
+    r = CliRunner().invoke(qypi, [*FEDERATED, "info", "does-not-exist"])
+    assert r.exit_code == 1, show_result(r)
+    assert r.stderr == "qypi: does-not-exist: package not found\n"
+
+
+def test_federated_concurrent():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=delayed(mkresponse, 0.3),
+            content_type="application/json",
+        )
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://internal\.test/"),
+            callback=delayed(internal_response, 0.3),
+            content_type="application/json",
+        )
+        start = time.monotonic()
+        r = CliRunner().invoke(
+            qypi,
+            [*FEDERATED, "--index-policy", "merge", "info", "has-prerel==1.0.0"],
+        )
+        elapsed = time.monotonic() - start
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)[0]["name"] == "has_prerel"
+    # Both indexes were queried at once rather than one after the other.
+    assert elapsed < 0.55
+
+
+def test_federated_fastest():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=mkresponse,
+            content_type="application/json",
+        )
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://internal\.test/"),
+            callback=delayed(internal_response, 0.3),
+            content_type="application/json",
+        )
+        r = CliRunner().invoke(
+            qypi, [*FEDERATED, "--index-policy", "fastest", "info", "foobar"]
+        )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)[0]["version"] == "1.0.0"
+
+
+def slow_foobar(r):
+    if "/foobar/" in r.url:
+        time.sleep(0.3)
+    return mkresponse(r)
+
+
+@pytest.mark.parametrize("cmd", ["info", "files"])
+def test_unordered(cmd):
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=slow_foobar,
+            content_type="application/json",
+        )
+        r = CliRunner().invoke(
+            qypi,
+            ["-j", "4", cmd, "--unordered", "foobar", "nullfields", "has-prerel"],
+        )
+    assert r.exit_code == 0, show_result(r)
+    data = json.loads(r.output)
+    assert data[-1]["spec"] == "foobar"
+    assert sorted((d["spec"], d["name"]) for d in data) == [
+        ("foobar", "foobar"),
+        ("has-prerel", "has_prerel"),
+        ("nullfields", "nullfields"),
+    ]
+
+
+def test_unordered_releases():
+    with responses.RequestsMock() as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=slow_foobar,
+            content_type="application/json",
+        )
+        r = CliRunner().invoke(
+            qypi, ["-j", "2", "releases", "--unordered", "foobar", "Has.Prerel"]
+        )
+    assert r.exit_code == 0, show_result(r)
+    assert list(json.loads(r.output)) == ["Has.Prerel", "foobar"]
+
+
+def test_unordered_owned(mocker):
+    def user_packages(user):
+        if user == "slow":
+            time.sleep(0.3)
+        return [["Owner", user + "-pkg"]]
+
+    spinstance = mocker.Mock(**{"user_packages.side_effect": user_packages})
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    r = CliRunner().invoke(qypi, ["-j", "3", "owned", "--unordered", "slow", "a", "b"])
+    assert r.exit_code == 0, show_result(r)
+    data = json.loads(r.output)
+    assert list(data)[-1] == "slow"
+    assert data["slow"] == [{"role": "Owner", "package": "slow-pkg"}]
+    r = CliRunner().invoke(qypi, ["-j", "3", "owned", "slow", "a", "b"])
+    assert r.exit_code == 0, show_result(r)
+    assert list(json.loads(r.output)) == ["slow", "a", "b"]
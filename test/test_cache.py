@@ -0,0 +1,346 @@
+import json
+import multiprocessing
+import os
+import random
+import time
+from click.testing import CliRunner
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import xmlrpc_cache_key
+from qypi.cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_put_get(tmp_path):
+    cache = ResponseCache(tmp_path)
+    assert cache.get("foo") is None
+    cache.put("project", "foo", b'{"foo": 42}')
+    entry = cache.get("foo")
+    assert entry is not None
+    assert entry.body == b'{"foo": 42}'
+    assert entry.status == 200
+    assert (cache.hits, cache.misses, cache.bytes_saved) == (1, 1, 11)
+
+
+def test_ttl_expiry(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(tmp_path, ttls={"project": 60}, clock=clock)
+    cache.put("project", "foo", b"project")
+    cache.put("version", "foo/1.0", b"version")
+    clock.now += 61
+    assert cache.get("foo") is None
+    assert cache.get("foo/1.0").body == b"version"
+    removed, _ = cache.prune()
+    assert removed == 1
+    assert cache.stats()["entries"] == 1
+
+
+def test_max_stale(tmp_path):
+    clock = FakeClock()
+    cache = ResponseCache(tmp_path, ttls={"project": 60}, max_stale=30, clock=clock)
+    cache.put("project", "foo", b"old")
+    clock.now += 80
+    entry = cache.get("foo")
+    assert entry.body == b"old"
+    assert cache.expired(entry.kind, entry.stored)
+    assert cache.prune() == (0, 0)
+    cache.refresh("foo", lambda: ("project", 200, b"new"))
+    # A fresh entry isn't refreshed again
+    cache.refresh("foo", lambda: ("project", 200, b"newer"))
+    assert cache.get("foo").body == b"new"
+    clock.now += 91
+    assert cache.get("foo") is None
+    assert cache.prune()[0] == 1
+
+
+def test_lru_eviction(tmp_path):
+    # Use a fixed clock so that all entries are the same size
+    cache = ResponseCache(tmp_path, max_size=0, clock=FakeClock())
+    cache.put("project", "a", b"a" * 1000)
+    size = cache.entry_path("a").stat().st_size
+    cache.max_size = 2 * size
+    cache.put("project", "b", b"b" * 1000)
+    cache.put("project", "c", b"c" * 1000)
+    for i, key in enumerate("acb"):
+        os.utime(cache.entry_path(key), (i, i))
+    cache.get("a")
+    removed, _ = cache.prune()
+    assert removed == 1
+    assert cache.get("a") is not None
+    assert cache.get("b") is not None
+    assert cache.get("c") is None
+
+
+def test_lock_files_bounded(tmp_path, monkeypatch):
+    monkeypatch.setattr("qypi.cache.LOCK_STRIPES", 8)
+    cache = ResponseCache(tmp_path)
+    for i in range(50):
+        cache.get_or_fetch(f"key{i}", lambda: ("project", 200, b"data"))
+    assert list(cache.entries_dir.glob("*/*.lock")) == []
+    assert len(list(cache.locks_dir.iterdir())) <= 8
+    assert cache.stats()["entries"] == 50
+    assert cache.clear()[0] == 50
+    assert list(cache.entries_dir.glob("*/*")) == []
+
+
+def test_compressed(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put("version", "foo/1.0", b"x" * 100_000)
+    assert cache.entry_path("foo/1.0").stat().st_size < 1000
+
+
+def test_corrupt_entry(tmp_path):
+    cache = ResponseCache(tmp_path)
+    cache.put("project", "foo", b"data")
+    cache.entry_path("foo").write_bytes(b"garbage")
+    assert cache.get("foo") is None
+    assert cache.prune()[0] == 1
+
+
+def test_cli_cache(mock_pypi_json, tmp_path):
+    args = ["--cache", "--cache-dir", str(tmp_path), "info", "foobar"]
+    r1 = CliRunner().invoke(qypi, args)
+    assert r1.exit_code == 0, show_result(r1)
+    calls = len(mock_pypi_json.calls)
+    assert calls == 1
+    r2 = CliRunner().invoke(qypi, [*args[:-1], "FooBar"])
+    assert r2.exit_code == 0, show_result(r2)
+    assert r2.output == r1.output
+    assert len(mock_pypi_json.calls) == calls
+    r = CliRunner().invoke(qypi, ["--cache-dir", str(tmp_path), "cache", "stats"])
+    assert r.exit_code == 0, show_result(r)
+    stats = json.loads(r.output)
+    assert stats["entries"] == 1
+    assert stats["kinds"] == {"project": {"entries": 1, "size": stats["size"]}}
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == 0.5
+    assert stats["bytes_saved"] > 0
+    r = CliRunner().invoke(qypi, ["--cache-dir", str(tmp_path), "cache", "clear"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)["removed"] == 1
+    assert ResponseCache(tmp_path).stats()["entries"] == 0
+
+
+def test_cli_unknown_ttl_kind(tmp_path):
+    r = CliRunner().invoke(
+        qypi, ["--cache-dir", str(tmp_path), "--cache-ttl", "projet=5", "list"]
+    )
+    assert r.exit_code == 2, show_result(r)
+    assert "'projet': unknown kind" in r.stderr
+
+
+def test_cli_stale_while_revalidate(mock_pypi_json, tmp_path):
+    base = ["--cache", "--cache-dir", str(tmp_path), "--cache-ttl", "project=0"]
+    swr = ["--stale-while-revalidate", "3600"]
+    r1 = CliRunner().invoke(qypi, [*base, *swr, "info", "foobar"])
+    assert r1.exit_code == 0, show_result(r1)
+    assert len(mock_pypi_json.calls) == 1
+    r2 = CliRunner().invoke(qypi, [*base, *swr, "--timings", "info", "foobar"])
+    assert r2.exit_code == 0, show_result(r2)
+    assert r2.stdout == r1.stdout
+    assert "stale" in r2.stderr.splitlines()[0]
+    assert "cache hits: 1 (1 stale), misses: 0" in r2.stderr
+    # The entry was refreshed in the background before exiting
+    assert len(mock_pypi_json.calls) == 2
+    # Without --stale-while-revalidate, the TTL is strict.
+    r3 = CliRunner().invoke(qypi, [*base, "info", "foobar"])
+    assert r3.exit_code == 0, show_result(r3)
+    assert len(mock_pypi_json.calls) == 3
+
+
+def test_cli_no_cache(mock_pypi_json, tmp_path):
+    args = ["--cache-dir", str(tmp_path), "info", "foobar"]
+    for _ in range(2):
+        r = CliRunner().invoke(qypi, args)
+        assert r.exit_code == 0, show_result(r)
+    assert len(mock_pypi_json.calls) == 2
+    assert not (tmp_path / "entries").exists()
+
+
+def test_cli_revalidation_reported(mock_pypi_json, tmp_path):
+    base = ["--cache", "--cache-dir", str(tmp_path), "--cache-ttl", "project=0"]
+    base += ["--stale-while-revalidate", "3600"]
+    r = CliRunner().invoke(qypi, [*base, "info", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    metrics_file = tmp_path / "qypi.prom"
+    r = CliRunner().invoke(
+        qypi,
+        [*base, "--hedge", "--timings", "--metrics-file", str(metrics_file)]
+        + ["info", "foobar"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert len(mock_pypi_json.calls) == 2
+    # The background revalidation finished before the run was summarized.
+    assert "[timings] requests: 1, hedged: 0" in r.stderr
+    metrics = metrics_file.read_text().splitlines()
+    assert 'qypi_requests_total{api="json",status="200"} 1' in metrics
+
+
+def test_cli_cache_list(mocker, tmp_path):
+    spinstance = mocker.Mock(**{"list_packages.return_value": ["foo", "bar"]})
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    for _ in range(2):
+        r = CliRunner().invoke(qypi, ["--cache", "--cache-dir", str(tmp_path), "list"])
+        assert r.exit_code == 0, show_result(r)
+        assert r.output == "foo\nbar\n"
+    assert spinstance.method_calls == [mocker.call.list_packages()]
+
+
+def test_cli_missing(mock_pypi_json, tmp_path):
+    args = ["--cache", "--cache-dir", str(tmp_path), "info"]
+    r = CliRunner().invoke(
+        qypi, [*args, "does-not-exist", "Does_Not_Exist", "does-not-exist==1.0"]
+    )
+    assert r.exit_code == 1, show_result(r)
+    assert r.stderr == (
+        "qypi: does-not-exist: package not found\n"
+        "qypi: Does_Not_Exist: package not found\n"
+        "qypi: does-not-exist: version 1.0 not found\n"
+    )
+    assert len(mock_pypi_json.calls) == 1
+    r = CliRunner().invoke(qypi, [*args, "does-not-exist"])
+    assert r.exit_code == 1, show_result(r)
+    assert r.stderr == "qypi: does-not-exist: package not found\n"
+    assert len(mock_pypi_json.calls) == 1
+    r = CliRunner().invoke(
+        qypi, [*args[:-1], "--cache-ttl", "missing=0", "info", "does-not-exist"]
+    )
+    assert r.exit_code == 1, show_result(r)
+    assert len(mock_pypi_json.calls) == 2
+
+
+def test_prefetch(mock_pypi_json, tmp_path):
+    specs = tmp_path / "specs.txt"
+    specs.write_text("# Comment\nhas-prerel\n\nnullfields\n")
+    base = ["--cache", "--cache-dir", str(tmp_path / "cache")]
+    r = CliRunner().invoke(
+        qypi,
+        [*base, "-j", "2", "prefetch", "-f", str(specs), "foobar==0.1.0", "nope"],
+    )
+    assert r.exit_code == 1, show_result(r)
+    assert r.stderr == (
+        "[1/4] foobar==0.1.0: ok\n"
+        "[2/4] nope: error\n"
+        "[3/4] has-prerel: ok\n"
+        "[4/4] nullfields: ok\n"
+        "qypi: nope: package not found\n"
+    )
+    summary = json.loads(r.stdout)
+    assert summary["packages"] == 4
+    assert summary["bytes_received"] > 0
+    calls = len(mock_pypi_json.calls)
+    for cmd in ["info", "files", "releases"]:
+        foobar = "foobar" if cmd == "releases" else "foobar==0.1.0"
+        r = CliRunner().invoke(qypi, [*base, cmd, foobar, "has-prerel", "nullfields"])
+        assert r.exit_code == 0, show_result(r)
+    assert len(mock_pypi_json.calls) == calls
+
+
+def test_prefetch_requires_cache(tmp_path):
+    r = CliRunner().invoke(qypi, ["--cache-dir", str(tmp_path), "prefetch", "foo"])
+    assert r.exit_code == 2
+    assert "prefetch requires caching" in r.stderr
+
+
+def stress_worker(cache_dir, fetch_dir, keys, barrier):
+    cache = ResponseCache(cache_dir)
+    random.shuffle(keys)
+    barrier.wait()
+    for key in keys:
+
+        def fetch(key=key):
+            with open(fetch_dir / f"{key}-{os.getpid()}", "x"):
+                pass
+            time.sleep(0.01)
+            return ("project", 200, key.encode("utf-8") * 1000)
+
+        entry = cache.get_or_fetch(key, fetch)
+        assert entry.body == key.encode("utf-8") * 1000
+    cache.close()
+
+
+def test_multiprocess_stress(tmp_path):
+    cache_dir = tmp_path / "cache"
+    fetch_dir = tmp_path / "fetches"
+    fetch_dir.mkdir()
+    keys = [f"key{i}" for i in range(25)]
+    nprocs = 8
+    mp = multiprocessing.get_context("spawn")
+    barrier = mp.Barrier(nprocs)
+    procs = [
+        mp.Process(
+            target=stress_worker, args=(cache_dir, fetch_dir, list(keys), barrier)
+        )
+        for _ in range(nprocs)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert [p.exitcode for p in procs] == [0] * nprocs
+    # Each key was fetched exactly once across all processes:
+    fetched = sorted(p.name.rpartition("-")[0] for p in fetch_dir.iterdir())
+    assert fetched == sorted(keys)
+    stats = ResponseCache(cache_dir).stats()
+    assert stats["entries"] == len(keys)
+    assert stats["misses"] == len(keys)
+    assert stats["hits"] == len(keys) * (nprocs - 1)
+
+
+def test_xmlrpc_cache_key():
+    base = "https://pypi.org/pypi"
+    assert xmlrpc_cache_key(base, "list_packages", ()) == base + "#list_packages"
+    assert xmlrpc_cache_key(base, "package_roles", ("Foo_Bar",)) == (
+        base + '#package_roles["foo-bar"]'
+    )
+    assert xmlrpc_cache_key(base, "browse", (("B", "A", "B"),)) == xmlrpc_cache_key(
+        base, "browse", (["A", "B"],)
+    )
+    assert xmlrpc_cache_key(
+        base, "search", ({"name": ["y", "x"], "summary": ["z"]}, "AND")
+    ) == xmlrpc_cache_key(
+        base, "search", ({"summary": ["z"], "name": ["x", "y"]}, "and")
+    )
+    assert xmlrpc_cache_key(base, "user_packages", ("Alice",)) != xmlrpc_cache_key(
+        base, "user_packages", ("alice",)
+    )
+
+
+def test_cli_cache_xmlrpc(mocker, tmp_path):
+    spinstance = mocker.Mock(
+        **{
+            "package_roles.return_value": [["Owner", "alice"]],
+            "browse.return_value": [["foobar", "1.0.0"]],
+            "changelog_last_serial.return_value": 42,
+        }
+    )
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    args = ["--cache", "--cache-dir", str(tmp_path)]
+    for cmd in [
+        ["owner", "Foo_Bar", "foo-bar"],
+        ["owner", "FOO.BAR"],
+        ["browse", "Topic :: B", "Topic :: A"],
+        ["browse", "Topic :: A", "Topic :: B"],
+        ["watch", "--state-file", str(tmp_path / "serial")],
+        ["watch", "--state-file", str(tmp_path / "serial2")],
+    ]:
+        r = CliRunner().invoke(qypi, [*args, *cmd])
+        assert r.exit_code == 0, show_result(r)
+    assert spinstance.method_calls == [
+        mocker.call.package_roles("Foo_Bar"),
+        mocker.call.browse(("Topic :: B", "Topic :: A")),
+        mocker.call.changelog_last_serial(),
+        mocker.call.changelog_last_serial(),
+    ]
+    r = CliRunner().invoke(qypi, [*args, "--cache-ttl", "roles=0", "owner", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == {"foobar": [{"role": "Owner", "user": "alice"}]}
+    assert spinstance.method_calls[-1] == mocker.call.package_roles("foobar")
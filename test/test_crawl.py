@@ -0,0 +1,147 @@
+import gzip
+import json
+import pickle
+from click.testing import CliRunner
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import QyPI
+from qypi.cache import ResponseCache
+from qypi.crawl import in_shard
+from qypi.hedge import Hedger
+
+NAMES = ["foobar", "has-prerel", "nullfields", "prerelease-only", "does-not-exist"]
+
+CRAWLED = ["Prerelease.Only", "foobar", "has_prerel", "nullfields"]
+
+
+def read_parts(outdir, stem="shard-1-of-1"):
+    docs = []
+    for p in sorted(outdir.glob(f"{stem}-part-*.jsonl.gz")):
+        with gzip.open(p, "rt") as fp:
+            docs.extend(json.loads(line) for line in fp)
+    return docs
+
+
+def test_in_shard():
+    names = [f"project-{i}" for i in range(200)]
+    shards = [[n for n in names if in_shard(n, k, 4)] for k in range(1, 5)]
+    assert sorted(sum(shards, [])) == sorted(names)
+    assert all(shards)
+    assert in_shard("Foo_Bar", 2, 3) == in_shard("foo-bar", 2, 3)
+
+
+def test_crawl_and_resume(mock_pypi_json, tmp_path):
+    names_file = tmp_path / "names.txt"
+    names_file.write_text("\n".join(NAMES) + "\n")
+    outdir = tmp_path / "out"
+    args = ["crawl", "-f", str(names_file), "-o", str(outdir), "-P", "1"]
+    r = CliRunner().invoke(qypi, [*args, "--batch-size", "2"])
+    assert r.exit_code == 1, show_result(r)
+    assert json.loads(r.stdout) == {
+        "shard": "1/1",
+        "projects": 5,
+        "skipped": 0,
+        "crawled": 4,
+        "not_found": 1,
+        "errors": 0,
+        "parts": 2,
+    }
+    assert r.stderr == (
+        "[crawl 1/1] 2/5 projects\n"
+        "[crawl 1/1] 4/5 projects\n"
+        "[crawl 1/1] 5/5 projects\n"
+        "qypi: does-not-exist: package not found\n"
+    )
+    docs = read_parts(outdir)
+    assert sorted(d["info"]["name"] for d in docs) == CRAWLED
+    calls = len(mock_pypi_json.calls)
+    r = CliRunner().invoke(qypi, args)
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.stdout)["skipped"] == 5
+    assert json.loads(r.stdout)["parts"] == 0
+    assert len(mock_pypi_json.calls) == calls
+    assert len(read_parts(outdir)) == 4
+
+
+def test_crawl_removes_orphaned_parts(mock_pypi_json, tmp_path):
+    names_file = tmp_path / "names.txt"
+    names_file.write_text("foobar\nnullfields\n")
+    outdir = tmp_path / "out"
+    outdir.mkdir()
+    orphan = outdir / "shard-1-of-1-part-00000.jsonl.gz"
+    orphan.write_bytes(b"partial")
+    r = CliRunner().invoke(
+        qypi, ["crawl", "-f", str(names_file), "-o", str(outdir), "-P", "1"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert len(read_parts(outdir)) == 2
+    assert len(mock_pypi_json.calls) == 2
+
+
+def test_crawl_shards(mock_pypi_json, tmp_path):
+    names_file = tmp_path / "names.txt"
+    names_file.write_text("\n".join(NAMES[:4]) + "\n")
+    outdir = tmp_path / "out"
+    crawled = []
+    for k in (1, 2, 3):
+        r = CliRunner().invoke(
+            qypi,
+            ["crawl", "-f", str(names_file), "-o", str(outdir), "-P", "1"]
+            + ["--shard", f"{k}/3"],
+        )
+        assert r.exit_code == 0, show_result(r)
+        crawled.extend(d["info"]["name"] for d in read_parts(outdir, f"shard-{k}-of-3"))
+    assert sorted(crawled) == CRAWLED
+    assert len(mock_pypi_json.calls) == 4
+
+
+def test_crawl_bad_shard():
+    r = CliRunner().invoke(qypi, ["crawl", "--shard", "4/3"])
+    assert r.exit_code == 2
+    assert "K must be between 1 and N" in r.stderr
+
+
+def test_crawl_processes(tmp_path):
+    # Worker processes can't see the mock index, so serve everything from a
+    # prepopulated cache instead.
+    cache_dir = tmp_path / "cache"
+    cache = ResponseCache(cache_dir)
+    obj = QyPI("https://pypi.org/pypi", cache=cache)
+    for name in ["foo", "bar", "baz"]:
+        doc = {"info": {"name": name}, "releases": {}}
+        cache.put("project", obj.cache_key(name, "json"), json.dumps(doc).encode())
+    names_file = tmp_path / "names.txt"
+    names_file.write_text("foo\nbar\nbaz\n")
+    outdir = tmp_path / "out"
+    r = CliRunner().invoke(
+        qypi,
+        ["--cache", "--cache-dir", str(cache_dir)]
+        + ["--metrics-file", str(tmp_path / "metrics.prom"), "crawl"]
+        + ["-f", str(names_file), "-o", str(outdir), "-P", "2"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert sorted(d["info"]["name"] for d in read_parts(outdir)) == [
+        "bar",
+        "baz",
+        "foo",
+    ]
+    # The workers' cache hits are reported by the parent.
+    metrics = (tmp_path / "metrics.prom").read_text().splitlines()
+    assert "qypi_cache_hits_total 3" in metrics
+    assert ResponseCache(cache_dir).stats()["hits"] == 3
+
+
+def test_pickle_qypi(tmp_path):
+    obj = QyPI(
+        ["https://pypi.org/pypi", "https://internal.test/pypi"],
+        cache=ResponseCache(tmp_path),
+        hedger=Hedger(),
+        jobs=4,
+    )
+    obj.map(str, [1, 2])
+    obj2 = pickle.loads(pickle.dumps(obj))
+    assert obj2.index_urls == obj.index_urls
+    assert obj2.jobs == 4
+    assert obj2.cache.path == tmp_path
+    assert obj2.executor is None
+    assert list(obj2.map(str, [1, 2])) == ["1", "2"]
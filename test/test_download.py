@@ -0,0 +1,117 @@
+import hashlib
+import json
+import re
+from click.testing import CliRunner
+import pytest
+import responses
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import QyPI, QyPIError
+from qypi.download import Downloader
+
+URL = "https://files.example.nil/packages/foo-1.0.tar.gz"
+CONTENT = bytes(range(256)) * 1000
+
+
+def file_info(content=CONTENT):
+    return {
+        "filename": "foo-1.0.tar.gz",
+        "url": URL,
+        "size": len(content),
+        "digests": {"sha256": hashlib.sha256(content).hexdigest()},
+    }
+
+
+def serve_ranges(request):
+    rng = request.headers.get("Range")
+    if rng is None:
+        return (200, {}, CONTENT)
+    start = int(rng.removeprefix("bytes=").rstrip("-"))
+    if start >= len(CONTENT):
+        return (416, {}, b"")
+    return (
+        206,
+        {"Content-Range": f"bytes {start}-{len(CONTENT) - 1}/{len(CONTENT)}"},
+        CONTENT[start:],
+    )
+
+
+@pytest.fixture
+def file_server():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(responses.GET, URL, callback=serve_ranges)
+        yield rsps
+
+
+def test_download(file_server, tmp_path):
+    dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+    assert dl.download(file_info()) == {
+        "filename": "foo-1.0.tar.gz",
+        "path": str(tmp_path / "foo-1.0.tar.gz"),
+        "size": len(CONTENT),
+        "status": "downloaded",
+    }
+    assert (tmp_path / "foo-1.0.tar.gz").read_bytes() == CONTENT
+    assert not (tmp_path / "foo-1.0.tar.gz.part").exists()
+    assert dl.download(file_info())["status"] == "skipped"
+    assert len(file_server.calls) == 1
+
+
+def test_download_resume(file_server, tmp_path):
+    (tmp_path / "foo-1.0.tar.gz.part").write_bytes(CONTENT[:1000])
+    dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+    assert dl.download(file_info())["status"] == "resumed"
+    assert file_server.calls[0].request.headers["Range"] == "bytes=1000-"
+    assert (tmp_path / "foo-1.0.tar.gz").read_bytes() == CONTENT
+
+
+@pytest.mark.usefixtures("file_server")
+def test_download_resume_complete_part(tmp_path):
+    (tmp_path / "foo-1.0.tar.gz.part").write_bytes(CONTENT)
+    dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+    assert dl.download(file_info())["status"] == "resumed"
+    assert (tmp_path / "foo-1.0.tar.gz").read_bytes() == CONTENT
+
+
+def test_download_range_ignored(tmp_path):
+    (tmp_path / "foo-1.0.tar.gz.part").write_bytes(b"garbage")
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, URL, body=CONTENT)
+        dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+        assert dl.download(file_info())["status"] == "downloaded"
+    assert (tmp_path / "foo-1.0.tar.gz").read_bytes() == CONTENT
+
+
+@pytest.mark.usefixtures("file_server")
+def test_download_bad_digest(tmp_path):
+    (tmp_path / "foo-1.0.tar.gz").write_bytes(b"stale")
+    dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+    with pytest.raises(QyPIError, match="SHA256 mismatch"):
+        dl.download(file_info(b"something else"))
+    assert not (tmp_path / "foo-1.0.tar.gz.part").exists()
+    assert (tmp_path / "foo-1.0.tar.gz").read_bytes() == b"stale"
+
+
+def test_download_bad_filename(tmp_path):
+    dl = Downloader(QyPI("https://pypi.org/pypi"), tmp_path)
+    with pytest.raises(QyPIError, match="refusing to write"):
+        dl.download(dict(file_info(), filename="../foo-1.0.tar.gz"))
+
+
+def test_cli_download(mock_pypi_json, tmp_path):
+    mock_pypi_json.add(
+        responses.GET,
+        re.compile(r"https://files\.dummyhosted\.nil/.*"),
+        body=b"not a wheel",
+    )
+    r = CliRunner().invoke(
+        qypi,
+        ["download", "-d", str(tmp_path), "--where", "packagetype == sdist", "foobar"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == []
+    r = CliRunner().invoke(qypi, ["download", "-d", str(tmp_path), "foobar"])
+    assert r.exit_code == 1, show_result(r)
+    assert json.loads(r.stdout) == []
+    assert "foobar-1.0.0-py2.py3-none-any.whl: SHA256 mismatch" in r.stderr
+    assert list(tmp_path.iterdir()) == []
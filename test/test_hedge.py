@@ -0,0 +1,244 @@
+import re
+import time
+from types import SimpleNamespace
+from click.testing import CliRunner
+from conftest import mkresponse
+import pytest
+import responses
+from test_api import internal_response
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.cache import ResponseCache
+from qypi.hedge import Hedger
+
+
+def slow(value, delay):
+    def func():
+        time.sleep(delay)
+        return value
+
+    return func
+
+
+def fail(delay=0):
+    def func():
+        time.sleep(delay)
+        raise ValueError("nope")
+
+    return func
+
+
+def test_no_hedge_when_fast():
+    h = Hedger(initial_delay=0.5)
+    assert h.call(slow("a", 0), slow("b", 0)) == ("a", "direct")
+    assert (h.requests, h.hedged, h.hedge_wins) == (1, 0, 0)
+    h.shutdown()
+
+
+def test_hedge_wins():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    assert h.call(slow("a", 0.5), slow("b", 0)) == ("b", "hedge-won")
+    assert (h.requests, h.hedged, h.hedge_wins) == (1, 1, 1)
+    h.shutdown()
+
+
+def test_hedge_primary_wins():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    assert h.call(slow("a", 0.05), slow("b", 0.5)) == ("a", "hedged")
+    assert (h.requests, h.hedged, h.hedge_wins) == (1, 1, 0)
+    h.shutdown()
+
+
+def test_hedge_primary_fails():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    assert h.call(fail(0.05), slow("b", 0.1)) == ("b", "hedge-won")
+    h.shutdown()
+
+
+def test_no_hedge_on_fast_failure():
+    h = Hedger(initial_delay=0.5, max_rate=1)
+    with pytest.raises(ValueError, match="nope"):
+        h.call(fail(), slow("b", 0))
+    assert h.hedged == 0
+    h.shutdown()
+
+
+def test_hedge_both_fail():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    with pytest.raises(ValueError, match="nope"):
+        h.call(fail(0.05), fail())
+    h.shutdown()
+
+
+def test_hedge_unacceptable_result():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    assert h.call(slow("a", 0.1), slow("b", 0), accept=lambda r: r == "ok") == (
+        "a",
+        "hedged",
+    )
+    assert h.hedge_wins == 0
+    h.shutdown()
+
+
+def test_hedge_unacceptable_result_primary_fails():
+    h = Hedger(initial_delay=0.01, max_rate=1)
+    with pytest.raises(ValueError, match="nope"):
+        h.call(fail(0.05), slow("b", 0), accept=lambda r: r == "ok")
+    h.shutdown()
+
+
+def test_hedge_rate_capped():
+    h = Hedger(initial_delay=0.01, max_rate=0.5)
+    results = [h.call(slow("a", 0.03), slow("b", 0))[1] for _ in range(4)]
+    assert results == ["direct", "hedge-won", "direct", "hedge-won"]
+    assert h.hedge_rate == 0.5
+    h.shutdown()
+
+
+def test_delay_percentile():
+    h = Hedger(percentile=90, initial_delay=5, min_samples=10)
+    for i in range(9):
+        h.latencies.append(i / 10)
+    assert h.delay() == 5
+    h.latencies.append(0.9)
+    assert h.delay() == pytest.approx(0.8)
+
+
+def test_cli_hedge_url():
+    def slow_response(r):
+        time.sleep(0.5)
+        return mkresponse(r)
+
+    def mirror_response(r):
+        url = r.url.replace("https://mirror.test/", "https://pypi.org/")
+        return mkresponse(SimpleNamespace(url=url))
+
+    # The slow primary request may still be running when the mock is torn
+    # down.
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=slow_response,
+            content_type="application/json",
+        )
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://mirror\.test/"),
+            callback=mirror_response,
+            content_type="application/json",
+        )
+        r = CliRunner().invoke(
+            qypi,
+            [
+                "--hedge",
+                "--hedge-url",
+                "https://mirror.test/pypi",
+                "--hedge-delay",
+                "0.05",
+                "--hedge-max-rate",
+                "1",
+                "--timings",
+                "info",
+                "foobar",
+            ],
+        )
+    assert r.exit_code == 0, show_result(r)
+    assert '"name": "foobar"' in r.stdout
+    lines = r.stderr.splitlines()
+    assert len(lines) == 2
+    assert re.fullmatch(
+        r"\[timings\] GET https://mirror\.test/pypi/foobar/json 200 [0-9.]+s"
+        r" hedge-won",
+        lines[0],
+    )
+    assert re.fullmatch(
+        r"\[timings\] requests: 1, hedged: 1 \(100\.0%\), hedges won: 1,"
+        r" hedge delay: 0\.050s",
+        lines[1],
+    )
+
+
+def test_cli_hedge_url_not_found(tmp_path):
+    def slow_response(r):
+        time.sleep(0.3)
+        return mkresponse(r)
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://pypi\.org/"),
+            callback=slow_response,
+            content_type="application/json",
+        )
+        rsps.add(responses.GET, re.compile(r"^https://mirror\.test/"), status=404)
+        r = CliRunner().invoke(
+            qypi,
+            [
+                "--cache",
+                "--cache-dir",
+                str(tmp_path),
+                "--hedge",
+                "--hedge-url",
+                "https://mirror.test/pypi",
+                "--hedge-delay",
+                "0.05",
+                "--hedge-max-rate",
+                "1",
+                "info",
+                "foobar",
+            ],
+        )
+    assert r.exit_code == 0, show_result(r)
+    assert '"name": "foobar"' in r.stdout
+    assert ResponseCache(tmp_path).stats()["kinds"].keys() == {"project"}
+
+
+def test_cli_hedge_url_primary_only():
+    def slow_response(callback):
+        def wrapped(r):
+            time.sleep(0.3)
+            return callback(r)
+
+        return wrapped
+
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://(pypi\.org|mirror\.test)/"),
+            callback=slow_response(mkresponse),
+            content_type="application/json",
+        )
+        rsps.add_callback(
+            responses.GET,
+            re.compile(r"^https://internal\.test/"),
+            callback=slow_response(internal_response),
+            content_type="application/json",
+        )
+        r = CliRunner().invoke(
+            qypi,
+            [
+                "-i",
+                "https://pypi.org/pypi",
+                "-i",
+                "https://internal.test/pypi",
+                "--index-policy",
+                "merge",
+                "--hedge",
+                "--hedge-url",
+                "https://mirror.test/pypi",
+                "--hedge-delay",
+                "0.05",
+                "--hedge-max-rate",
+                "1",
+                "releases",
+                "foobar",
+            ],
+        )
+        # Let the losing requests finish so that they're recorded.
+        time.sleep(0.4)
+        hosts = sorted(c.request.url.split("/")[2] for c in rsps.calls)
+    assert r.exit_code == 0, show_result(r)
+    # Requests to the internal index are duplicated to the internal index,
+    # not to the primary index's mirror.
+    assert hosts == ["internal.test", "internal.test", "mirror.test", "pypi.org"]
@@ -0,0 +1,167 @@
+import gzip
+import json
+from click.testing import CliRunner
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.index import (
+    OfflineIndex,
+    field_terms,
+    iter_bits,
+    pack_bitset,
+    read_documents,
+    unpack_bitset,
+)
+
+DOCUMENTS = [
+    {
+        "info": {
+            "name": "foo-bar",
+            "version": "1.0",
+            "summary": "Frobnicate the bar",
+            "keywords": "frob,bar",
+            "description": "Lorem ipsum",
+            "classifiers": ["Typing :: Typed"],
+        }
+    },
+    {
+        "info": {
+            "name": "baz",
+            "version": "2.0",
+            "summary": "Bar none",
+            "keywords": None,
+            "description": "Frob, frob, frob",
+            "classifiers": [],
+        }
+    },
+    {
+        "info": {
+            "name": "Quux",
+            "version": "0.1",
+            "summary": "Nothing",
+            "description": "",
+            "classifiers": ["Typing :: Typed", "Topic :: Utilities"],
+        }
+    },
+    {"info": {"name": "Foo_Bar", "version": "0.1", "summary": "Duplicate"}},
+]
+
+
+@pytest.fixture
+def crawl_dir(tmp_path):
+    d = tmp_path / "crawl"
+    d.mkdir()
+    with gzip.open(d / "shard-1-of-1-part-00000.jsonl.gz", "wt") as fp:
+        for doc in DOCUMENTS[:2]:
+            print(json.dumps(doc), file=fp)
+    with open(d / "shard-1-of-1-part-00001.jsonl", "w") as fp:
+        for doc in DOCUMENTS[2:]:
+            print(json.dumps(doc), file=fp)
+    return d
+
+
+def test_field_terms():
+    assert field_terms("name", {"name": "Foo_Bar"}) == {
+        "foo": 1,
+        "bar": 1,
+        "foobar": 1,
+    }
+    assert field_terms("classifiers", {"classifiers": ["Typing :: Typed"]}) == {
+        "typing": 1,
+        "typed": 1,
+    }
+    assert field_terms("keywords", {"keywords": None}) == {}
+
+
+def test_build_search(crawl_dir, tmp_path):
+    stats = OfflineIndex.build(tmp_path / "index.db", read_documents([crawl_dir]))
+    assert stats["projects"] == 3
+    assert stats["duplicates"] == 1
+    index = OfflineIndex(tmp_path / "index.db")
+    assert [r["name"] for r in index.search({"summary": ["bar"]})] == [
+        "baz",
+        "foo-bar",
+    ]
+    assert index.search({"summary": ["bar"], "keywords": ["frob"]}) == [
+        {"name": "foo-bar", "version": "1.0", "summary": "Frobnicate the bar"}
+    ]
+    assert [
+        r["name"]
+        for r in index.search({"name": ["foobar"], "description": ["frob"]}, "or")
+    ] == ["foo-bar", "baz"]
+    assert index.search({"summary": ["bar nothing"]}) == []
+    index.close()
+
+
+def test_cli_offline_search(crawl_dir, tmp_path):
+    base = ["--offline-index", str(tmp_path / "index.db")]
+    r = CliRunner().invoke(qypi, [*base, "index", "build", str(crawl_dir)])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)["projects"] == 3
+    r = CliRunner().invoke(
+        qypi, [*base, "search", "--offline", "--or", "name:foobar", "frob"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {"name": "foo-bar", "version": "1.0", "summary": "Frobnicate the bar"},
+        {"name": "baz", "version": "2.0", "summary": "Bar none"},
+    ]
+    r = CliRunner().invoke(qypi, [*base, "search", "--offline", "author:me"])
+    assert r.exit_code == 2
+    assert "author: field is not covered by the offline index" in r.stderr
+
+
+def test_bitset():
+    ids = [0, 3, 8, 9, 1000]
+    bits = unpack_bitset(pack_bitset(ids))
+    assert bits == sum(1 << i for i in ids)
+    assert list(iter_bits(bits)) == ids
+    assert list(iter_bits(unpack_bitset(pack_bitset([])))) == []
+
+
+def test_cli_offline_browse(crawl_dir, tmp_path):
+    base = ["--offline-index", str(tmp_path / "index.db")]
+    r = CliRunner().invoke(qypi, [*base, "index", "build", str(crawl_dir)])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)["classifiers"] == 2
+    r = CliRunner().invoke(qypi, [*base, "browse", "--offline", "Typing :: Typed"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {"name": "foo-bar", "version": "1.0"},
+        {"name": "Quux", "version": "0.1"},
+    ]
+    clfile = tmp_path / "classifiers.txt"
+    clfile.write_text("Topic :: Utilities\n")
+    r = CliRunner().invoke(
+        qypi,
+        [*base, "browse", "--offline", "-p", "-f", str(clfile), "Typing :: Typed"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "Quux", "version": "0.1"}]
+    r = CliRunner().invoke(
+        qypi, [*base, "browse", "--offline", "Typing :: Typed", "Nonexistent"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == []
+
+
+def test_cli_offline_search_no_index(tmp_path):
+    r = CliRunner().invoke(
+        qypi, ["--cache-dir", str(tmp_path), "search", "--offline", "foo"]
+    )
+    assert r.exit_code == 2
+    assert "offline index not found" in r.stderr
+
+
+def test_cli_build_from_cache(mock_pypi_json, tmp_path):
+    base = ["--cache-dir", str(tmp_path)]
+    r = CliRunner().invoke(qypi, [*base, "--cache", "info", "foobar", "nullfields"])
+    assert r.exit_code == 0, show_result(r)
+    r = CliRunner().invoke(qypi, [*base, "index", "build", "--from-cache"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output)["projects"] == 2
+    assert (tmp_path / "offline-index.db").exists()
+    r = CliRunner().invoke(qypi, [*base, "search", "--offline", "name:nullfields"])
+    assert r.exit_code == 0, show_result(r)
+    assert [d["name"] for d in json.loads(r.output)] == ["nullfields"]
+    assert len(mock_pypi_json.calls) == 2
@@ -0,0 +1,108 @@
+import json
+from click.testing import CliRunner
+from conftest import DATA_DIR
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import select_latest
+from qypi.latest import LatestIndex
+
+BASE = "https://pypi.org/pypi"
+
+
+class FakeXMLRPC:
+    def __init__(self, last_serial=100, changes=()):
+        self.last_serial = last_serial
+        self.changes = list(changes)
+        self.calls = []
+
+    def __call__(self, method, *args):
+        self.calls.append((method, *args))
+        if method == "changelog_last_serial":
+            return self.last_serial
+        elif method == "changelog_since_serial":
+            return [c for c in self.changes if c[-1] > args[0]]
+        else:
+            raise AssertionError(method)
+
+
+def load_project(name):
+    with open(DATA_DIR / f"{name}.json") as fp:
+        data = json.load(fp)
+    return {"releases": {v: about["files"] for v, about in data.items()}}
+
+
+@pytest.mark.parametrize("name", ["foobar", "has-prerel", "prerelease-only"])
+@pytest.mark.parametrize("pre", [False, True])
+@pytest.mark.parametrize("newest", [False, True])
+def test_lookup_matches_select_latest(tmp_path, name, pre, newest):
+    index = LatestIndex(tmp_path / "latest.db")
+    index.sync(BASE, FakeXMLRPC())
+    pkg = load_project(name)
+    index.record(BASE, name, pkg, index.clock())
+    assert index.lookup(BASE, name, pre=pre, newest=newest) == select_latest(
+        pkg, pre=pre, newest=newest
+    )
+    index.close()
+
+
+def test_record_before_sync(tmp_path):
+    clock_time = [1000.0]
+    index = LatestIndex(tmp_path / "latest.db", clock=lambda: clock_time[0])
+    pkg = load_project("foobar")
+    index.record(BASE, "foobar", pkg, 1000.0)
+    assert index.lookup(BASE, "foobar") is None
+    index.sync(BASE, FakeXMLRPC())
+    index.record(BASE, "foobar", pkg, 999.0)
+    assert index.lookup(BASE, "foobar") is None
+    index.record(BASE, "foobar", pkg, 1000.0)
+    assert index.lookup(BASE, "foobar") == "1.0.0"
+    index.close()
+
+
+def test_sync(tmp_path):
+    clock_time = [1000.0]
+    index = LatestIndex(tmp_path / "latest.db", clock=lambda: clock_time[0])
+    xmlrpc = FakeXMLRPC(
+        changes=[
+            ("FooBar", "2.0.0", 0, "new release", 101),
+            ("FooBar", "2.1.0rc1", 0, "new release", 102),
+            ("has_prerel", "1.0.0", 0, "add source file has_prerel-1.0.tar.gz", 103),
+        ]
+    )
+    assert index.sync(BASE, xmlrpc) == 0
+    assert not index.needs_sync(BASE)
+    for name in ["foobar", "has-prerel"]:
+        index.record(BASE, name, load_project(name), 1000.0)
+    clock_time[0] += 61
+    assert index.needs_sync(BASE)
+    assert index.sync(BASE, xmlrpc) == 3
+    assert xmlrpc.calls[-1] == ("changelog_since_serial", 100)
+    assert index.synced(BASE) == (103, 1061.0)
+    assert index.lookup(BASE, "foobar") == "2.0.0"
+    assert index.lookup(BASE, "foobar", pre=True) == "2.1.0rc1"
+    # The new releases have no files yet.
+    assert index.lookup(BASE, "foobar", newest=True) == "1.0.0"
+    assert index.lookup(BASE, "has-prerel") is None
+    index.close()
+
+
+def test_cli_latest_index(mocker, mock_pypi_json, tmp_path):
+    spinstance = mocker.Mock(
+        **{
+            "changelog_last_serial.return_value": 100,
+            "changelog_since_serial.return_value": [],
+        }
+    )
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    args = ["--cache-dir", str(tmp_path), "--latest-index", "info", "foobar"]
+    r1 = CliRunner().invoke(qypi, args)
+    assert r1.exit_code == 0, show_result(r1)
+    r2 = CliRunner().invoke(qypi, args)
+    assert r2.exit_code == 0, show_result(r2)
+    assert r2.output == r1.output
+    assert [c.request.url for c in mock_pypi_json.calls] == [
+        "https://pypi.org/pypi/foobar/json",
+        "https://pypi.org/pypi/foobar/1.0.0/json",
+    ]
+    assert (tmp_path / "latest-index.db").exists()
@@ -0,0 +1,152 @@
+import json
+import re
+import threading
+import time
+from click.testing import CliRunner
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.limiter import AdaptiveLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(limiter, clock, latency, overloaded=False):
+    started = limiter.acquire()
+    clock.now += latency
+    limiter.release(started, overloaded=overloaded)
+
+
+def test_grows_while_latency_flat():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=5, clock=clock)
+    assert limiter.current == 1
+    for _ in range(20):
+        run(limiter, clock, 0.1)
+    # One request at a time only uses at least half of a limit of up to 2.
+    assert limiter.current == 3
+    assert (limiter.low, limiter.high, limiter.cutbacks) == (1, 3, 0)
+
+
+def test_capped_at_max():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(min_limit=4, max_limit=5, clock=clock)
+    for _ in range(10):
+        started = [limiter.acquire() for _ in range(limiter.current)]
+        clock.now += 0.1
+        for s in started:
+            limiter.release(s)
+    assert limiter.current == 5
+
+
+def test_cut_back_on_overload():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=20, initial=16, clock=clock)
+    started = [limiter.acquire() for _ in range(4)]
+    clock.now += 0.1
+    limiter.release(started[0], overloaded=True)
+    assert limiter.current == 8
+    # Requests sent under the old limit don't cut it back further.
+    limiter.release(started[1], overloaded=True)
+    limiter.release(started[2], overloaded=True)
+    assert limiter.current == 8
+    run(limiter, clock, 0.1, overloaded=True)
+    assert limiter.current == 4
+    assert limiter.cutbacks == 2
+    limiter.release(started[3])
+    for _ in range(4):
+        run(limiter, clock, 0.1, overloaded=True)
+    assert limiter.current == 1
+    assert limiter.low == 1
+
+
+def test_cut_back_on_rising_latency():
+    clock = FakeClock()
+    limiter = AdaptiveLimiter(
+        min_limit=1, max_limit=20, initial=8, min_samples=5, clock=clock
+    )
+    for _ in range(5):
+        run(limiter, clock, 0.1)
+    assert limiter.cutbacks == 0
+    for _ in range(2):
+        run(limiter, clock, 0.5)
+    assert limiter.cutbacks == 1
+    assert limiter.current == 4
+    for _ in range(5):
+        run(limiter, clock, 0.1)
+    assert limiter.cutbacks == 1
+
+
+def test_call():
+    limiter = AdaptiveLimiter(min_limit=1, max_limit=10, initial=4)
+    assert limiter.call(lambda: 503, overloaded=lambda s: s >= 500) == 503
+    assert limiter.current == 2
+
+    def fail():
+        raise ValueError("nope")
+
+    with pytest.raises(ValueError, match="nope"):
+        limiter.call(fail, failed=lambda e: not isinstance(e, ValueError))
+    assert limiter.cutbacks == 1
+    assert limiter.inflight == 0
+
+
+def test_limits_concurrency():
+    limiter = AdaptiveLimiter(min_limit=2, max_limit=2)
+    active = []
+    peak = []
+    lock = threading.Lock()
+
+    def work():
+        with lock:
+            active.append(None)
+            peak.append(len(active))
+        time.sleep(0.02)
+        with lock:
+            active.pop()
+
+    threads = [threading.Thread(target=limiter.call, args=(work,)) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert max(peak) == 2
+    assert limiter.requests == 6
+    assert limiter.wait_time > 0
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_cli_adaptive_jobs():
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "--adaptive-jobs",
+            "-j",
+            "4",
+            "--timings",
+            "info",
+            "foobar",
+            "has-prerel",
+        ],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert [p["name"] for p in json.loads(r.stdout)] == ["foobar", "has_prerel"]
+    assert re.fullmatch(
+        r"\[timings\] concurrency limit: [1-4] \(ranged 1-[1-4]\), cutbacks: [0-9]+,"
+        r" throttled: [0-9.]+s",
+        r.stderr.splitlines()[-1],
+    )
+
+
+def test_cli_min_jobs_too_high():
+    r = CliRunner().invoke(
+        qypi, ["--adaptive-jobs", "--min-jobs", "3", "-j", "2", "info", "foobar"]
+    )
+    assert r.exit_code == 2
+    assert "--min-jobs cannot be greater than --jobs" in r.stderr
@@ -30,7 +30,7 @@ def test_list(mocker):
     assert r.output == (
         "foobar\n" "BarFoo\n" "quux\n" "Gnusto-Cleesh\n" "XYZZY_PLUGH\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [mocker.call.list_packages()]
 
 
@@ -60,7 +60,7 @@ def test_owner(mocker):
         "    ]\n"
         "}\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [mocker.call.package_roles("foobar")]
 
 
@@ -106,7 +106,7 @@ def test_multiple_owner(mocker):
         "    ]\n"
         "}\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [
         mocker.call.package_roles("foobar"),
         mocker.call.package_roles("Glarch"),
@@ -139,7 +139,7 @@ def test_owned(mocker):
         "    ]\n"
         "}\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [mocker.call.user_packages("luser")]
 
 
@@ -185,7 +185,7 @@ def test_multiple_owned(mocker):
         "    ]\n"
         "}\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [
         mocker.call.user_packages("luser"),
         mocker.call.user_packages("jsmith"),
@@ -239,7 +239,7 @@ def test_search(mocker):
         "    }\n"
         "]\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [
         mocker.call.search(
             {"description": ["term", "bar"], "keywords": ["foo"]},
@@ -295,7 +295,7 @@ def test_browse(mocker):
         "    }\n"
         "]\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [
         mocker.call.browse(("Typing :: Typed", "Topic :: Utilities"))
     ]
@@ -336,7 +336,7 @@ def test_browse_packages(mocker):
         "    }\n"
         "]\n"
     )
-    spclass.assert_called_once_with("https://pypi.org/pypi")
+    spclass.assert_called_once_with("https://pypi.org/pypi", transport=mocker.ANY)
     assert spinstance.method_calls == [
         mocker.call.browse(("Typing :: Typed", "Topic :: Utilities"))
     ]
@@ -855,4 +855,67 @@ def test_releases():
     )
 
 
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_info_fields():
+    r = CliRunner().invoke(
+        qypi, ["info", "-F", "name,version", "--fields", "people", "foobar"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {
+            "name": "foobar",
+            "people": [
+                {
+                    "email": "megan30@daniels.info",
+                    "name": "Brandon Perkins",
+                    "role": "author",
+                },
+                {
+                    "email": "cspencer@paul-fisher.com",
+                    "name": "Denise Adkins",
+                    "role": "maintainer",
+                },
+            ],
+            "version": "1.0.0",
+        }
+    ]
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_files_fields():
+    r = CliRunner().invoke(qypi, ["files", "-F", "filename,size", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {
+            "files": [{"filename": "foobar-1.0.0-py2.py3-none-any.whl", "size": 735}],
+            "name": "foobar",
+            "version": "1.0.0",
+        }
+    ]
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_releases_fields():
+    r = CliRunner().invoke(qypi, ["releases", "-F", "version", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == {
+        "foobar": [{"version": "0.1.0"}, {"version": "0.2.0"}, {"version": "1.0.0"}]
+    }
+
+
+def test_search_fields(mocker):
+    spinstance = mocker.Mock(
+        **{
+            "search.return_value": [
+                {"name": "foobar", "version": "1.2.3", "summary": ""},
+                {"name": "foobar", "version": "1.3.0", "summary": "Foo"},
+            ],
+        }
+    )
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    r = CliRunner().invoke(qypi, ["search", "-p", "-F", "version,summary", "foo"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"summary": "Foo", "version": "1.3.0"}]
+
+
 # `qypi --index-url`
@@ -0,0 +1,280 @@
+import hashlib
+import json
+import re
+from click.testing import CliRunner
+from conftest import mkresponse, urlre
+import pytest
+import requests
+import responses
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.metadata import SIMPLE_JSON, metadata_files, parse_core_metadata, simple_url
+
+METADATA = b"""\
+Metadata-Version: 2.1
+Name: foobar
+Version: 1.0.0
+Summary: Lorem ipsum dolor sit amet
+Requires-Python: >=3.8
+Requires-Dist: requests (>=2.20)
+Requires-Dist: click ; extra == 'cli'
+Provides-Extra: cli
+Project-URL: Source, https://github.com/example/foobar
+Classifier: Programming Language :: Python :: 3
+
+Long description
+"""
+
+WHEEL_URL = "https://files.dummyhosted.nil/packages/foobar-1.0.0-py2.py3-none-any.whl"
+
+
+def simple_page(core_metadata):
+    return {
+        "meta": {"api-version": "1.1"},
+        "name": "foobar",
+        "files": [
+            {
+                "filename": "foobar-0.1.0.tar.gz",
+                "url": "https://files.dummyhosted.nil/packages/foobar-0.1.0.tar.gz",
+                "hashes": {},
+                "core-metadata": True,
+            },
+            {
+                "filename": "foobar-1.0.0.tar.gz",
+                "url": "../../packages/foobar-1.0.0.tar.gz",
+                "hashes": {},
+            },
+            {
+                "filename": "foobar-1.0.0-py2.py3-none-any.whl",
+                "url": WHEEL_URL,
+                "hashes": {},
+                "core-metadata": core_metadata,
+            },
+        ],
+    }
+
+
+def test_simple_url():
+    assert simple_url("https://pypi.org/pypi") == "https://pypi.org/simple"
+    assert simple_url("https://test.pypi.org/pypi/") == "https://test.pypi.org/simple"
+    assert simple_url("https://example.com/json") is None
+
+
+def test_metadata_files():
+    page = simple_page({"sha256": "abc"})
+    assert [f["filename"] for f in metadata_files(page, "1.0")] == [
+        "foobar-1.0.0-py2.py3-none-any.whl"
+    ]
+    assert [f["filename"] for f in metadata_files(page, "0.1.0")] == [
+        "foobar-0.1.0.tar.gz"
+    ]
+    assert metadata_files(simple_page(False), "1.0.0") == []
+
+
+def test_parse_core_metadata():
+    info = parse_core_metadata(METADATA)
+    assert info["name"] == "foobar"
+    assert info["requires_python"] == ">=3.8"
+    assert info["requires_dist"] == ["requests (>=2.20)", "click ; extra == 'cli'"]
+    assert info["provides_extra"] == ["cli"]
+    assert info["project_urls"] == {"Source": "https://github.com/example/foobar"}
+    assert info["classifiers"] == ["Programming Language :: Python :: 3"]
+    assert info["description"] == "Long description\n"
+    assert info["author"] is None
+
+
+@pytest.fixture
+def mock_pypi_simple():
+    with responses.RequestsMock(assert_all_requests_are_fired=False) as rsps:
+        rsps.add_callback(
+            responses.GET,
+            urlre,
+            callback=mkresponse,
+            content_type="application/json",
+        )
+        yield rsps
+
+
+@pytest.mark.parametrize(
+    "core_metadata",
+    [True, {"sha256": hashlib.sha256(METADATA).hexdigest()}],
+)
+def test_info_core_metadata(mock_pypi_simple, core_metadata):
+    mock_pypi_simple.add(
+        responses.GET,
+        "https://pypi.org/simple/foobar/",
+        json=simple_page(core_metadata),
+        content_type=SIMPLE_JSON,
+        match=[
+            responses.matchers.header_matcher(
+                {"Accept": "application/vnd.pypi.simple.v1+json"}
+            )
+        ],
+    )
+    mock_pypi_simple.add(responses.GET, WHEEL_URL + ".metadata", body=METADATA)
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "info",
+            "--simple-metadata",
+            "-F",
+            "name,requires_dist,requires_python",
+            "foobar==1.0.0",
+        ],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {
+            "name": "foobar",
+            "requires_dist": ["requests (>=2.20)", "click ; extra == 'cli'"],
+            "requires_python": ">=3.8",
+        }
+    ]
+    assert [c.request.url for c in mock_pypi_simple.calls] == [
+        "https://pypi.org/simple/foobar/",
+        WHEEL_URL + ".metadata",
+    ]
+
+
+def test_info_core_metadata_bad_digest(mock_pypi_simple):
+    mock_pypi_simple.add(
+        responses.GET,
+        "https://pypi.org/simple/foobar/",
+        json=simple_page({"sha256": "0" * 64}),
+        content_type=SIMPLE_JSON,
+    )
+    mock_pypi_simple.add(responses.GET, WHEEL_URL + ".metadata", body=METADATA)
+    r = CliRunner().invoke(
+        qypi, ["info", "--simple-metadata", "-F", "requires_dist", "foobar==1.0.0"]
+    )
+    assert r.exit_code == 1, show_result(r)
+    assert "foobar-1.0.0-py2.py3-none-any.whl.metadata: SHA256 mismatch" in r.stderr
+
+
+def test_info_core_metadata_fallback(mock_pypi_simple):
+    mock_pypi_simple.add(
+        responses.GET,
+        "https://pypi.org/simple/foobar/",
+        json=simple_page(False),
+        content_type=SIMPLE_JSON,
+    )
+    r = CliRunner().invoke(
+        qypi, ["info", "--simple-metadata", "-F", "name,version", "foobar==1.0.0"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "foobar", "version": "1.0.0"}]
+    assert [c.request.url for c in mock_pypi_simple.calls] == [
+        "https://pypi.org/simple/foobar/",
+        "https://pypi.org/pypi/foobar/1.0.0/json",
+    ]
+
+
+@pytest.mark.usefixtures("mock_pypi_simple")
+def test_info_release_date_skips_metadata():
+    r = CliRunner().invoke(qypi, ["info", "-F", "release_date", "foobar==1.0.0"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"release_date": "2019-02-01T09:17:59.172284Z"}]
+
+
+@pytest.mark.parametrize(
+    "simple_response",
+    [
+        {"body": "<html><body></body></html>", "content_type": "text/html"},
+        {"body": "not JSON", "content_type": SIMPLE_JSON},
+        {"status": 500},
+        {"body": requests.ConnectionError("nope")},
+    ],
+)
+def test_info_core_metadata_simple_unusable(mock_pypi_simple, simple_response):
+    mock_pypi_simple.add(
+        responses.GET, "https://pypi.org/simple/foobar/", **simple_response
+    )
+    r = CliRunner().invoke(
+        qypi, ["info", "--simple-metadata", "-F", "name", "foobar==0.2.0"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "foobar"}]
+    assert mock_pypi_simple.calls[-1].request.url == (
+        "https://pypi.org/pypi/foobar/0.2.0/json"
+    )
+
+
+def test_info_core_metadata_fetch_fails(mock_pypi_simple):
+    mock_pypi_simple.add(
+        responses.GET,
+        "https://pypi.org/simple/foobar/",
+        json=simple_page(True),
+        content_type=SIMPLE_JSON,
+    )
+    mock_pypi_simple.add(responses.GET, WHEEL_URL + ".metadata", status=503)
+    r = CliRunner().invoke(
+        qypi, ["info", "--simple-metadata", "-F", "name", "foobar==1.0.0"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "foobar"}]
+    assert mock_pypi_simple.calls[-1].request.url == (
+        "https://pypi.org/pypi/foobar/1.0.0/json"
+    )
+
+
+def test_info_core_metadata_pinned_skips_simple(mock_pypi_simple):
+    r = CliRunner().invoke(qypi, ["info", "-F", "name", "foobar==1.0.0"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "foobar"}]
+    assert [c.request.url for c in mock_pypi_simple.calls] == [
+        "https://pypi.org/pypi/foobar/1.0.0/json"
+    ]
+
+
+def test_info_core_metadata_cached_simple(mock_pypi_simple, tmp_path):
+    mock_pypi_simple.add(
+        responses.GET,
+        "https://pypi.org/simple/foobar/",
+        json=simple_page(True),
+        content_type=SIMPLE_JSON,
+    )
+    mock_pypi_simple.add(responses.GET, WHEEL_URL + ".metadata", body=METADATA)
+    sdist_url = "https://files.dummyhosted.nil/packages/foobar-0.1.0.tar.gz"
+    mock_pypi_simple.add(
+        responses.GET,
+        sdist_url + ".metadata",
+        body=METADATA.replace(b"Version: 1.0.0", b"Version: 0.1.0"),
+    )
+    args = ["--cache", "--cache-dir", str(tmp_path), "info", "-F", "name,version"]
+    r = CliRunner().invoke(qypi, [*args, "--simple-metadata", "foobar==1.0.0"])
+    assert r.exit_code == 0, show_result(r)
+    mock_pypi_simple.calls.reset()
+    # The Simple API page is used without --simple-metadata once it's cached.
+    r = CliRunner().invoke(qypi, [*args, "foobar==0.1.0"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [{"name": "foobar", "version": "0.1.0"}]
+    assert [c.request.url for c in mock_pypi_simple.calls] == [sdist_url + ".metadata"]
+
+
+def test_info_core_metadata_from_project(mock_pypi_simple):
+    wheel_url = (
+        "https://files.dummyhosted.nil/packages/ac/62/c3a61adf1cc9b1e3ec63ba06706"
+        "d3f7af3e1ef389b97523e2b529fbe5432/foobar-0.1.0-py2.py3-none-any.whl"
+    )
+    mock_pypi_simple.add(
+        responses.GET,
+        wheel_url + ".metadata",
+        body=METADATA.replace(b"Version: 1.0.0", b"Version: 0.1.0"),
+    )
+    mock_pypi_simple.add(
+        responses.GET, re.compile(r".*foobar-0\.2\.0.*\.metadata$"), status=404
+    )
+    r = CliRunner().invoke(qypi, ["info", "-A", "-F", "name,version", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {"name": "foobar", "version": "0.1.0"},
+        {"name": "foobar", "version": "0.2.0"},
+        {"name": "foobar", "version": "1.0.0"},
+    ]
+    urls = [c.request.url for c in mock_pypi_simple.calls]
+    assert urls[0] == "https://pypi.org/pypi/foobar/json"
+    assert urls[1] == wheel_url + ".metadata"
+    assert urls[2].endswith("foobar-0.2.0-py2.py3-none-any.whl.metadata")
+    # The version document is fetched after a 404 for the metadata file.
+    assert urls[3:] == ["https://pypi.org/pypi/foobar/0.2.0/json"]
+    assert not any("/simple/" in u for u in urls)
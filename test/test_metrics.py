@@ -0,0 +1,95 @@
+import pickle
+from urllib.request import urlopen
+from click.testing import CliRunner
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.metrics import Metrics, MetricsExporter
+
+
+def test_render():
+    metrics = Metrics()
+    metrics.observe("json", 200, 0.02, bytes_in=100, bytes_out=10)
+    metrics.observe("json", 404, 0.5)
+    metrics.observe("xmlrpc", "ok", 70)
+    text = metrics.render([("qypi_errors_total", "counter", "Errors", 3)])
+    lines = text.splitlines()
+    assert 'qypi_requests_total{api="json",status="200"} 1' in lines
+    assert 'qypi_requests_total{api="json",status="404"} 1' in lines
+    assert 'qypi_requests_total{api="xmlrpc",status="ok"} 1' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="json",le="0.01"} 0' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="json",le="0.025"} 1' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="json",le="0.5"} 2' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="xmlrpc",le="60"} 0' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="xmlrpc",le="+Inf"} 1' in lines
+    assert 'qypi_request_duration_seconds_count{api="json"} 2' in lines
+    assert "qypi_received_bytes_total 100" in lines
+    assert "qypi_sent_bytes_total 10" in lines
+    assert "# TYPE qypi_errors_total counter" in lines
+    assert "qypi_errors_total 3" in lines
+
+
+def test_drain_merge():
+    worker = Metrics()
+    worker.observe("json", 200, 0.02, bytes_in=100, bytes_out=10)
+    parent = Metrics()
+    parent.observe("json", 200, 0.5, bytes_in=5)
+    parent.merge(pickle.loads(pickle.dumps(worker.drain())))
+    worker.observe("xmlrpc", "ok", 1)
+    parent.merge(worker.drain())
+    assert worker.drain() == ({}, {}, 0, 0)
+    lines = parent.render().splitlines()
+    assert 'qypi_requests_total{api="json",status="200"} 2' in lines
+    assert 'qypi_requests_total{api="xmlrpc",status="ok"} 1' in lines
+    assert 'qypi_request_duration_seconds_bucket{api="json",le="0.025"} 1' in lines
+    assert 'qypi_request_duration_seconds_count{api="json"} 2' in lines
+    assert "qypi_received_bytes_total 105" in lines
+    assert "qypi_sent_bytes_total 10" in lines
+
+
+def test_cli_metrics_file(mock_pypi_json, tmp_path):
+    path = tmp_path / "qypi.prom"
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "--cache",
+            "--cache-dir",
+            str(tmp_path / "cache"),
+            "--metrics-file",
+            str(path),
+            "info",
+            "foobar",
+            "FooBar",
+            "does-not-exist",
+        ],
+    )
+    assert r.exit_code == 1, show_result(r)
+    lines = path.read_text().splitlines()
+    assert 'qypi_requests_total{api="json",status="200"} 1' in lines
+    assert 'qypi_requests_total{api="json",status="404"} 1' in lines
+    assert "qypi_cache_misses_total 2" in lines
+    assert "qypi_errors_total 1" in lines
+    assert len(mock_pypi_json.calls) == 2
+
+
+def test_cli_metrics_interval_requires_file():
+    r = CliRunner().invoke(qypi, ["--metrics-interval", "5", "list"])
+    assert r.exit_code == 2
+    assert "--metrics-interval requires --metrics-file" in r.stderr
+
+
+def test_exporter_port(tmp_path):
+    metrics = Metrics()
+    metrics.observe("json", 200, 0.1)
+    exporter = MetricsExporter(
+        metrics.render, path=tmp_path / "qypi.prom", interval=0.05, port=0
+    )
+    exporter.start()
+    try:
+        host, port = exporter.server.server_address
+        with urlopen(f"http://{host}:{port}/metrics") as r:
+            assert r.headers["Content-Type"].startswith("text/plain")
+            body = r.read().decode("utf-8")
+    finally:
+        exporter.close()
+    assert 'qypi_requests_total{api="json",status="200"} 1' in body.splitlines()
+    assert (tmp_path / "qypi.prom").read_text() == body
@@ -0,0 +1,57 @@
+import pstats
+import tracemalloc
+from click.testing import CliRunner
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+@pytest.mark.parametrize("jobs", ["1", "4"])
+def test_profile_cprofile(tmp_path, jobs):
+    path = tmp_path / "out.prof"
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "-j",
+            jobs,
+            "--profile",
+            "cprofile",
+            "--profile-output",
+            str(path),
+            "files",
+            "-A",
+            "foobar",
+        ],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert f"[profile] cprofile results written to {path}" in r.stderr
+    stats = pstats.Stats(str(path))
+    # The lazily-consumed lookups were profiled, including when they ran in
+    # worker threads:
+    assert any(func == "resolve_spec" for _, _, func in stats.stats)
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_profile_tracemalloc(tmp_path):
+    path = tmp_path / "out.tracemalloc"
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "--profile",
+            "tracemalloc",
+            "--profile-output",
+            str(path),
+            "--profile-top",
+            "3",
+            "info",
+            "foobar",
+        ],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert not tracemalloc.is_tracing()
+    lines = r.stderr.splitlines()
+    assert lines[0] == f"[profile] tracemalloc results written to {path}"
+    assert lines[1].startswith("Current: ")
+    assert len(lines) == 5
+    assert tracemalloc.Snapshot.load(str(path)).traces
@@ -0,0 +1,108 @@
+import json
+from click.testing import CliRunner
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.api import QyPI
+from qypi.cache import ResponseCache
+from qypi.watch import Watcher, parse_event
+
+CHANGELOG = [
+    ["foobar", "1.1.0", 1700000000, "new release", 101],
+    [
+        "foobar",
+        "1.1.0",
+        1700000001,
+        "add py3 file foobar-1.1.0-py3-none-any.whl",
+        102,
+    ],
+    ["Other_Project", "2.0", 1700000002, "remove file other_project-2.0.tar.gz", 103],
+    ["foobar", None, 1700000003, "add Owner jsmith", 104],
+]
+
+
+def test_parse_event():
+    assert parse_event(*CHANGELOG[1]) == {
+        "serial": 102,
+        "name": "foobar",
+        "version": "1.1.0",
+        "timestamp": "2023-11-14T22:13:21Z",
+        "action": "add py3 file foobar-1.1.0-py3-none-any.whl",
+        "event": "file_added",
+        "python_version": "py3",
+        "filename": "foobar-1.1.0-py3-none-any.whl",
+    }
+    assert parse_event(*CHANGELOG[3])["event"] == "other"
+
+
+def test_watch(mocker, tmp_path):
+    spinstance = mocker.Mock(
+        **{
+            "changelog_last_serial.return_value": 100,
+            "changelog_since_serial.return_value": CHANGELOG,
+        }
+    )
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    args = ["--cache-dir", str(tmp_path), "watch"]
+    r = CliRunner().invoke(qypi, args)
+    assert r.exit_code == 0, show_result(r)
+    assert r.output == ""
+    assert (tmp_path / "watch-serial").read_text() == "100\n"
+    r = CliRunner().invoke(qypi, [*args, "other-project", "FooBar"])
+    assert r.exit_code == 0, show_result(r)
+    events = [json.loads(line) for line in r.output.splitlines()]
+    assert [(e["name"], e["event"]) for e in events] == [
+        ("foobar", "release"),
+        ("foobar", "file_added"),
+        ("Other_Project", "file_removed"),
+    ]
+    spinstance.changelog_since_serial.assert_called_once_with(100)
+    assert (tmp_path / "watch-serial").read_text() == "104\n"
+    r = CliRunner().invoke(qypi, [*args, "--since", "100", "--all-events", "quux"])
+    assert r.exit_code == 0, show_result(r)
+    assert r.output == ""
+    r = CliRunner().invoke(qypi, [*args, "--since", "100", "--all-events", "foobar"])
+    assert r.exit_code == 0, show_result(r)
+    assert len(r.output.splitlines()) == 3
+
+
+def test_watch_invalidate(mocker, tmp_path):
+    spinstance = mocker.Mock(**{"changelog_since_serial.return_value": CHANGELOG[:1]})
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    cache = ResponseCache(tmp_path)
+    qp = QyPI("https://pypi.org/pypi", cache=cache)
+    cache.put("project", qp.cache_key("foobar", "json"), b"{}")
+    cache.put("missing", qp.cache_key("foobar", "1.1.0", "json"), b"", status=404)
+    cache.put("project", qp.cache_key("quux", "json"), b"{}")
+    watcher = Watcher(qp, tmp_path / "state", cache=cache)
+    events = []
+    assert watcher.run(events.append, since=100) == 101
+    assert len(events) == 1
+    assert [e.key for e in cache.entries()] == [qp.cache_key("quux", "json")]
+
+
+def test_watch_follow(mocker, tmp_path):
+    spinstance = mocker.Mock(
+        **{
+            "changelog_since_serial.side_effect": [
+                CHANGELOG[:1],
+                OSError("Connection reset"),
+                CHANGELOG[1:2],
+            ]
+        }
+    )
+    mocker.patch("qypi.api.ServerProxy", return_value=spinstance)
+    (tmp_path / "state").write_text("100\n")
+    watcher = Watcher(QyPI("https://pypi.org/pypi"), tmp_path / "state")
+    events = []
+    sleep = mocker.Mock(side_effect=[None, None, KeyboardInterrupt])
+    try:
+        watcher.run(events.append, follow=True, interval=5, sleep=sleep)
+    except KeyboardInterrupt:
+        pass
+    assert [e["serial"] for e in events] == [101, 102]
+    assert spinstance.changelog_since_serial.call_args_list == [
+        mocker.call(100),
+        mocker.call(101),
+        mocker.call(101),
+    ]
+    assert (tmp_path / "state").read_text() == "102\n"
@@ -0,0 +1,117 @@
+import json
+from click.testing import CliRunner
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.wheels import best_wheel, compatible_platforms, supported_tags
+
+LINUX_WHEEL = "foo-1.0-cp312-cp312-manylinux_2_17_aarch64.manylinux2014_aarch64.whl"
+ABI3_WHEEL = "foo-1.0-cp38-abi3-macosx_10_9_universal2.whl"
+PURE_WHEEL = "foo-1.0-py3-none-any.whl"
+
+
+def test_compatible_platforms():
+    assert compatible_platforms("manylinux2014_x86_64")[:3] == [
+        "manylinux_2_17_x86_64",
+        "manylinux2014_x86_64",
+        "manylinux_2_16_x86_64",
+    ]
+    assert compatible_platforms("musllinux_1_1_aarch64") == [
+        "musllinux_1_1_aarch64",
+        "musllinux_1_0_aarch64",
+        "linux_aarch64",
+    ]
+    assert "macosx_11_0_arm64" in compatible_platforms("macosx_14_0_arm64")
+    assert compatible_platforms("win_amd64") == ["win_amd64"]
+
+
+@pytest.mark.parametrize(
+    "filenames,target,best",
+    [
+        ([LINUX_WHEEL, PURE_WHEEL], "cp312-manylinux_2_28_aarch64", LINUX_WHEEL),
+        ([LINUX_WHEEL, PURE_WHEEL], "cp312-manylinux_2_12_aarch64", PURE_WHEEL),
+        ([LINUX_WHEEL], "cp311-manylinux_2_28_aarch64", None),
+        ([LINUX_WHEEL], "cp312-manylinux_2_28_x86_64", None),
+        ([ABI3_WHEEL], "cp312-macosx_14_0_arm64", ABI3_WHEEL),
+        ([ABI3_WHEEL], "cp37-macosx_14_0_arm64", None),
+        (["foo-1.0.tar.gz", "foo-1.0-bad.whl"], "cp312-win_amd64", None),
+    ],
+)
+def test_best_wheel(filenames, target, best):
+    assert best_wheel([{"filename": f} for f in filenames], target) == best
+
+
+def test_supported_tags_bad_target():
+    with pytest.raises(ValueError):
+        supported_tags("manylinux_2_28_aarch64")
+
+
+def test_wheels(mock_pypi_json):
+    r = CliRunner().invoke(
+        qypi,
+        ["wheels", "-A", "--pre", "-t", "cp312-win_amd64", "has-prerel", "foobar"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {
+            "name": "has_prerel",
+            "version": "1.0.0",
+            "sdist": True,
+            "wheels": {"cp312-win_amd64": None},
+        },
+        {
+            "name": "has_prerel",
+            "version": "1.0.1a1",
+            "sdist": True,
+            "wheels": {"cp312-win_amd64": "has_prerel-1.0.1a1-py2.py3-none-any.whl"},
+        },
+        {
+            "name": "foobar",
+            "version": "0.1.0",
+            "sdist": True,
+            "wheels": {"cp312-win_amd64": "foobar-0.1.0-py2.py3-none-any.whl"},
+        },
+        {
+            "name": "foobar",
+            "version": "0.2.0",
+            "sdist": False,
+            "wheels": {"cp312-win_amd64": "foobar-0.2.0-py2.py3-none-any.whl"},
+        },
+        {
+            "name": "foobar",
+            "version": "1.0.0",
+            "sdist": False,
+            "wheels": {"cp312-win_amd64": "foobar-1.0.0-py2.py3-none-any.whl"},
+        },
+    ]
+    # One request per package, regardless of the number of versions
+    assert len(mock_pypi_json.calls) == 2
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_wheels_table():
+    r = CliRunner().invoke(
+        qypi,
+        [
+            "wheels",
+            "--format=table",
+            "-t",
+            "cp312-win_amd64",
+            "-t",
+            "cp27-win32",
+            "has-prerel",
+            "foobar",
+        ],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert r.output == (
+        "NAME        VERSION  cp312-win_amd64  cp27-win32\n"
+        "has_prerel  1.0.0    sdist            sdist\n"
+        "foobar      1.0.0    wheel            wheel\n"
+    )
+
+
+def test_wheels_bad_target():
+    r = CliRunner().invoke(qypi, ["wheels", "-t", "win_amd64", "foobar"])
+    assert r.exit_code == 2
+    assert "expected a target of the form cpXY-PLATFORM" in r.stderr
@@ -0,0 +1,125 @@
+import json
+from click.testing import CliRunner
+import pytest
+from test_main import show_result
+from qypi.__main__ import qypi
+from qypi.where import Where, WhereError
+
+RECORD = {
+    "name": "foobar",
+    "version": "1.10.0",
+    "size": 735,
+    "yanked": False,
+    "requires_python": ">=3.8",
+    "filename": "foobar-1.10.0-py3-none-any.whl",
+    "upload_time": "2019-02-01T09:17:59",
+    "digests": {"sha256": "abc"},
+    "classifiers": ["Typing :: Typed", "Topic :: Utilities"],
+    "license": None,
+}
+
+
+@pytest.mark.parametrize(
+    "expr,result",
+    [
+        ("name == foobar", True),
+        ("name == 'foo bar'", False),
+        ("name != foobar", False),
+        ("version > 1.9", True),
+        ("version == 1.10", True),
+        ("version < 1.10.0rc1", False),
+        ("size > 1000", False),
+        ("size >= 735", True),
+        ("size < 1e3", True),
+        ("yanked", False),
+        ("not yanked", True),
+        ("yanked == false", True),
+        ("license == null", True),
+        ("license > a", False),
+        ("requires_python allows 3.12", True),
+        ("requires_python allows 3.7", False),
+        ('filename ~ "*.whl"', True),
+        ("upload_time >= 2019-01-01", True),
+        ("upload_time < 2019-01-01 or size == 735", True),
+        ("upload_time < 2019-01-01 and size == 735", False),
+        ("not (name == foobar and yanked)", True),
+        ("digests.sha256 == abc", True),
+        ("classifiers ~ 'Typing :: *'", True),
+        ("classifiers == 'Framework :: Django'", False),
+        ("nonexistent == 42", None),
+        ("nonexistent == 42 or size == 735", True),
+        ("nonexistent == 42 and size == 1", False),
+        ("not nonexistent", None),
+        ("digests.md5 == abc", None),
+    ],
+)
+def test_evaluate(expr, result):
+    assert Where(expr).evaluate(RECORD) is result
+
+
+def test_multiple():
+    where = Where("name == foobar", "size > 1000")
+    assert where.fields == {"name", "size"}
+    assert where.evaluate(RECORD) is False
+
+
+@pytest.mark.parametrize(
+    "expr",
+    ["", "name ==", "name == foo bar", "(name == foo", "and", "name = foo", "'foo'"],
+)
+def test_invalid(expr):
+    with pytest.raises(WhereError):
+        Where(expr)
+
+
+def test_info_where_all_versions(mock_pypi_json):
+    r = CliRunner().invoke(
+        qypi, ["info", "-A", "--where", "release_date >= 2017", "foobar"]
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert [i["version"] for i in json.loads(r.output)] == ["0.2.0", "1.0.0"]
+    # The version document for 0.1.0 is never fetched:
+    assert [c.request.url for c in mock_pypi_json.calls] == [
+        "https://pypi.org/pypi/foobar/json",
+        "https://pypi.org/pypi/foobar/0.2.0/json",
+    ]
+
+
+def test_files_where_all_versions(mock_pypi_json):
+    r = CliRunner().invoke(
+        qypi,
+        ["files", "-A", "--where", "packagetype == sdist", "-F", "filename", "foobar"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == [
+        {
+            "name": "foobar",
+            "version": "0.1.0",
+            "files": [{"filename": "foobar-0.1.0.tar.gz"}],
+        }
+    ]
+    assert [c.request.url for c in mock_pypi_json.calls] == [
+        "https://pypi.org/pypi/foobar/json",
+        "https://pypi.org/pypi/foobar/0.1.0/json",
+    ]
+
+
+@pytest.mark.usefixtures("mock_pypi_json")
+def test_releases_where():
+    r = CliRunner().invoke(
+        qypi,
+        ["releases", "--where", "version >= 0.2", "-F", "release_url", "foobar"],
+    )
+    assert r.exit_code == 0, show_result(r)
+    assert json.loads(r.output) == {
+        "foobar": [
+            {"release_url": "https://dummy.nil/pypi/foobar/0.2.0"},
+            {"release_url": "https://dummy.nil/pypi/foobar/1.0.0"},
+        ]
+    }
+
+
+def test_where_invalid():
+    r = CliRunner().invoke(qypi, ["info", "--where", "name ==", "foobar"])
+    assert r.exit_code == 2
+    assert "unexpected end of expression" in r.stderr